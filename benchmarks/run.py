@@ -0,0 +1,725 @@
+"""
+Benchmarks de PyShare: cargas sintéticas contra la aplicación Flask, en proceso
+(cliente de pruebas de Flask) y por un socket real de localhost.
+
+    python benchmarks/run.py                       # todos los escenarios, ambos transportes
+    python benchmarks/run.py --quick               # tamaños reducidos (un par de minutos)
+    python benchmarks/run.py small_jpegs api_files --transport socket --engine async
+    python benchmarks/run.py --quick --save-baseline
+    python benchmarks/run.py --quick --check       # sale con 1 si hay regresiones o escenarios pedidos sin medir
+
+Cada escenario se ejecuta en un proceso nuevo con su propia carpeta temporal, así
+la CPU y el pico de memoria (RSS) son solo suyos. Se mide el proceso completo:
+servidor y cliente comparten proceso en ambos transportes.
+
+No son tests: los números dependen de la máquina, así que la línea base
+(benchmarks/baseline.json) solo sirve para comparar cambios en el mismo equipo.
+Regenérala con --save-baseline antes de empezar a medir.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource  # no existe en Windows: el RSS máximo no se informa
+except ImportError:
+    resource = None
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / 'baseline.json'
+MB = 1024 * 1024
+
+# Límites sin efecto: el benchmark mide el servidor, no el rate limiting
+UNLIMITED = {
+    'default': {'requests': 10 ** 12, 'window': 60},
+    'upload_chunk': {'bytes': 10 ** 15, 'window': 60},
+    'upload_session_chunk': {'bytes': 10 ** 15, 'window': 60},
+}
+
+
+def encode_multipart(fields, files):
+    """Cuerpo multipart/form-data: files es una lista de (campo, nombre, datos, tipo)"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for field, filename, data, content_type in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; '
+                     f'filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n'.encode())
+        parts.append(data)
+        parts.append(b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def percentile(ordered, fraction):
+    """Percentil por rango más cercano de una lista ya ordenada"""
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class InProcessClient:
+    """Cliente de pruebas de Flask (uno por hilo): mide la aplicación sin red"""
+
+    name = 'inprocess'
+
+    def __init__(self, server):
+        self.app = server.app
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, data=body, headers=headers or {}, buffered=False)
+        try:
+            received = sum(len(block) for block in response.response)
+        finally:
+            response.close()
+        return response.status_code, received
+
+    def close(self):
+        pass
+
+
+class SocketClient:
+    """Conexiones HTTP/1.1 persistentes (una por hilo) contra el servidor real"""
+
+    name = 'socket'
+    READ_SIZE = MB
+
+    def __init__(self, port):
+        self.port = port
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=300)
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def request(self, method, path, body=None, headers=None):
+        for attempt in (0, 1):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                received = 0
+                while True:
+                    block = response.read(self.READ_SIZE)
+                    if not block:
+                        break
+                    received += len(block)
+                if response.getheader('Connection', '').lower() == 'close':
+                    conn.close()
+                    self.local.conn = None
+                return response.status, received
+            except (ConnectionError, http.client.RemoteDisconnected):
+                # Keep-alive cerrado por el servidor entre peticiones: se reintenta una vez
+                conn.close()
+                self.local.conn = None
+                if attempt:
+                    raise
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+
+
+class Load:
+    """Lanza tareas con N hilos y recoge latencias, bytes y errores"""
+
+    def __init__(self, client, concurrency):
+        self.client = client
+        self.concurrency = concurrency
+
+    def run(self, task, items):
+        """task(client, item) -> (status, bytes); devuelve la medida agregada"""
+        latencies = []
+        totals = {'bytes': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def timed(item):
+            start = time.perf_counter()
+            try:
+                status, size = task(self.client, item)
+                failed = status >= 400
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Petición fallida: {e}")
+                size, failed = 0, True
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                totals['bytes'] += size
+                totals['errors'] += failed
+
+        items = list(items)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(timed, items))
+        return self.measurement(latencies, totals['bytes'], totals['errors'], time.perf_counter() - start)
+
+    @staticmethod
+    def measurement(latencies, size, errors, seconds):
+        latencies = sorted(latencies)
+        seconds = max(seconds, 1e-9)
+        return {
+            'requests': len(latencies),
+            'errors': errors,
+            'seconds': round(seconds, 3),
+            'rps': round(len(latencies) / seconds, 1),
+            'mb_s': round(size / MB / seconds, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+            'max_ms': round(latencies[-1] * 1000, 2) if latencies else None,
+        }
+
+
+class Scenario:
+    """
+    Un escenario prepara sus datos antes de arrancar el servidor (prepare) y
+    después lanza la carga (run), devolviendo sus medidas por nombre.
+    """
+
+    name = None
+    description = ''
+    FULL = {}
+    QUICK = {}
+    CONFIG = {}  # claves de configuración propias del escenario
+
+    def __init__(self, quick=False):
+        self.params = dict(self.QUICK if quick else self.FULL)
+
+    def skip_reason(self):
+        """Motivo para no ejecutar el escenario en esta máquina (o None)"""
+        return None
+
+    def prepare(self, folder):
+        pass
+
+    def run(self, bench):
+        raise NotImplementedError
+
+
+class SmallJpegs(Scenario):
+    name = 'small_jpegs'
+    description = 'Muchas fotos JPEG pequeñas por /upload-multiple'
+    FULL = {'files': 3000, 'per_request': 10, 'concurrency': 8}
+    QUICK = {'files': 300, 'per_request': 10, 'concurrency': 4}
+
+    @staticmethod
+    def make_jpegs(count):
+        """JPEG distintos: unas bases de ruido con bytes únicos tras el marcador EOI"""
+        from PIL import Image
+        bases = []
+        for seed in range(8):
+            buffer = io.BytesIO()
+            Image.effect_noise((320, 240), 40 + seed).convert('RGB').save(buffer, 'JPEG', quality=90)
+            bases.append(buffer.getvalue())
+        return [bases[i % len(bases)] + uuid.uuid4().bytes for i in range(count)]
+
+    def run(self, bench):
+        jpegs = self.make_jpegs(self.params['files'])
+        per_request = self.params['per_request']
+        batches = [list(enumerate(jpegs))[i:i + per_request] for i in range(0, len(jpegs), per_request)]
+
+        def upload(client, batch):
+            body, content_type = encode_multipart({}, [
+                ('files', f'IMG_{index:06d}.jpg', data, 'image/jpeg') for index, data in batch
+            ])
+            status, _ = client.request('POST', '/upload-multiple', body, {'Content-Type': content_type})
+            return status, len(body)
+
+        return {'upload': bench.load(self.params['concurrency']).run(upload, batches)}
+
+
+class ChunkedVideos(Scenario):
+    name = 'chunked_videos'
+    description = 'Vídeos grandes por /upload-chunk (protocolo por chunks)'
+    FULL = {'videos': 2, 'size_mb': 2048, 'chunk_mb': 8, 'concurrency': 4}
+    QUICK = {'videos': 2, 'size_mb': 96, 'chunk_mb': 8, 'concurrency': 4}
+
+    def run(self, bench):
+        chunk_size = self.params['chunk_mb'] * MB
+        total_chunks = self.params['size_mb'] // self.params['chunk_mb']
+        base = os.urandom(chunk_size)
+        # Todos los chunks de todos los vídeos van al mismo pool, como hace la página
+        jobs = [(video, index) for video in range(self.params['videos']) for index in range(total_chunks)]
+
+        def send_chunk(client, job):
+            video, index = job
+            data = f'{video:08d}{index:08d}'.encode() + base[16:]  # contenido único por chunk
+            body, content_type = encode_multipart(
+                {'filename': f'VID_{video:04d}.mp4', 'chunkIndex': index, 'totalChunks': total_chunks},
+                [('chunk', 'blob', data, 'application/octet-stream')]
+            )
+            status, _ = client.request('POST', '/upload-chunk', body, {'Content-Type': content_type})
+            return status, len(data)
+
+        result = bench.load(self.params['concurrency']).run(send_chunk, jobs)
+        stored = [p for p in bench.upload_folder.glob('VID_*.mp4') if p.stat().st_size == total_chunks * chunk_size]
+        if len(stored) != self.params['videos']:
+            result['errors'] += self.params['videos'] - len(stored)
+        return {'chunks': result}
+
+
+class HeicBatch(Scenario):
+    name = 'heic_batch'
+    description = 'Lote de HEIC subidos y convertidos a JPG en segundo plano'
+    FULL = {'files': 40, 'width': 4032, 'height': 3024, 'concurrency': 4}
+    QUICK = {'files': 8, 'width': 1600, 'height': 1200, 'concurrency': 2}
+
+    def skip_reason(self):
+        try:
+            import pillow_heif  # noqa: F401
+        except ImportError:
+            return 'pillow_heif no está instalado (sin él no se pueden generar ni convertir HEIC)'
+        return None
+
+    def run(self, bench):
+        import pillow_heif
+        from PIL import Image
+        pillow_heif.register_heif_opener()
+
+        buffer = io.BytesIO()
+        Image.effect_noise((self.params['width'], self.params['height']), 50).convert('RGB').save(buffer, 'HEIF')
+        heic = buffer.getvalue()
+        uploaded_at = {}
+
+        def upload(client, index):
+            name = f'IMG_{index:05d}.heic'
+            body, content_type = encode_multipart({}, [('files', name, heic + uuid.uuid4().bytes, 'image/heic')])
+            status, _ = client.request('POST', '/upload-multiple', body, {'Content-Type': content_type})
+            uploaded_at[name] = time.perf_counter()
+            return status, len(body)
+
+        # Latencia de conversión: desde la respuesta de la subida hasta el JPG listo,
+        # vigilando la cola mientras se sigue subiendo
+        conversions = bench.server.conversions
+        done_at = {}
+        uploads_done = threading.Event()
+
+        def watch():
+            deadline = time.monotonic() + 600
+            while time.monotonic() < deadline:
+                now = time.perf_counter()
+                for name, status in conversions.summary().items():
+                    if status['status'] in ('done', 'error') and name not in done_at:
+                        done_at[name] = (now, status['status'] == 'error')
+                if uploads_done.is_set() and len(done_at) >= len(uploaded_at):
+                    return
+                time.sleep(0.02)
+
+        watcher = threading.Thread(target=watch, daemon=True)
+        watcher.start()
+        start = time.perf_counter()
+        upload_result = bench.load(self.params['concurrency']).run(upload, range(self.params['files']))
+        uploads_done.set()
+        watcher.join()
+        if conversions.executor is not None:
+            conversions.executor.shutdown(wait=True)  # la CPU de los procesos se cuenta al terminar
+
+        latencies = [max(0, done_at[name][0] - uploaded_at[name]) for name in done_at if name in uploaded_at]
+        errors = sum(failed for _, failed in done_at.values()) + len(uploaded_at) - len(done_at)
+        convert_result = Load.measurement(latencies, 0, errors, time.perf_counter() - start)
+        return {'upload': upload_result, 'convert': convert_result}
+
+
+class ApiFiles(Scenario):
+    name = 'api_files'
+    description = '/api/files sobre una carpeta con 100k archivos'
+    FULL = {'files': 100000, 'full_requests': 20, 'page_requests': 1000, 'concurrency': 8}
+    QUICK = {'files': 10000, 'full_requests': 10, 'page_requests': 200, 'concurrency': 4}
+    # Los índices de hashes y metadatos de 100k archivos se construirían en segundo plano durante la medida
+    CONFIG = {'dedup': 'off', 'metadata_index': False}
+
+    def prepare(self, folder):
+        payload = b'\xff\xd8\xff\xe0' + b'\0' * 60
+        start = datetime(2020, 1, 1).timestamp()
+        for i in range(self.params['files']):
+            ext = 'mp4' if i % 10 == 0 else 'jpg'
+            path = folder / f'IMG_{i:06d}.{ext}'
+            path.write_bytes(payload)
+            mtime = start + i * 60
+            os.utime(path, (mtime, mtime))
+
+    def run(self, bench):
+        load = bench.load(self.params['concurrency'])
+        bench.client.request('GET', '/api/files')  # calentamiento: serializa el listado la primera vez
+
+        def full(client, _):
+            return client.request('GET', '/api/files')
+
+        queries = ['sort=name&limit=100', 'type=video&limit=100', 'since=2020-02-01&limit=50',
+                   'sort=size&order=asc&limit=200', 'prefix=IMG_01&limit=100']
+        rng = random.Random(1)
+
+        def page(client, _):
+            query = rng.choice(queries)
+            offset = rng.randrange(0, max(1, self.params['files'] // 2))
+            return client.request('GET', f'/api/files?{query}&offset={offset}')
+
+        # Con ETag: el caso normal cuando la página se refresca sin cambios
+        etag = f'"{bench.server.catalog.etag}"'
+
+        def conditional(client, _):
+            return client.request('GET', '/api/files', headers={'If-None-Match': etag})
+
+        return {
+            'full': load.run(full, range(self.params['full_requests'])),
+            'page': load.run(page, range(self.params['page_requests'])),
+            'not_modified': load.run(conditional, range(self.params['page_requests'])),
+        }
+
+
+class Downloads(Scenario):
+    name = 'downloads'
+    description = 'Descargas concurrentes completas y por rangos de /uploads/<archivo>'
+    FULL = {'files': 4, 'size_mb': 256, 'clients': 16, 'downloads': 64, 'ranges': 2000, 'range_kb': 1024}
+    QUICK = {'files': 4, 'size_mb': 32, 'clients': 8, 'downloads': 16, 'ranges': 200, 'range_kb': 1024}
+
+    def prepare(self, folder):
+        block = os.urandom(MB)
+        for i in range(self.params['files']):
+            with open(folder / f'VID_{i:04d}.mp4', 'wb') as f:
+                for _ in range(self.params['size_mb']):
+                    f.write(block)
+
+    def run(self, bench):
+        load = bench.load(self.params['clients'])
+        files = self.params['files']
+        size = self.params['size_mb'] * MB
+        range_size = self.params['range_kb'] * 1024
+        rng = random.Random(1)
+
+        def full(client, index):
+            return client.request('GET', f'/uploads/VID_{index % files:04d}.mp4')
+
+        def ranged(client, index):
+            start = rng.randrange(0, size - range_size)
+            return client.request('GET', f'/uploads/VID_{index % files:04d}.mp4',
+                                  headers={'Range': f'bytes={start}-{start + range_size - 1}'})
+
+        return {
+            'full': load.run(full, range(self.params['downloads'])),
+            'range': load.run(ranged, range(self.params['ranges'])),
+        }
+
+
+SCENARIOS = {cls.name: cls for cls in (SmallJpegs, ChunkedVideos, HeicBatch, ApiFiles, Downloads)}
+
+
+class Bench:
+    """Servidor PyShare en una carpeta temporal y el cliente del transporte elegido"""
+
+    def __init__(self, workdir, transport, engine, config):
+        self.workdir = Path(workdir)
+        self.upload_folder = self.workdir / 'uploads'
+        self.transport = transport
+        self.engine = engine
+        self.config = config
+        self.server = None
+        self.client = None
+
+    @staticmethod
+    def free_port():
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            return s.getsockname()[1]
+
+    def start(self):
+        from pyshare.core import PyShareServer
+
+        port = self.free_port()
+        config = {
+            'host': '127.0.0.1',
+            'port': port,
+            'upload_dir': str(self.upload_folder),
+            'max_size_mb': 100000,
+            'server_backend': self.engine,
+            'rate_limits': UNLIMITED,
+            **self.config,
+        }
+        start = time.perf_counter()
+        self.server = PyShareServer(config, config_file=str(self.workdir / 'config.json'))
+        startup = time.perf_counter() - start
+
+        if self.transport == 'socket':
+            self.server.server.start()
+            self.server.is_running = True
+            deadline = time.monotonic() + 10
+            while True:
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.05)
+            self.client = SocketClient(port)
+        else:
+            self.client = InProcessClient(self.server)
+        return startup
+
+    def load(self, concurrency):
+        return Load(self.client, concurrency)
+
+    def stop(self):
+        if self.client:
+            self.client.close()
+        if self.server:
+            self.server.shutdown()
+
+
+def cpu_seconds():
+    """CPU de este proceso y de sus hijos ya terminados (conversiones HEIC)"""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KB, macOS en bytes
+    return round(peak / (MB if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_child(args):
+    """Ejecuta un escenario en este proceso y escribe el resultado en --output"""
+    scenario = SCENARIOS[args.child](quick=args.quick)
+    if args.workdir:
+        Path(args.workdir).mkdir(parents=True, exist_ok=True)
+    workdir = Path(tempfile.mkdtemp(prefix=f'pyshare-bench-{scenario.name}-', dir=args.workdir))
+    os.chdir(workdir)  # pyshare.log y config.json quedan en la carpeta temporal
+    bench = Bench(workdir, args.transport, args.engine, scenario.CONFIG)
+    try:
+        bench.upload_folder.mkdir()
+        scenario.prepare(bench.upload_folder)
+        startup = bench.start()
+
+        cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+        measurements = scenario.run(bench)
+        bench.stop()
+        bench = None
+        cpu, wall = cpu_seconds() - cpu_start, time.perf_counter() - wall_start
+
+        result = {
+            'params': scenario.params,
+            'startup_s': round(startup, 3),
+            'cpu_s': round(cpu, 2),
+            'cpu_pct': round(100 * cpu / max(wall, 1e-9), 1),
+            'peak_rss_mb': peak_rss_mb(),
+            'measurements': measurements,
+        }
+    finally:
+        if bench is not None:
+            bench.stop()
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+
+def run_scenario(name, transport, args):
+    """Lanza el escenario en un proceso nuevo; su salida se guarda y solo se muestra si falla"""
+    scenario = SCENARIOS[name](quick=args.quick)
+    reason = scenario.skip_reason()
+    if reason:
+        return {'skipped': reason}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output = Path(tmp) / 'result.json'
+        log_path = Path(tmp) / 'child.log'
+        command = [sys.executable, str(Path(__file__).resolve()), '--child', name,
+                   '--transport', transport, '--engine', args.engine, '--output', str(output)]
+        if args.quick:
+            command.append('--quick')
+        if args.workdir:
+            command += ['--workdir', args.workdir]
+        with open(log_path, 'wb') as log:
+            completed = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT)
+        if completed.returncode != 0 or not output.exists():
+            tail = log_path.read_text(encoding='utf-8', errors='replace').splitlines()[-20:]
+            return {'failed': f'código {completed.returncode}', 'log': tail}
+        return json.loads(output.read_text(encoding='utf-8'))
+
+
+def print_result(key, result):
+    if 'skipped' in result:
+        print(f"{key:<28} omitido: {result['skipped']}")
+        return
+    if 'failed' in result:
+        print(f"{key:<28} FALLÓ ({result['failed']})")
+        for line in result['log']:
+            print(f"    {line}")
+        return
+    print(f"{key:<28} arranque {result['startup_s']}s  CPU {result['cpu_s']}s ({result['cpu_pct']}%)  "
+          f"RSS máx. {result['peak_rss_mb']}MB")
+    for name, m in result['measurements'].items():
+        errors = f"  errores {m['errors']}" if m['errors'] else ''
+        print(f"    {name:<14} {m['requests']:>6} pet.  {m['rps']:>9} pet/s  {m['mb_s']:>8} MB/s  "
+              f"p50 {m['p50_ms']}ms  p99 {m['p99_ms']}ms{errors}")
+
+
+class BaselineComparison:
+    """
+    Compara con la línea base: peor rendimiento (pet/s o MB/s), p99 o RSS máximo
+    más allá de la tolerancia cuentan como regresión.
+    """
+
+    MIN_LATENCY_DELTA_MS = 2  # por debajo, la diferencia es ruido del planificador
+
+    def __init__(self, baseline, tolerance):
+        self.baseline = baseline
+        self.tolerance = tolerance
+        self.regressions = []
+
+    def compare(self, key, result):
+        base = self.baseline.get('results', {}).get(key)
+        if not base or 'measurements' not in base or 'measurements' not in result:
+            return
+        if base.get('params') != result.get('params'):
+            print(f"    (línea base de {key} con otros parámetros; no se compara)")
+            return
+
+        for name, m in result['measurements'].items():
+            b = base['measurements'].get(name)
+            if not b:
+                continue
+            throughput = 'mb_s' if b['mb_s'] else 'rps'
+            if b[throughput] and m[throughput] < b[throughput] * (1 - self.tolerance):
+                self.report(key, name, throughput, b[throughput], m[throughput])
+            if (b['p99_ms'] is not None and m['p99_ms'] is not None
+                    and m['p99_ms'] > b['p99_ms'] * (1 + self.tolerance)
+                    and m['p99_ms'] - b['p99_ms'] > self.MIN_LATENCY_DELTA_MS):
+                self.report(key, name, 'p99_ms', b['p99_ms'], m['p99_ms'])
+            if m['errors'] > b['errors']:
+                self.report(key, name, 'errors', b['errors'], m['errors'])
+
+        if base.get('peak_rss_mb') and result.get('peak_rss_mb'):
+            if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + self.tolerance):
+                self.report(key, '-', 'peak_rss_mb', base['peak_rss_mb'], result['peak_rss_mb'])
+
+    def report(self, key, name, metric, before, now):
+        change = f"{(now - before) / before * 100:+.0f}%" if before else 'nuevo'
+        self.regressions.append(f"{key} {name} {metric}: {before} -> {now} ({change})")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Benchmarks de subida y descarga de PyShare')
+    parser.add_argument('scenarios', nargs='*', metavar='escenario',
+                        help=f"Escenarios a ejecutar (por defecto todos): {', '.join(SCENARIOS)}")
+    parser.add_argument('--transport', choices=('inprocess', 'socket', 'both'), default='both',
+                        help='Cliente de pruebas de Flask, socket real de localhost o ambos')
+    parser.add_argument('--engine', choices=('pooled', 'waitress', 'async'), default='pooled',
+                        help='Motor HTTP para el transporte socket')
+    parser.add_argument('--quick', action='store_true', help='Tamaños reducidos')
+    parser.add_argument('--workdir', help='Carpeta para los archivos temporales (los vídeos ocupan varios GB)')
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help='Archivo de línea base')
+    parser.add_argument('--save-baseline', action='store_true', help='Guarda los resultados como línea base')
+    parser.add_argument('--check', action='store_true', help='Sale con código 1 si hay regresiones o escenarios pedidos sin medir')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Margen antes de marcar regresión (0.15 = 15%%)')
+    parser.add_argument('--json', dest='json_output', help='Guarda también los resultados en este archivo')
+    # Uso interno: ejecución de un escenario en el proceso hijo
+    parser.add_argument('--child', choices=list(SCENARIOS), help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"escenario desconocido: {', '.join(unknown)}")
+    if args.child:
+        run_child(args)
+        return 0
+
+    names = args.scenarios or list(SCENARIOS)
+    transports = ('inprocess', 'socket') if args.transport == 'both' else (args.transport,)
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text(encoding='utf-8')) if baseline_path.exists() else {}
+    comparison = BaselineComparison(baseline, args.tolerance)
+
+    results = {}
+    for name in names:
+        for transport in transports:
+            key = f"{name}/{transport}" + (f"/{args.engine}" if transport == 'socket' else '')
+            result = run_scenario(name, transport, args)
+            results[key] = result
+            print_result(key, result)
+            comparison.compare(key, result)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'quick': args.quick,
+        'results': results,
+    }
+    if args.json_output:
+        Path(args.json_output).write_text(json.dumps(report, indent=2), encoding='utf-8')
+
+    # Un escenario que no se ha podido medir no cuenta como "sin regresiones"
+    failed = [key for key, r in results.items() if 'failed' in r]
+    skipped = [key for key, r in results.items() if 'skipped' in r]
+    # Omitir por falta de una dependencia opcional solo cuenta si se pidió el escenario
+    required = [key for key in skipped if key.split('/')[0] in args.scenarios]
+    measured = len(results) - len(failed) - len(skipped)
+
+    if args.save_baseline:
+        # Se conservan los escenarios que no se han vuelto a medir, fallidos u omitidos incluidos
+        merged = {**baseline.get('results', {}),
+                  **{key: r for key, r in results.items() if 'measurements' in r}}
+        baseline_path.write_text(json.dumps({**report, 'results': merged}, indent=2) + '\n', encoding='utf-8')
+        print(f"Línea base guardada en {baseline_path}")
+    elif baseline:
+        if comparison.regressions:
+            print(f"\nRegresiones frente a {baseline_path} (tolerancia {args.tolerance:.0%}):")
+            for line in comparison.regressions:
+                print(f"  {line}")
+        elif measured:
+            print(f"\nSin regresiones frente a {baseline_path}")
+
+    if failed or skipped:
+        print()
+    if failed:
+        print(f"Escenarios fallidos: {', '.join(failed)}")
+    if skipped:
+        print(f"Escenarios omitidos: {', '.join(skipped)}")
+
+    if failed:
+        return 1
+    return 1 if args.check and (comparison.regressions or required or not measured) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,6 @@
+"""
+PyShare: servidor local para pasar fotos y vídeos del móvil al PC.
+
+El núcleo está en pyshare.core y no depende de Tk; app.py añade la interfaz
+gráfica y ``python -m pyshare serve`` arranca solo el servidor.
+"""
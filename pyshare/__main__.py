@@ -0,0 +1,136 @@
+"""
+Línea de comandos de PyShare.
+
+    python -m pyshare serve --port 8730 --upload-dir uploads --workers 32
+    python -m pyshare serve --engine async
+    python -m pyshare gui
+    python -m pyshare migrate-layout --layout date --date-source capture
+
+La configuración se toma de config.json, luego de las variables de entorno
+PYSHARE_* y por último de las opciones de la línea de comandos.
+"""
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+# Variable de entorno -> (clave de configuración, tipo)
+ENV_VARS = {
+    'PYSHARE_HOST': ('host', str),
+    'PYSHARE_PORT': ('port', int),
+    'PYSHARE_UPLOAD_DIR': ('upload_dir', str),
+    'PYSHARE_WORKERS': ('server_threads', int),
+    'PYSHARE_ENGINE': ('server_backend', str),
+    'PYSHARE_MAX_SIZE_MB': ('max_size_mb', float),
+}
+
+
+def build_config(args):
+    """Valores que sobrescriben config.json: primero entorno, después opciones"""
+    config = {}
+    for var, (key, cast) in ENV_VARS.items():
+        if os.environ.get(var):
+            config[key] = cast(os.environ[var])
+    
+    for key in ('host', 'port', 'upload_dir', 'max_size_mb'):
+        value = getattr(args, key, None)
+        if value is not None:
+            config[key] = value
+    if getattr(args, 'workers', None) is not None:
+        config['server_threads'] = args.workers
+    if getattr(args, 'engine', None) is not None:
+        config['server_backend'] = args.engine
+    return config
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m pyshare', description='Servidor de transferencia de fotos')
+    parser.add_argument('--config', default=os.environ.get('PYSHARE_CONFIG', 'config.json'),
+                        help='Archivo de configuración (por defecto config.json)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    serve = commands.add_parser('serve', help='Servidor sin interfaz gráfica')
+    serve.add_argument('--host', help='Dirección de escucha (por defecto 0.0.0.0)')
+    serve.add_argument('--port', type=int, help='Puerto (por defecto 8730)')
+    serve.add_argument('--upload-dir', dest='upload_dir', help='Carpeta de destino (por defecto uploads)')
+    serve.add_argument('--workers', type=int, help='Hilos del servidor HTTP (con async: hilos de E/S)')
+    serve.add_argument('--engine', choices=('pooled', 'waitress', 'async'),
+                       help='Motor HTTP (por defecto pooled; async para muchas conexiones lentas)')
+    serve.add_argument('--max-size-mb', dest='max_size_mb', type=float, help='Tamaño máximo por archivo en MB')
+    
+    commands.add_parser('gui', help='Interfaz gráfica Tk (equivale a python3 app.py)')
+    
+    migrate = commands.add_parser('migrate-layout', help='Reordena en subcarpetas una carpeta de subidas existente')
+    migrate.add_argument('--layout', choices=('flat', 'date', 'hash'),
+                         help='Disposición nueva (por defecto, storage_layout de config.json)')
+    migrate.add_argument('--date-source', dest='date_source', choices=('upload', 'capture'),
+                         help='Con --layout date: fecha de subida o de captura (EXIF/MP4)')
+    migrate.add_argument('--upload-dir', dest='upload_dir', help='Carpeta de subidas (por defecto uploads)')
+    migrate.add_argument('--dry-run', action='store_true', help='Solo muestra qué se movería')
+    return parser
+
+
+def load_config_file(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def migrate_layout(args, config):
+    """Mueve los archivos a la disposición pedida y la deja guardada en config.json"""
+    from pyshare.core import StorageLayout, migrate_layout as migrate
+    
+    saved = load_config_file(args.config)
+    config = {**saved, **config}
+    layout = StorageLayout(args.layout or config.get('storage_layout', 'flat'),
+                           args.date_source or config.get('storage_date', 'upload'))
+    folder = config.get('upload_dir', 'uploads')
+    summary = migrate(folder, layout, dry_run=args.dry_run)
+    
+    verb = 'Se moverían' if args.dry_run else 'Movidos'
+    print(f"{verb} {summary['moved']} archivos a la disposición {layout}; {summary['kept']} ya estaban en su sitio")
+    for path in summary['duplicates']:
+        print(f"Nombre repetido, se deja donde está: {path}")
+    
+    if not args.dry_run:
+        saved.update({'storage_layout': layout.kind, 'storage_date': layout.date_source})
+        with open(args.config, 'w', encoding='utf-8') as f:
+            json.dump(saved, f, indent=2)
+    return 0
+
+
+def load_gui():
+    """Carga app.py desde la raíz del proyecto, sin depender del directorio actual"""
+    import importlib.util
+    path = Path(__file__).resolve().parent.parent / 'app.py'
+    if not path.exists():
+        raise SystemExit(f"No se encuentra la interfaz gráfica: {path}")
+    spec = importlib.util.spec_from_file_location('app', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['app'] = module
+    spec.loader.exec_module(module)
+    return module.PhotoTransferServer
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    config = build_config(args)
+    
+    # Importaciones diferidas: --help no carga Flask y serve nunca carga Tk
+    if args.command == 'serve':
+        from pyshare.core import PyShareServer
+        PyShareServer(config, config_file=args.config).serve()
+    elif args.command == 'migrate-layout':
+        return migrate_layout(args, config)
+    else:
+        PhotoTransferServer = load_gui()
+        PhotoTransferServer(config, config_file=args.config).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
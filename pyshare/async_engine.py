@@ -0,0 +1,620 @@
+"""
+Motor HTTP asyncio alternativo para PyShare (server_backend = 'async').
+
+Cada conexión es una corrutina, no un hilo: una subida lenta por Wi-Fi solo
+ocupa un socket y unos pocos KB de buffer. Las rutas de subida
+(/upload-multiple, /upload-stream) se procesan aquí mismo leyendo el cuerpo por
+bloques con backpressure; el resto de rutas (/api/files, /upload-chunk,
+/uploads/<filename>, ...) se sirven con la misma app Flask, ejecutada en un
+pool de hilos acotado. La E/S de disco y el trabajo de Pillow nunca corren en
+el bucle de eventos.
+"""
+
+import asyncio
+import io
+import json
+import logging
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from werkzeug.sansio.multipart import MultipartDecoder, NEED_DATA, File, Data, Epilogue
+from werkzeug.utils import secure_filename
+
+from pyshare.core import UploadWriter, UploadTooLarge, UploadBusy, SendfileWrapper, ACCESS_LOG
+
+logger = logging.getLogger(__name__)
+
+STATUS_REASONS = {
+    100: 'Continue', 200: 'OK', 201: 'Created', 204: 'No Content', 206: 'Partial Content',
+    304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 408: 'Request Timeout',
+    411: 'Length Required', 413: 'Payload Too Large', 429: 'Too Many Requests',
+    431: 'Request Header Fields Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable',
+}
+
+
+class HTTPError(Exception):
+    """Error de protocolo que se responde al cliente y cierra la conexión"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class BodyReader:
+    """Cuerpo de la petición leído bajo demanda (Content-Length o chunked)"""
+
+    def __init__(self, reader, content_length=None, chunked=False):
+        self.reader = reader
+        self.length = content_length
+        self.remaining = content_length if not chunked else None
+        self.chunked = chunked
+        self._chunk_left = 0
+        self.finished = not chunked and not content_length
+
+    async def read(self, n=65536):
+        """Hasta n bytes; b'' al terminar el cuerpo"""
+        if self.finished:
+            return b''
+        if self.chunked:
+            return await self._read_chunked(n)
+
+        data = await self.reader.read(min(n, self.remaining))
+        if not data:
+            raise HTTPError(400, "Conexión cerrada antes de terminar el cuerpo")
+        self.remaining -= len(data)
+        if self.remaining == 0:
+            self.finished = True
+        return data
+
+    async def _read_chunked(self, n):
+        if self._chunk_left == 0:
+            line = await self.reader.readline()
+            try:
+                size = int(line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise HTTPError(400, "Codificación chunked no válida")
+            if size == 0:
+                # Trailers hasta la línea en blanco
+                while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                self.finished = True
+                return b''
+            self._chunk_left = size
+
+        data = await self.reader.read(min(n, self._chunk_left))
+        if not data:
+            raise HTTPError(400, "Conexión cerrada antes de terminar el cuerpo")
+        self._chunk_left -= len(data)
+        if self._chunk_left == 0:
+            await self.reader.readline()  # CRLF tras cada chunk
+        return data
+
+    async def read_all(self):
+        parts = []
+        while True:
+            data = await self.read()
+            if not data:
+                return b''.join(parts)
+            parts.append(data)
+
+
+class SyncBodyBridge:
+    """
+    wsgi.input para cuerpos grandes: el hilo de la app lee del BodyReader del
+    bucle de eventos según lo necesita, sin cargar el cuerpo en memoria.
+    """
+
+    def __init__(self, body, loop):
+        self.body = body
+        self.loop = loop
+        self._buffer = b''
+
+    def _fetch(self, n):
+        return asyncio.run_coroutine_threadsafe(self.body.read(n), self.loop).result()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self._buffer + asyncio.run_coroutine_threadsafe(self.body.read_all(), self.loop).result()
+            self._buffer = b''
+            return data
+        if self._buffer:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+            return data
+        return self._fetch(size)
+
+    def readline(self, size=-1):
+        while b'\n' not in self._buffer and (size < 0 or len(self._buffer) < size):
+            data = self._fetch(65536)
+            if not data:
+                break
+            self._buffer += data
+        end = self._buffer.find(b'\n') + 1 or len(self._buffer)
+        if size >= 0:
+            end = min(end, size)
+        line, self._buffer = self._buffer[:end], self._buffer[end:]
+        return line
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+class AsyncEngine:
+    """Servidor HTTP/1.1 asyncio con keep-alive y pool de E/S acotado"""
+
+    # Ruta -> nombre de la vista Flask equivalente (para sus límites de peticiones)
+    MULTIPART_ROUTES = {
+        '/upload-multiple': ('upload_multiple', 'files'),
+        '/upload-stream': ('upload_stream_multipart', None),
+    }
+    MAX_HEADER_SIZE = 64 * 1024
+
+    def __init__(self, core, host='0.0.0.0', port=8730, io_workers=32, max_connections=2048,
+                 keepalive_timeout=5, prebuffer_limit=8 * 1024 * 1024, read_buffer=256 * 1024):
+        self.core = core
+        self.app = core.app
+        self.host = host
+        self.port = port
+        self.io_workers = io_workers
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.prebuffer_limit = prebuffer_limit  # cuerpos menores se leen en el bucle antes de ir a la app
+        self.read_buffer = read_buffer
+        self.executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='pyshare-aio')
+        self.loop = None
+        self._stop = None
+        self._stopped = threading.Event()
+        self._connections = set()
+
+        # Abrir el socket ya, para que un puerto ocupado falle en start()
+        self.sock = socket.create_server((host, port), backlog=1024)
+        self.sock.setblocking(False)
+
+    # --- ciclo de vida -------------------------------------------------------
+
+    def serve_forever(self):
+        self._stopped.clear()
+        try:
+            asyncio.run(self._main())
+        finally:
+            self._stopped.set()
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        # Tareas en el pool: trabajando + una cola corta; el resto espera sin hilo
+        self._io_slots = asyncio.Semaphore(self.io_workers * 2)
+        self._connection_slots = asyncio.Semaphore(self.max_connections)
+        server = await asyncio.start_server(self._handle_connection, sock=self.sock, limit=self.read_buffer)
+        async with server:
+            await self._stop.wait()
+            server.close()
+            # Las conexiones abiertas (keep-alive, subidas a medias) se cortan
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+
+    def shutdown(self, timeout=10):
+        """Detiene el bucle y espera a que termine (seguro desde otro hilo)"""
+        if self.loop is not None and self._stop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._stop.set)
+            self._stopped.wait(timeout)
+
+    def server_close(self):
+        try:
+            self.sock.close()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, func, *args):
+        """Ejecuta trabajo bloqueante en el pool acotado"""
+        async with self._io_slots:
+            return await self.loop.run_in_executor(self.executor, func, *args)
+
+    # --- conexiones ----------------------------------------------------------
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        task.add_done_callback(self._connections.discard)
+        async with self._connection_slots:
+            peer = writer.get_extra_info('peername') or ('', 0)
+            # asyncio solo activa TCP_NODELAY si proto == IPPROTO_TCP, y el socket de
+            # create_server tiene proto 0: sin esto, el cuerpo que sale tras la cabecera
+            # espera al ACK retardado del cliente (~40 ms por respuesta con keep-alive)
+            sock = writer.get_extra_info('socket')
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                while True:
+                    try:
+                        request = await asyncio.wait_for(self._read_head(reader), self.keepalive_timeout)
+                    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                        break
+                    except HTTPError as e:
+                        await self._send_json(writer, e.status, {'error': str(e)}, keep_alive=False)
+                        break
+                    if request is None:
+                        break
+                    request['remote_addr'] = peer[0]
+                    if not await self._dispatch(request, reader, writer):
+                        break
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            except asyncio.CancelledError:
+                pass  # parada del servidor: la conexión se cierra sin más
+            except Exception as e:
+                logger.error(f"Error en conexión con {peer[0]}: {e}")
+            finally:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except Exception:
+                    pass
+
+    async def _read_head(self, reader):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.LimitOverrunError:
+            raise HTTPError(431, "Cabeceras demasiado grandes")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial.strip():
+                return None  # el cliente cerró una conexión keep-alive
+            raise
+        if len(head) > self.MAX_HEADER_SIZE:
+            raise HTTPError(431, "Cabeceras demasiado grandes")
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            raise HTTPError(400, "Línea de petición no válida")
+
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, _, value = line.partition(':')
+            name = name.strip().lower()
+            value = value.strip()
+            headers[name] = f"{headers[name]}, {value}" if name in headers else value
+
+        path, _, query = target.partition('?')
+        return {'method': method, 'path': path, 'query': query, 'version': version, 'headers': headers}
+
+    def _wants_keep_alive(self, request):
+        connection = request['headers'].get('connection', '').lower()
+        if request['version'] == 'HTTP/1.0':
+            return 'keep-alive' in connection
+        return 'close' not in connection
+
+    async def _dispatch(self, request, reader, writer):
+        headers = request['headers']
+        chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        try:
+            content_length = int(headers['content-length']) if 'content-length' in headers else None
+        except ValueError:
+            await self._send_json(writer, 400, {'error': 'Content-Length no válido'}, keep_alive=False)
+            return False
+        body = BodyReader(reader, content_length, chunked)
+        keep_alive = self._wants_keep_alive(request)
+
+        # Control de admisión antes de aceptar el cuerpo (y antes del 100 Continue)
+        native = self._native_handler(request)
+        ticket = None
+        if native is not None:
+            try:
+                ticket = self.core.io_scheduler.reserve(
+                    request['remote_addr'], content_length or self.core.upload_chunk_size
+                )
+            except UploadBusy as e:
+                self.core.logger.warning(f"Servidor saturado, subida rechazada de {request['remote_addr']}")
+                keep_alive = keep_alive and body.finished
+                await self._send_json(writer, 503, {'error': str(e)}, keep_alive=keep_alive,
+                                      headers={'Retry-After': str(e.retry_after)})
+                return keep_alive
+
+        if 'expect' in headers and headers['expect'].lower() == '100-continue' and not body.finished:
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            await writer.drain()
+
+        try:
+            if native is not None:
+                started = time.perf_counter()
+                status, payload, extra = await native(request, body)
+                self.core.metrics.request(self._native_endpoint(request)).observe(time.perf_counter() - started)
+                ACCESS_LOG.record(request['method'], request['path'], status)
+                await self._send_json(writer, status, payload, keep_alive=keep_alive, headers=extra)
+            else:
+                await self._serve_wsgi(request, body, writer, keep_alive)
+        except HTTPError as e:
+            await self._send_json(writer, e.status, {'error': str(e)}, keep_alive=False)
+            return False
+        finally:
+            if ticket is not None:
+                self.core.io_scheduler.release(ticket)
+
+        # Si la respuesta salió sin leer todo el cuerpo, la conexión no se puede reutilizar
+        if not body.finished:
+            return False
+        return keep_alive
+
+    # --- rutas nativas -------------------------------------------------------
+
+    def _native_handler(self, request):
+        method, path = request['method'], request['path']
+        if method == 'POST' and path in self.MULTIPART_ROUTES:
+            return self._handle_multipart
+        if method == 'PUT' and path.startswith('/upload-stream/'):
+            return self._handle_raw_upload
+        return None
+
+    def _native_endpoint(self, request):
+        """Nombre de la vista Flask equivalente (para métricas y límites)"""
+        if request['path'] in self.MULTIPART_ROUTES:
+            return self.MULTIPART_ROUTES[request['path']][0]
+        return 'upload_stream_raw'
+    
+    def _check_rate(self, endpoint, request, cost=1):
+        """Aplica los mismos límites por ruta que el decorador de Flask"""
+        limiter, by_bytes = self.core.rate_limiters.get(endpoint, self.core.rate_limiters['default'])
+        if by_bytes:
+            cost = int(request['headers'].get('content-length', 0) or 0)
+        allowed, retry_after = limiter.check(request['remote_addr'], cost)
+        if allowed:
+            return None
+        self.core.logger.warning(f"Rate limit exceeded for IP: {request['remote_addr']}")
+        return (429, {'error': 'Demasiadas peticiones. Intenta más tarde.'},
+                {'Retry-After': str(max(1, int(retry_after + 0.999)))})
+
+    async def _handle_multipart(self, request, body):
+        endpoint, field = self.MULTIPART_ROUTES[request['path']]
+        limited = self._check_rate(endpoint, request)
+        if limited:
+            return limited
+
+        content_type = request['headers'].get('content-type', '')
+        mimetype, _, params = content_type.partition(';')
+        boundary = None
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'boundary':
+                boundary = value.strip('"')
+        if mimetype.strip().lower() != 'multipart/form-data' or not boundary:
+            return 400, {'error': 'Se esperaba multipart/form-data'}, None
+
+        try:
+            uploaded, errors = await self._ingest_multipart(body, boundary, field)
+        except UploadTooLarge as e:
+            return 413, {'error': str(e)}, None
+        except HTTPError:
+            raise
+        except Exception as e:
+            self.core.logger.error(f"Error en {endpoint} (async): {e}")
+            return 500, {'error': f'Error interno del servidor: {str(e)}'}, None
+
+        if not uploaded and not errors:
+            return 400, {'error': 'No se recibieron archivos'}, None
+
+        await self.run(self.core.update_stats)
+        response = {'message': f'{len(uploaded)} archivos subidos correctamente', 'files': uploaded}
+        if errors:
+            response['errors'] = errors
+            response['message'] += f', {len(errors)} errores'
+        return 200, response, None
+
+    async def _ingest_multipart(self, body, boundary, field=None):
+        """
+        Como PyShareServer.ingest_multipart, pero sin ocupar un hilo mientras
+        llegan datos. Con field, solo se guardan los archivos de ese campo.
+        """
+        file_manager = self.core.file_manager
+        decoder = MultipartDecoder(boundary.encode('latin-1'))
+        uploaded = []
+        errors = []
+        writer = None
+        eof = False
+
+        try:
+            while True:
+                try:
+                    event = decoder.next_event()
+                except ValueError:
+                    # El decodificador no admite el fin de datos en mitad de una parte
+                    if eof:
+                        raise HTTPError(400, "Cuerpo multipart incompleto")
+                    raise
+                if event is NEED_DATA:
+                    if eof:
+                        raise HTTPError(400, "Cuerpo multipart incompleto")
+                    data = await body.read(self.core.STREAM_BUFFER_SIZE)
+                    eof = not data
+                    decoder.receive_data(data or None)
+                elif isinstance(event, File):
+                    if field is not None and event.name != field:
+                        continue
+                    filename = secure_filename(event.filename or '')
+                    is_valid, message = file_manager.validate_name(filename)
+                    if is_valid:
+                        writer = await self.run(UploadWriter, file_manager, filename)
+                    else:
+                        errors.append(message)
+                elif isinstance(event, Data):
+                    if writer is not None:
+                        await self.run(writer.write, event.data)
+                        if not event.more_data:
+                            filepath = await self.run(writer.commit)
+                            digest = writer.digest
+                            writer = None
+                            final_path = await self.run(self.core.finish_upload, filepath, digest)
+                            uploaded.append(final_path.name)
+                elif isinstance(event, Epilogue):
+                    break
+        except Exception:
+            if writer is not None:
+                await self.run(writer.abort)
+            raise
+
+        return uploaded, errors
+
+    async def _handle_raw_upload(self, request, body):
+        limited = self._check_rate('upload_stream_raw', request)
+        if limited:
+            return limited
+
+        file_manager = self.core.file_manager
+        filename = secure_filename(unquote(request['path'][len('/upload-stream/'):]))
+        is_valid, message = file_manager.validate_name(filename)
+        if not is_valid:
+            return 400, {'error': message}, None
+        if body.length is not None and body.length > file_manager.max_size:
+            return 413, {'error': f"Archivo demasiado grande: {file_manager.format_size(body.length)}"}, None
+
+        writer = await self.run(UploadWriter, file_manager, filename)
+        try:
+            while True:
+                data = await body.read(self.core.STREAM_BUFFER_SIZE)
+                if not data:
+                    break
+                await self.run(writer.write, data)
+            filepath = await self.run(writer.commit)
+        except UploadTooLarge as e:
+            await self.run(writer.abort)
+            return 413, {'error': str(e)}, None
+        except BaseException:
+            await self.run(writer.abort)
+            raise
+
+        final_path = await self.run(self.core.finish_upload, filepath, writer.digest)
+        await self.run(self.core.update_stats)
+        return 200, {'message': 'Archivo subido correctamente', 'filename': final_path.name}, None
+
+    # --- resto de rutas: app Flask en el pool --------------------------------
+
+    def _build_environ(self, request, wsgi_input, content_length):
+        headers = request['headers']
+        environ = {
+            'REQUEST_METHOD': request['method'],
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(request['path'], encoding='latin-1'),
+            'QUERY_STRING': request['query'],
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': request['version'],
+            'REMOTE_ADDR': request['remote_addr'],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': wsgi_input,
+            'wsgi.input_terminated': True,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': SendfileWrapper,
+        }
+        if 'content-type' in headers:
+            environ['CONTENT_TYPE'] = headers['content-type']
+        if content_length is not None:
+            environ['CONTENT_LENGTH'] = str(content_length)
+        for name, value in headers.items():
+            if name in ('content-type', 'content-length'):
+                continue
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+        return environ
+
+    def _call_app(self, environ):
+        """Llama a la app WSGI y devuelve (status, cabeceras, iterable)"""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+
+        result = self.app(environ, start_response)
+        return response['status'], response['headers'], result
+
+    @staticmethod
+    def _next_batch(iterator, max_bytes=256 * 1024):
+        parts = []
+        size = 0
+        for data in iterator:
+            if data:
+                parts.append(data)
+                size += len(data)
+                if size >= max_bytes:
+                    break
+        return b''.join(parts)
+
+    async def _serve_wsgi(self, request, body, writer, keep_alive):
+        if body.finished:
+            wsgi_input, content_length = io.BytesIO(), 0
+        elif body.length is not None and body.length <= self.prebuffer_limit:
+            # Cuerpos pequeños: se leen aquí (sin hilo) y la app los recibe completos
+            data = await body.read_all()
+            wsgi_input, content_length = io.BytesIO(data), len(data)
+        else:
+            wsgi_input, content_length = SyncBodyBridge(body, self.loop), body.length
+
+        environ = self._build_environ(request, wsgi_input, content_length)
+        status, headers, result = await self.run(self._call_app, environ)
+
+        try:
+            header_names = {name.lower() for name, _ in headers}
+            status_code = int(status.split(' ', 1)[0])
+            ACCESS_LOG.record(request['method'], request['path'], status_code)
+            has_body = request['method'] != 'HEAD' and status_code not in (204, 304) and status_code >= 200
+            chunked = has_body and 'content-length' not in header_names
+
+            head = [f"HTTP/1.1 {status}"]
+            head += [f"{name}: {value}" for name, value in headers]
+            if chunked:
+                head.append("Transfer-Encoding: chunked")
+            head.append("Connection: keep-alive" if keep_alive else "Connection: close")
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+
+            if not has_body:
+                await writer.drain()
+                return
+
+            if isinstance(result, SendfileWrapper) and not chunked:
+                await writer.drain()
+                if result.count:
+                    await self.loop.sendfile(writer.transport, result.file, result.offset, result.count)
+                return
+
+            iterator = iter(result)
+            while True:
+                data = await self.run(self._next_batch, iterator)
+                if not data:
+                    break
+                if chunked:
+                    writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+                else:
+                    writer.write(data)
+                await writer.drain()
+            if chunked:
+                writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        finally:
+            if hasattr(result, 'close'):
+                await self.run(result.close)
+
+    async def _send_json(self, writer, status, payload, keep_alive=True, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = [
+            f"HTTP/1.1 {status} {STATUS_REASONS.get(status, '')}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(data)}",
+            "Connection: keep-alive" if keep_alive else "Connection: close",
+        ]
+        for name, value in (headers or {}).items():
+            head.append(f"{name}: {value}")
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + data)
+        await writer.drain()
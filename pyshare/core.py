@@ -0,0 +1,5277 @@
+"""Núcleo del servidor PyShare: todo lo que no depende de la interfaz Tk"""
+
+import threading
+import os
+import stat
+import signal
+import socket
+from pathlib import Path
+from flask import Flask, request, jsonify, send_file, abort, g
+from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from werkzeug.wsgi import LimitedStream
+from werkzeug.exceptions import InternalServerError, ClientDisconnected
+from werkzeug.sansio.multipart import MultipartDecoder, NEED_DATA, File, Data, Epilogue
+import mimetypes
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+import multiprocessing
+from collections import OrderedDict, deque
+import hashlib
+from functools import wraps
+from contextlib import contextmanager
+import math
+from datetime import datetime, timedelta, timezone
+import logging
+import queue
+import atexit
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import sqlite3
+import bisect
+import base64
+import secrets
+import re
+import shutil
+import json
+import struct
+import tarfile
+import zlib
+from urllib.parse import quote as url_quote
+
+# Carpeta del proyecto: Flask sirve los estáticos desde aquí, como antes
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+class Histogram:
+    """
+    Histograma acumulado con un shard por hilo.
+    
+    observe() no toma ningún lock: cada hilo incrementa sus propios contadores
+    y los shards solo se suman al leer (/metrics, panel de la GUI).
+    """
+    
+    def __init__(self, buckets):
+        self.bounds = tuple(buckets)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+    
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = [[0] * (len(self.bounds) + 1), 0.0]
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+    
+    def observe(self, value):
+        shard = self._shard()
+        shard[0][bisect.bisect_left(self.bounds, value)] += 1
+        shard[1] += value
+    
+    def snapshot(self):
+        """(conteo por cubeta, suma, total); la última cubeta es +Inf"""
+        with self._lock:
+            shards = list(self._shards)
+        counts = [0] * (len(self.bounds) + 1)
+        total_sum = 0.0
+        for shard_counts, shard_sum in shards:
+            for i, n in enumerate(shard_counts):
+                counts[i] += n
+            total_sum += shard_sum
+        return counts, total_sum, sum(counts)
+    
+    def quantile(self, q):
+        """Cuantil aproximado (límite superior de la cubeta), o None sin datos"""
+        counts, _, total = self.snapshot()
+        if not total:
+            return None
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= q * total:
+                return self.bounds[i] if i < len(self.bounds) else math.inf
+        return math.inf
+
+class Counter:
+    """Contador con un shard por hilo, como Histogram"""
+    
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+    
+    def inc(self, amount=1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = [0]
+            with self._lock:
+                self._shards.append(shard)
+        shard[0] += amount
+    
+    @property
+    def value(self):
+        with self._lock:
+            return sum(shard[0] for shard in self._shards)
+
+class Metrics:
+    """
+    Métricas de rendimiento: duración de cada etapa de una subida, latencia
+    por ruta y velocidad de recepción. Se exponen en /metrics (Prometheus).
+    """
+    
+    TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+    RATE_BUCKETS = tuple(128 * 1024 * 2 ** i for i in range(12))  # 128KB/s .. 256MB/s
+    
+    def __init__(self):
+        self.stages = {}    # etapa -> Histogram de segundos
+        self.requests = {}  # ruta -> Histogram de segundos
+        self.upload_rate = Histogram(self.RATE_BUCKETS)
+        self.upload_bytes = Counter()
+        self._lock = threading.Lock()
+    
+    def _histogram(self, table, key):
+        histogram = table.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = table.setdefault(key, Histogram(self.TIME_BUCKETS))
+        return histogram
+    
+    def stage(self, name):
+        return self._histogram(self.stages, name)
+    
+    def request(self, endpoint):
+        return self._histogram(self.requests, endpoint)
+    
+    @contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage(stage).observe(time.perf_counter() - start)
+    
+    def observe_upload(self, size, seconds, stage='receive'):
+        """Datos recibidos de un cliente: tiempo de la etapa y bytes/s"""
+        self.stage(stage).observe(seconds)
+        self.upload_bytes.inc(size)
+        if size and seconds > 0:
+            self.upload_rate.observe(size / seconds)
+    
+    def summary(self):
+        """{etapa: (total, p50, p95)} para el panel de la GUI"""
+        return {
+            name: (histogram.snapshot()[2], histogram.quantile(0.5), histogram.quantile(0.95))
+            for name, histogram in sorted(self.stages.items())
+        }
+    
+    @staticmethod
+    def _format_histogram(lines, name, label, histograms):
+        for key, histogram in sorted(histograms.items()):
+            counts, total_sum, total = histogram.snapshot()
+            prefix = f'{label}="{key}",' if label else ''
+            cumulative = 0
+            for bound, n in zip(histogram.bounds, counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {total}')
+            labels = f'{{{prefix.rstrip(",")}}}' if prefix else ''
+            lines.append(f'{name}_sum{labels} {total_sum}')
+            lines.append(f'{name}_count{labels} {total}')
+    
+    def render(self, gauges=()):
+        """Formato de exposición de texto de Prometheus; gauges: (nombre, ayuda, valor)"""
+        lines = []
+        for name, help_text, value in gauges:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+        
+        lines += ['# HELP pyshare_stage_seconds Duración de cada etapa del procesado de subidas',
+                  '# TYPE pyshare_stage_seconds histogram']
+        self._format_histogram(lines, 'pyshare_stage_seconds', 'stage', self.stages)
+        lines += ['# HELP pyshare_request_seconds Latencia por ruta (hasta empezar a enviar la respuesta)',
+                  '# TYPE pyshare_request_seconds histogram']
+        self._format_histogram(lines, 'pyshare_request_seconds', 'endpoint', self.requests)
+        lines += ['# HELP pyshare_upload_bytes_per_second Velocidad de recepción de cada subida o chunk',
+                  '# TYPE pyshare_upload_bytes_per_second histogram']
+        self._format_histogram(lines, 'pyshare_upload_bytes_per_second', None, {'': self.upload_rate})
+        lines += ['# HELP pyshare_received_bytes_total Bytes recibidos en subidas',
+                  '# TYPE pyshare_received_bytes_total counter',
+                  f'pyshare_received_bytes_total {self.upload_bytes.value}']
+        return '\n'.join(lines) + '\n'
+
+# Registro global, como los loggers: los componentes miden sin recibirlo como parámetro
+METRICS = Metrics()
+
+class AccessLog:
+    """
+    Registro de accesos agregado: en vez de una línea por petición (miles por
+    minuto durante una subida), una línea por intervalo con el total por ruta
+    y por código de estado. Los errores 5xx se siguen registrando uno a uno.
+    """
+    
+    TOP_ROUTES = 8
+    
+    def __init__(self, interval=60):
+        self.interval = interval
+        self.logger = logging.getLogger('pyshare.access')
+        self.lock = threading.Lock()
+        self._reset(time.monotonic())
+    
+    def _reset(self, now):
+        self.started = now
+        self.total = 0
+        self.routes = {}
+        self.statuses = {}
+    
+    def _summary(self, now):
+        statuses = ', '.join(f"{code}×{n}" for code, n in sorted(self.statuses.items()))
+        routes = sorted(self.routes.items(), key=lambda item: -item[1])[:self.TOP_ROUTES]
+        return (f"Peticiones en {now - self.started:.0f}s: {self.total} ({statuses}) — "
+                + ', '.join(f"{route} {n}" for route, n in routes))
+    
+    def record(self, method, path, status):
+        if status >= 500:
+            self.logger.warning(f"{method} {path} -> {status}")
+        # Agrupado por el primer segmento: /uploads/a.jpg y /uploads/b.jpg cuentan juntos
+        route = '/' + path.split('?', 1)[0].lstrip('/').split('/', 1)[0]
+        now = time.monotonic()
+        with self.lock:
+            self.total += 1
+            self.routes[route] = self.routes.get(route, 0) + 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if now - self.started < self.interval:
+                return
+            summary = self._summary(now)
+            self._reset(now)
+        self.logger.info(summary)
+    
+    def flush(self):
+        """Escribe lo acumulado sin esperar al final del intervalo"""
+        now = time.monotonic()
+        with self.lock:
+            if not self.total:
+                return
+            summary = self._summary(now)
+            self._reset(now)
+        self.logger.info(summary)
+
+ACCESS_LOG = AccessLog()
+
+class _DroppingQueueHandler(QueueHandler):
+    """QueueHandler que descarta (y cuenta) en vez de bloquear si la cola está llena"""
+    
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def enqueue(self, record):
+        try:
+            if self.dropped:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': f"Cola de log llena: se descartaron {self.dropped} mensajes",
+                }))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class LogPipeline:
+    """
+    Logging que no bloquea: los hilos de subida solo encolan el registro y un
+    hilo aparte (QueueListener) lo escribe en el archivo, con rotación por
+    tamaño, y en la consola.
+    """
+    
+    MAX_QUEUE = 10000
+    FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+    _installed = None
+    
+    def __init__(self, path='pyshare.log', max_bytes=5 * 1024 * 1024, backups=3):
+        self.queue = queue.Queue(self.MAX_QUEUE)
+        formatter = logging.Formatter(self.FORMAT)
+        file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                           encoding='utf-8', delay=True)
+        console = logging.StreamHandler()
+        for handler in (file_handler, console):
+            handler.setFormatter(formatter)
+        self.handler = _DroppingQueueHandler(self.queue)
+        self.listener = QueueListener(self.queue, file_handler, console, respect_handler_level=True)
+    
+    @classmethod
+    def install(cls, path, max_bytes, backups):
+        """
+        Pone la cola en el logger raíz, una vez por proceso. Como basicConfig, no
+        toca nada si el raíz ya tiene handlers (la app está integrada en otra).
+        """
+        root = logging.getLogger()
+        if cls._installed is None and not root.handlers:
+            pipeline = cls(path, max_bytes, backups)
+            root.addHandler(pipeline.handler)
+            root.setLevel(logging.INFO)
+            pipeline.listener.start()
+            atexit.register(pipeline.stop)
+            cls._installed = pipeline
+        return cls._installed
+    
+    def stop(self):
+        """Vacía la cola (y el resumen de accesos pendiente) antes de salir"""
+        ACCESS_LOG.flush()
+        self.listener.stop()
+
+# Formato de salida -> (formato de Pillow, extensión)
+CONVERSION_FORMATS = {'jpeg': ('JPEG', '.jpg'), 'webp': ('WEBP', '.webp'), 'avif': ('AVIF', '.avif')}
+CONVERSION_DEFAULTS = {
+    'format': 'jpeg',
+    'quality': 95,
+    'progressive': False,
+    'keep_exif': True,
+    'keep_icc': True,
+    'decode_threads': None,  # hilos de libheif por imagen (None = los de la librería)
+}
+
+def _register_heif(decode_threads=None):
+    """Registra pillow_heif en Pillow (si está instalado) sin cargar lo que no se usa"""
+    try:
+        import pillow_heif  # opcional: soporte HEIC para Pillow
+    except ImportError:
+        return
+    options = {'thumbnails': False, 'depth_images': False, 'aux_images': False}
+    if decode_threads:
+        options['decode_threads'] = decode_threads
+    try:
+        # Sin miniaturas, mapas de profundidad ni imágenes auxiliares: solo la foto
+        pillow_heif.register_heif_opener(**options)
+    except TypeError:
+        pillow_heif.register_heif_opener()
+
+def avif_available():
+    """Si Pillow puede guardar AVIF (nativo desde 11.2, o con el plugin pillow_avif)"""
+    from PIL import Image
+    try:
+        import pillow_avif  # noqa: F401 (registra el plugin)
+    except ImportError:
+        pass
+    Image.init()
+    return 'AVIF' in Image.SAVE
+
+def convert_image_file(source, target, options=None):
+    """
+    Convierte un HEIC/HEIF a JPEG, WebP o AVIF (se ejecuta en un proceso del
+    pool de conversión).
+    
+    Conserva EXIF y perfil ICC si se pide. La imagen decodificada se libera
+    en cuanto existe la copia en RGB, así que nunca hay más de dos en memoria
+    y solo mientras dura la conversión de modo. No borra el original; de eso
+    se encarga el proceso principal al recibir el resultado. Devuelve los
+    segundos que tardó la conversión.
+    """
+    start = time.perf_counter()
+    options = {**CONVERSION_DEFAULTS, **(options or {})}
+    from PIL import Image
+    
+    _register_heif(options['decode_threads'])
+    pil_format, _ = CONVERSION_FORMATS[options['format']]
+    if pil_format == 'AVIF':
+        avif_available()
+    
+    original = img = Image.open(source)
+    try:
+        params = {'quality': int(options['quality'])}
+        if options['keep_icc'] and original.info.get('icc_profile'):
+            params['icc_profile'] = original.info['icc_profile']
+        if options['keep_exif']:
+            exif = original.getexif()
+            if exif:
+                # libheif ya aplica la rotación al decodificar; la etiqueta la repetiría
+                if exif.get(0x0112, 1) != 1:
+                    exif[0x0112] = 1
+                params['exif'] = exif.tobytes()
+        if pil_format == 'JPEG':
+            params['progressive'] = bool(options['progressive'])
+        
+        keep_alpha = pil_format != 'JPEG' and original.mode in ('RGBA', 'LA')
+        wanted = 'RGBA' if keep_alpha else 'RGB'
+        if original.mode != wanted:
+            img = original.convert(wanted)
+            original.close()
+        img.save(target, pil_format, **params)
+    finally:
+        img.close()
+    return time.perf_counter() - start
+
+def walk_uploads(folder, dirs=None):
+    """
+    Recorre la carpeta de subidas con todas sus subcarpetas y devuelve
+    (subcarpeta relativa, DirEntry) de cada archivo. No entra en carpetas
+    ocultas (.thumbs) ni en temp/, e ignora los archivos ocultos (subidas a
+    medio escribir, bases SQLite). Si se pasa dirs, anota en él el mtime de
+    cada carpeta visitada.
+    """
+    folder = Path(folder)
+    pending = ['']
+    while pending:
+        shard = pending.pop()
+        path = folder / shard if shard else folder
+        try:
+            if dirs is not None:
+                dirs[shard] = path.stat().st_mtime
+            with os.scandir(path) as it:
+                items = list(it)
+        except OSError:
+            continue
+        for item in items:
+            if item.name.startswith('.'):
+                continue
+            if item.is_dir(follow_symlinks=False):
+                if shard or item.name != 'temp':
+                    pending.append(f"{shard}/{item.name}" if shard else item.name)
+            elif item.is_file():
+                yield shard, item
+
+class StorageLayout:
+    """
+    Decide en qué subcarpeta de uploads/ se guarda cada archivo.
+    
+    El nombre sigue siendo único en toda la carpeta (es lo que aparece en
+    /uploads/<archivo>); la disposición solo elige la subcarpeta:
+      flat: todo directamente en uploads/, como siempre
+      date: uploads/AAAA/MM/DD/ por fecha de subida o de captura
+      hash: uploads/ab/ según el hash del nombre (256 carpetas repartidas por igual)
+    """
+    
+    KINDS = ('flat', 'date', 'hash')
+    DATE_SOURCES = ('upload', 'capture')
+    DATE_FORMAT = '%Y/%m/%d'
+    
+    def __init__(self, kind='flat', date_source='upload'):
+        if kind not in self.KINDS:
+            raise ValueError(f"Disposición de almacenamiento no válida: {kind}")
+        if date_source not in self.DATE_SOURCES:
+            raise ValueError(f"Fecha de almacenamiento no válida: {date_source}")
+        self.kind = kind
+        self.date_source = date_source
+    
+    @property
+    def by_capture(self):
+        """Si los archivos se recolocan por fecha de captura al terminar de subirse"""
+        return self.kind == 'date' and self.date_source == 'capture'
+    
+    def shard_for(self, name, when=None):
+        """Subcarpeta relativa ('' = raíz) para name; when es un timestamp (por defecto, ahora)"""
+        if self.kind == 'date':
+            return time.strftime(self.DATE_FORMAT, time.localtime(when))
+        if self.kind == 'hash':
+            return hashlib.md5(name.encode('utf-8')).hexdigest()[:2]
+        return ''
+    
+    def __str__(self):
+        if self.kind == 'date':
+            return f"date ({self.date_source})"
+        return self.kind
+
+class NameAllocator:
+    """
+    Reserva nombres únicos en O(1) con un contador por nombre base.
+    
+    Los nombres son únicos en toda la carpeta aunque los archivos estén
+    repartidos en subcarpetas: el índice se llena una vez recorriendo el árbol
+    y guarda también dónde está cada archivo. Después cada reserva crea el
+    archivo con O_EXCL, así que dos hilos nunca reciben el mismo nombre.
+    """
+    
+    SUFFIX_RE = re.compile(r'^(.*)_(\d+)$')
+    
+    def __init__(self, folder, layout=None):
+        self.folder = Path(folder)
+        self.layout = layout or StorageLayout()
+        self.counters = None  # (nombre, extensión) -> sufijo más alto en uso (0 = sin sufijo)
+        self.locations = {}  # nombre -> subcarpeta relativa ('' = raíz)
+        self.lock = threading.Lock()
+    
+    def _register(self, filename, shard=''):
+        self.locations.setdefault(filename, shard)
+        name, ext = os.path.splitext(filename)
+        key = (name, ext)
+        self.counters[key] = max(self.counters.get(key, 0), 0)
+        match = self.SUFFIX_RE.match(name)
+        if match:
+            key = (match.group(1), ext)
+            self.counters[key] = max(self.counters.get(key, 0), int(match.group(2)))
+    
+    def _seed(self):
+        self.counters = {}
+        self.locations = {}
+        if self.folder.exists():
+            for shard, item in walk_uploads(self.folder):
+                self._register(item.name, shard)
+    
+    def allocate(self, filename, when=None, near=None):
+        """
+        Reserva y crea (vacío) el primer nombre libre para filename.
+        
+        when es la fecha para la disposición por fecha; near, el nombre de un
+        archivo junto al que guardar el nuevo (p. ej. el JPG de un HEIC).
+        """
+        name, ext = os.path.splitext(filename)
+        key = (name, ext)
+        with self.lock:
+            if self.counters is None:
+                self._seed()
+            
+            used = self.counters.get(key)
+            counter = 0 if used is None else used + 1
+            while True:
+                candidate = filename if counter == 0 else f"{name}_{counter}{ext}"
+                if candidate in self.locations:
+                    # Existe en otra subcarpeta
+                    counter += 1
+                    continue
+                shard = self.layout.shard_for(candidate, when)
+                if near is not None and self.layout.kind == 'date':
+                    shard = self.locations.get(near, shard)
+                directory = self.folder / shard if shard else self.folder
+                if shard:
+                    directory.mkdir(parents=True, exist_ok=True)
+                try:
+                    fd = os.open(directory / candidate, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                except FileExistsError:
+                    # Creado fuera del servidor desde el escaneo inicial
+                    counter += 1
+                    continue
+                os.close(fd)
+                self.counters[key] = counter
+                if counter == 0:
+                    self._register(candidate, shard)
+                else:
+                    self.locations[candidate] = shard
+                return candidate
+    
+    def location(self, filename):
+        """Subcarpeta relativa de filename, o None si no está en la carpeta"""
+        with self.lock:
+            if self.counters is None:
+                self._seed()
+            return self.locations.get(filename)
+    
+    def observe(self, filename, shard):
+        """Anota un archivo encontrado al recorrer la carpeta (añadido o movido desde fuera)"""
+        with self.lock:
+            if self.counters is None:
+                return
+            if filename in self.locations:
+                self.locations[filename] = shard
+            else:
+                self._register(filename, shard)
+    
+    def move(self, filename, shard):
+        """Mueve filename a otra subcarpeta de forma atómica para quien lo busque"""
+        with self.lock:
+            source = self.locations.get(filename, '')
+            if source == shard:
+                return
+            target_dir = self.folder / shard if shard else self.folder
+            target_dir.mkdir(parents=True, exist_ok=True)
+            source_dir = self.folder / source if source else self.folder
+            os.replace(source_dir / filename, target_dir / filename)
+            self.locations[filename] = shard
+    
+    def forget(self, filename):
+        """Olvida la ubicación de un archivo borrado (el sufijo no se reutiliza)"""
+        with self.lock:
+            self.locations.pop(filename, None)
+
+class FileManager:
+    """Maneja operaciones de archivos de forma segura"""
+    
+    def __init__(self, upload_folder, max_size_mb=500, layout=None):
+        # self.max_size = max_size_mb * 1024 * 1024
+        self.upload_folder = Path(upload_folder)
+        # self.max_size = max_size
+        # self.upload_folder.mkdir(exist_ok=True)
+        
+        if isinstance(max_size_mb, (int, float)) and max_size_mb > 1024*1024:
+                self.max_size = int(max_size_mb)
+        else:
+            # asumimos MB
+            self.max_size = int(max_size_mb * 1024 * 1024)
+            self.upload_folder.mkdir(exist_ok=True)
+        
+        self.layout = layout or StorageLayout()
+        self.name_allocator = NameAllocator(self.upload_folder, self.layout)
+        
+        # Extensiones permitidas
+        self.PHOTO_EXTENSIONS = {'jpg', 'jpeg', 'png', 'heic', 'heif', 'webp', 'tiff', 'bmp', 'raw', 'dng'}
+        self.VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi'}
+        self.ALLOWED_EXTENSIONS = self.PHOTO_EXTENSIONS.union(self.VIDEO_EXTENSIONS)
+        
+        # MIME types permitidos
+        self.ALLOWED_MIME_TYPES = {
+            'image/jpeg', 'image/png', 'image/heic', 'image/heif', 
+            'image/webp', 'image/tiff', 'image/bmp', 'image/x-canon-cr2',
+            'video/mp4', 'video/quicktime', 'video/x-msvideo'
+        }
+    
+    def validate_file(self, file):
+        """Valida archivo por extensión, MIME type y tamaño"""
+        if not file or not file.filename:
+            return False, "Archivo no válido"
+        
+        # Validar extensión
+        if not self.is_allowed_extension(file.filename):
+            return False, f"Extensión no permitida: {file.filename.split('.')[-1]}"
+        
+        # Validar tamaño
+        file.seek(0, 2)  # Ir al final
+        file_size = file.tell()
+        file.seek(0)  # Volver al inicio
+        
+        if file_size > self.max_size:
+            return False, f"Archivo demasiado grande: {self.format_size(file_size)}"
+        
+        # Validar MIME type usando mimetypes
+        try:
+            mime_type, _ = mimetypes.guess_type(file.filename)
+            if mime_type and mime_type not in self.ALLOWED_MIME_TYPES:
+                return False, f"Tipo de archivo no permitido: {mime_type}"
+        except Exception as e:
+            return False, f"Error validando archivo: {str(e)}"
+        
+        return True, "Archivo válido"
+    
+    def is_allowed_extension(self, filename):
+        """Verifica si la extensión está permitida"""
+        return '.' in filename and filename.rsplit('.', 1)[1].lower() in self.ALLOWED_EXTENSIONS
+    
+    def get_unique_filename(self, filename, when=None, near=None):
+        """Reserva un nombre único para evitar sobrescribir (crea el archivo vacío)"""
+        return self.name_allocator.allocate(secure_filename(filename), when, near)
+    
+    def path_for(self, filename):
+        """Ruta en disco de un archivo subido a partir de su nombre, esté en la subcarpeta que esté"""
+        shard = self.name_allocator.location(filename)
+        return self.upload_folder / shard / filename if shard else self.upload_folder / filename
+    
+    def place_by_capture(self, filepath):
+        """Con la disposición por fecha de captura, lleva el archivo a la carpeta de ese día"""
+        filepath = Path(filepath)
+        if not self.layout.by_capture:
+            return filepath
+        when = capture_time(filepath)
+        if when is None:
+            return filepath
+        shard = self.layout.shard_for(filepath.name, when)
+        try:
+            self.name_allocator.move(filepath.name, shard)
+        except OSError as e:
+            logging.getLogger(__name__).warning(f"No se pudo mover {filepath.name} a {shard}: {e}")
+            return filepath
+        return self.upload_folder / shard / filepath.name
+    
+    def release_filename(self, filename):
+        """Libera un nombre reservado que no llegó a usarse"""
+        filepath = self.path_for(filename)
+        try:
+            if filepath.stat().st_size == 0:
+                filepath.unlink()
+                self.name_allocator.forget(filename)
+        except OSError:
+            pass
+    
+    def save_file(self, file, filename, hasher=None):
+        """Guarda archivo de forma segura (actualizando hasher con el contenido si se pasa)"""
+        try:
+            filepath = self.path_for(filename)
+            
+            # Guardar con buffer optimizado
+            with open(filepath, 'wb') as f:
+                while True:
+                    chunk = file.stream.read(32768)  # 32KB chunks
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+            
+            return True, f"Archivo guardado: {filename}"
+            
+        except Exception as e:
+            self.release_filename(filename)
+            return False, f"Error guardando archivo: {str(e)}"
+    
+    def validate_name(self, filename):
+        """Valida extensión y MIME type a partir solo del nombre (subidas en streaming)"""
+        if not filename:
+            return False, "Archivo no válido"
+        if not self.is_allowed_extension(filename):
+            return False, f"Extensión no permitida: {filename.split('.')[-1]}"
+        mime_type, _ = mimetypes.guess_type(filename)
+        if mime_type and mime_type not in self.ALLOWED_MIME_TYPES:
+            return False, f"Tipo de archivo no permitido: {mime_type}"
+        return True, "Archivo válido"
+    
+    def save_stream(self, stream, filename, buffer_size=1024 * 1024):
+        """
+        Guarda un stream crudo directamente en uploads/ sin pasar por archivos temporales.
+        
+        Devuelve (ruta, sha256 del contenido).
+        """
+        writer = UploadWriter(self, filename)
+        try:
+            while True:
+                chunk = stream.read(buffer_size)
+                if not chunk:
+                    break
+                writer.write(chunk)
+            return writer.commit(), writer.digest
+        except Exception:
+            writer.abort()
+            raise
+    
+    def convert_heic_to_jpg(self, filepath):
+        """Convierte archivos HEIC a JPG en este hilo (el servidor usa ConversionQueue)"""
+        try:
+            if filepath.suffix.lower() in ['.heic', '.heif']:
+                jpg_path = filepath.with_suffix('.jpg')
+                convert_image_file(filepath, jpg_path)
+                # Eliminar archivo HEIC original
+                filepath.unlink()
+                return jpg_path
+        except Exception as e:
+            logging.getLogger(__name__).error(f"Error convirtiendo HEIC: {e}")
+        
+        return filepath
+    
+    def format_size(self, bytes):
+        """Formatea tamaño de archivo de forma optimizada"""
+        if bytes == 0:
+            return "0B"
+        
+        size_names = ["B", "KB", "MB", "GB", "TB"]
+        i = int(math.floor(math.log(bytes, 1024)))
+        p = math.pow(1024, i)
+        s = round(bytes / p, 1)
+        return f"{s}{size_names[i]}"
+
+class UploadTooLarge(Exception):
+    """La subida superó max_size mientras se recibía"""
+
+class UploadIncomplete(Exception):
+    """El cuerpo de la subida terminó antes de tiempo (cliente desconectado)"""
+
+class UploadWriter:
+    """
+    Escribe una subida directamente en uploads/ mientras llega.
+    
+    Los datos van a un archivo oculto en la misma carpeta que se renombra al
+    terminar, así que cada byte se escribe una sola vez y el catálogo nunca ve
+    archivos a medias.
+    """
+    
+    def __init__(self, file_manager, filename):
+        self.file_manager = file_manager
+        self.filename = file_manager.get_unique_filename(filename)
+        self.final_path = file_manager.path_for(self.filename)
+        self.partial_path = self.final_path.with_name(f".{self.filename}.{secrets.token_hex(4)}.uploading")
+        self.size = 0
+        self.hasher = hashlib.sha256()
+        self.digest = None
+        self.started = time.perf_counter()
+        self.file = open(self.partial_path, 'wb')
+    
+    def write(self, data):
+        """Añade datos; aborta en cuanto se supera el tamaño máximo"""
+        self.size += len(data)
+        if self.size > self.file_manager.max_size:
+            raise UploadTooLarge(
+                f"Archivo demasiado grande: más de {self.file_manager.format_size(self.file_manager.max_size)}"
+            )
+        self.file.write(data)
+        self.hasher.update(data)
+    
+    def commit(self):
+        """Cierra y publica el archivo con su nombre final"""
+        self.file.close()
+        self.digest = self.hasher.hexdigest()
+        os.replace(self.partial_path, self.final_path)
+        METRICS.observe_upload(self.size, time.perf_counter() - self.started)
+        return self.final_path
+    
+    def abort(self):
+        """Descarta lo escrito y libera el nombre reservado"""
+        try:
+            self.file.close()
+        finally:
+            self.partial_path.unlink(missing_ok=True)
+            self.file_manager.release_filename(self.filename)
+
+class DedupIndex:
+    """
+    Índice de contenido SHA-256 -> archivo guardado, para no almacenar duplicados.
+    
+    SHA-256 porque es lo que el navegador puede calcular con WebCrypto, así el
+    cliente puede preguntar por sus hashes antes de subir nada.
+    """
+    
+    MODES = ('skip', 'hardlink', 'off')
+    
+    def __init__(self, file_manager, db_path=None, mode='skip'):
+        if mode not in self.MODES:
+            raise ValueError(f"Modo de deduplicación no válido: {mode}")
+        self.file_manager = file_manager
+        self.db_path = Path(db_path) if db_path else None
+        self.mode = mode
+        self.by_hash = {}  # sha256 -> nombre
+        self.by_name = {}  # nombre -> (sha256, tamaño, mtime)
+        self.lock = threading.RLock()
+        self._db = None
+    
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+    
+    @staticmethod
+    def hash_file(filepath, buffer_size=1024 * 1024):
+        """SHA-256 de un archivo leído por bloques"""
+        hasher = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            while True:
+                chunk = f.read(buffer_size)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+        return hasher.hexdigest()
+    
+    def load(self):
+        """Carga el índice persistido (si hay base configurada)"""
+        if not self.db_path:
+            return
+        with self.lock:
+            self._db = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS hashes ('
+                'name TEXT PRIMARY KEY, sha256 TEXT NOT NULL, size INTEGER NOT NULL, modified REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS hashes_sha256 ON hashes (sha256)')
+            self._db.commit()
+            for name, digest, size, mtime in self._db.execute('SELECT name, sha256, size, modified FROM hashes'):
+                self.by_name[name] = (digest, size, mtime)
+                self.by_hash.setdefault(digest, name)
+    
+    def stop(self):
+        with self.lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+    
+    def add(self, digest, filepath):
+        """Registra el hash de un archivo ya guardado"""
+        filepath = Path(filepath)
+        try:
+            st = filepath.stat()
+        except OSError:
+            return
+        with self.lock:
+            self._remove_locked(filepath.name)
+            self.by_name[filepath.name] = (digest, st.st_size, st.st_mtime)
+            self.by_hash.setdefault(digest, filepath.name)
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO hashes (name, sha256, size, modified) VALUES (?, ?, ?, ?)',
+                    (filepath.name, digest, st.st_size, st.st_mtime)
+                )
+                self._db.commit()
+    
+    def _remove_locked(self, name):
+        previous = self.by_name.pop(name, None)
+        if previous is None:
+            return
+        digest = previous[0]
+        if self.by_hash.get(digest) == name:
+            del self.by_hash[digest]
+            # Otro archivo con el mismo contenido (p. ej. un hardlink) pasa a ser el canónico
+            for other, (other_digest, _, _) in self.by_name.items():
+                if other_digest == digest:
+                    self.by_hash[digest] = other
+                    break
+        if self._db is not None:
+            self._db.execute('DELETE FROM hashes WHERE name = ?', (name,))
+    
+    def remove(self, name):
+        with self.lock:
+            self._remove_locked(name)
+            if self._db is not None:
+                self._db.commit()
+    
+    def _is_current(self, name):
+        """Comprueba que el archivo indexado sigue en disco sin cambios"""
+        record = self.by_name.get(name)
+        if record is None:
+            return False
+        try:
+            st = self.file_manager.path_for(name).stat()
+        except OSError:
+            return False
+        return st.st_size == record[1] and st.st_mtime == record[2]
+    
+    def lookup(self, digest):
+        """Nombre del archivo ya guardado con ese contenido, o None"""
+        with self.lock:
+            name = self.by_hash.get(digest)
+            if name is None:
+                return None
+            if not self._is_current(name):
+                # Borrado o modificado fuera del servidor: la entrada ya no vale
+                self._remove_locked(name)
+                if self._db is not None:
+                    self._db.commit()
+                return self.lookup(digest)
+            return name
+    
+    def digest_of(self, name, st):
+        """SHA-256 conocido de un archivo, si el índice coincide con su stat actual"""
+        with self.lock:
+            record = self.by_name.get(name)
+        if record is None or record[1] != st.st_size or record[2] != st.st_mtime:
+            return None
+        return record[0]
+    
+    def known(self, digests):
+        """Subconjunto de hashes que ya están guardados: {hash: nombre}"""
+        result = {}
+        for digest in digests:
+            name = self.lookup(digest)
+            if name is not None:
+                result[digest] = name
+        return result
+    
+    def deduplicate(self, digest, filepath):
+        """
+        Aplica el modo de deduplicación a un archivo recién guardado.
+        
+        Devuelve la ruta del archivo existente si era un duplicado, o None.
+        """
+        if not self.enabled:
+            return None
+        existing = self.lookup(digest)
+        if existing is None or existing == filepath.name:
+            return None
+        
+        existing_path = self.file_manager.path_for(existing)
+        logger = logging.getLogger(__name__)
+        if self.mode == 'skip':
+            filepath.unlink(missing_ok=True)
+            self.file_manager.name_allocator.forget(filepath.name)
+            logger.info(f"Duplicado de {existing}: {filepath.name} no se guarda")
+            return existing_path
+        
+        # hardlink: se conserva el nombre nuevo sin ocupar espacio extra
+        tmp_link = filepath.with_name(f".{filepath.name}.{secrets.token_hex(4)}.link")
+        try:
+            os.link(existing_path, tmp_link)
+            os.replace(tmp_link, filepath)
+        except OSError:
+            tmp_link.unlink(missing_ok=True)
+            return None
+        self.add(digest, filepath)
+        logger.info(f"Duplicado de {existing}: {filepath.name} enlazado sin ocupar espacio")
+        return filepath
+    
+    def index_missing(self, names):
+        """Calcula en segundo plano el hash de los archivos que aún no están indexados"""
+        def run():
+            for name in names:
+                with self.lock:
+                    if self._is_current(name):
+                        continue
+                filepath = self.file_manager.path_for(name)
+                try:
+                    digest = self.hash_file(filepath)
+                except OSError:
+                    continue
+                self.add(digest, filepath)
+        
+        threading.Thread(target=run, daemon=True).start()
+
+class FileCatalog:
+    """Índice en memoria de los archivos subidos, opcionalmente persistido en SQLite"""
+    
+    def __init__(self, file_manager, db_path=None, reconcile_interval=10, full_check_every=30):
+        self.file_manager = file_manager
+        self.db_path = Path(db_path) if db_path else None
+        self.reconcile_interval = reconcile_interval
+        self.full_check_every = full_check_every  # cada N ciclos se revisan también tamaños/mtime
+        
+        self.entries = {}  # nombre -> entrada lista para la API
+        self.total_size = 0  # contador incremental de bytes
+        self.lock = threading.RLock()
+        self.version = 0
+        self.epoch = int(time.time() * 1000)  # distingue versiones entre reinicios (ETag)
+        self._listing = None  # (version, lista ordenada, JSON serializado)
+        self._views = {}  # (orden, filtros) -> (version, claves, entradas) en orden ascendente
+        self._dir_mtimes = None  # subcarpeta -> mtime en el último recorrido
+        self._db = None
+        self._watcher = None
+        self._stop = threading.Event()
+        self.on_change = None  # callback tras una reconciliación con cambios
+    
+    def _make_entry(self, name, size, mtime):
+        """Construye la entrada tal como la devuelve /api/files"""
+        is_video = name.rsplit('.', 1)[-1].lower() in self.file_manager.VIDEO_EXTENSIONS
+        icon = "🎥" if is_video else "📸"
+        return {
+            'name': f"{icon} {name}",
+            'size': size,
+            'size_formatted': self.file_manager.format_size(size),
+            'modified': mtime,
+            'original_name': name,
+            'type': 'video' if is_video else 'photo'
+        }
+    
+    def _open_db(self):
+        """Abre (o crea) la base SQLite del catálogo"""
+        self._db = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'name TEXT PRIMARY KEY, size INTEGER NOT NULL, modified REAL NOT NULL)'
+        )
+        self._db.commit()
+    
+    def load(self):
+        """Carga el catálogo al arrancar (desde SQLite si existe, si no escaneando)"""
+        with self.lock:
+            if self.db_path:
+                self._open_db()
+                rows = self._db.execute('SELECT name, size, modified FROM files').fetchall()
+                self.entries = {name: self._make_entry(name, size, mtime) for name, size, mtime in rows}
+                self.total_size = sum(e['size'] for e in self.entries.values())
+                self._touch()
+        
+        if self.db_path and self.entries:
+            # Respuesta inmediata desde la base; la reconciliación corre en segundo plano
+            threading.Thread(target=self.reconcile, kwargs={'full': True}, daemon=True).start()
+        else:
+            self.reconcile(full=True)
+    
+    def _scan(self, dirs):
+        """Recorre la carpeta y sus subcarpetas una sola vez (scandir reutiliza el stat de cada entrada)"""
+        found = {}
+        allocator = self.file_manager.name_allocator
+        for shard, item in walk_uploads(self.file_manager.upload_folder, dirs):
+            if self.file_manager.is_allowed_extension(item.name) and item.name not in found:
+                st = item.stat()
+                found[item.name] = (st.st_size, st.st_mtime)
+                allocator.observe(item.name, shard)
+        return found
+    
+    def _dirs_unchanged(self):
+        """Si ninguna carpeta conocida cambió desde el último recorrido (un stat por carpeta)"""
+        if self._dir_mtimes is None:
+            return False
+        folder = self.file_manager.upload_folder
+        for shard, mtime in self._dir_mtimes.items():
+            try:
+                if (folder / shard if shard else folder).stat().st_mtime != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+    
+    def reconcile(self, full=False):
+        """Sincroniza el catálogo con cambios hechos fuera del servidor"""
+        try:
+            if not full and self._dirs_unchanged():
+                return False
+            
+            dirs = {}
+            found = self._scan(dirs)
+            changed = False
+            with self.lock:
+                for name in list(self.entries):
+                    if name not in found:
+                        self._remove_locked(name)
+                        changed = True
+                for name, (size, mtime) in found.items():
+                    current = self.entries.get(name)
+                    if current is None or current['size'] != size or current['modified'] != mtime:
+                        self._put_locked(name, size, mtime)
+                        changed = True
+                self._dir_mtimes = dirs or None
+                if changed:
+                    self._commit()
+            if changed and self.on_change:
+                self.on_change()
+            return changed
+        except Exception as e:
+            logging.getLogger(__name__).error(f"Error reconciliando catálogo: {e}")
+            return False
+    
+    def start_watcher(self):
+        """Lanza el hilo que detecta cambios externos por mtime del directorio"""
+        if self._watcher is not None:
+            return
+        
+        def watch():
+            cycles = 0
+            while not self._stop.wait(self.reconcile_interval):
+                cycles += 1
+                self.reconcile(full=cycles % self.full_check_every == 0)
+        
+        self._watcher = threading.Thread(target=watch, daemon=True)
+        self._watcher.start()
+    
+    def stop(self):
+        """Detiene el hilo de reconciliación y cierra la base"""
+        self._stop.set()
+        with self.lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+    
+    def _touch(self):
+        self.version += 1
+        self._listing = None
+        self._views = {}
+    
+    @property
+    def etag(self):
+        """ETag del estado actual del catálogo"""
+        return f"{self.epoch:x}-{self.version}"
+    
+    def _commit(self):
+        if self._db is not None:
+            self._db.commit()
+    
+    def _put_locked(self, name, size, mtime):
+        previous = self.entries.get(name)
+        if previous is not None:
+            self.total_size -= previous['size']
+        self.entries[name] = self._make_entry(name, size, mtime)
+        self.total_size += size
+        if self._db is not None:
+            self._db.execute(
+                'INSERT OR REPLACE INTO files (name, size, modified) VALUES (?, ?, ?)',
+                (name, size, mtime)
+            )
+        self._touch()
+    
+    def _remove_locked(self, name):
+        entry = self.entries.pop(name, None)
+        if entry is None:
+            return False
+        self.total_size -= entry['size']
+        if self._db is not None:
+            self._db.execute('DELETE FROM files WHERE name = ?', (name,))
+        self._touch()
+        return True
+    
+    def add(self, filepath):
+        """Registra (o actualiza) un archivo recién guardado"""
+        filepath = Path(filepath)
+        if not self.file_manager.is_allowed_extension(filepath.name):
+            return
+        try:
+            st = filepath.stat()
+        except OSError:
+            return self.remove(filepath.name)
+        
+        with self.lock:
+            self._put_locked(filepath.name, st.st_size, st.st_mtime)
+            self._commit()
+    
+    def remove(self, name):
+        """Quita un archivo del catálogo"""
+        with self.lock:
+            if self._remove_locked(name):
+                self._commit()
+    
+    def _build_listing(self):
+        with self.lock:
+            if self._listing is None or self._listing[0] != self.version:
+                files = sorted(self.entries.values(), key=lambda x: x['modified'], reverse=True)
+                body = json.dumps({'files': files, 'count': len(files)}, ensure_ascii=False)
+                self._listing = (self.version, files, body)
+            return self._listing
+    
+    def totals(self):
+        """(número de archivos, bytes totales) sin tocar el disco"""
+        with self.lock:
+            return len(self.entries), self.total_size
+    
+    def list_files(self):
+        """Lista ordenada por fecha (más reciente primero), cacheada por versión"""
+        return self._build_listing()[1]
+    
+    def listing_json(self):
+        """JSON de /api/files ya serializado, cacheado por versión"""
+        return self._build_listing()[2]
+    
+    SORT_KEYS = {
+        'mtime': lambda e: (e['modified'], e['original_name']),
+        'size': lambda e: (e['size'], e['original_name']),
+        'name': lambda e: (e['original_name'].lower(), e['original_name']),
+    }
+    
+    MAX_VIEWS = 32  # vistas filtradas cacheadas por versión
+    
+    def _sorted_view(self, sort, file_type=None, since=None, until=None, prefix=None):
+        """
+        Vista ordenada (ascendente) por la clave pedida, cacheada por versión.
+        
+        Con filtros la vista se deriva una sola vez de la vista completa y se
+        guarda junto a ella, así que las páginas siguientes no vuelven a recorrer
+        el catálogo hasta que cambie la versión.
+        """
+        prefix_lower = prefix.lower() if prefix else None
+        filters = (file_type or None, since, until, prefix_lower)
+        with self.lock:
+            view = self._views.get((sort, filters))
+            if view is not None and view[0] == self.version:
+                return view
+            
+            if filters == (None, None, None, None):
+                key_func = self.SORT_KEYS[sort]
+                entries = sorted(self.entries.values(), key=key_func)
+                view = (self.version, [key_func(e) for e in entries], entries)
+            else:
+                _, all_keys, all_entries = self._sorted_view(sort)
+                keys = []
+                entries = []
+                for key, e in zip(all_keys, all_entries):
+                    if file_type and e['type'] != file_type:
+                        continue
+                    if since is not None and e['modified'] < since:
+                        continue
+                    if until is not None and e['modified'] >= until:
+                        continue
+                    if prefix_lower and not e['original_name'].lower().startswith(prefix_lower):
+                        continue
+                    keys.append(key)
+                    entries.append(e)
+                view = (self.version, keys, entries)
+                if len(self._views) >= self.MAX_VIEWS:
+                    # Descartar la vista filtrada más antigua; las completas se quedan
+                    for cached in list(self._views):
+                        if cached[1] != (None, None, None, None):
+                            del self._views[cached]
+                            break
+            self._views[(sort, filters)] = view
+            return view
+    
+    @staticmethod
+    def encode_cursor(key):
+        return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+    
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode('ascii'))))
+        except Exception:
+            raise ValueError("Cursor no válido")
+    
+    def query(self, sort='mtime', order='desc', file_type=None, since=None, until=None,
+              prefix=None, cursor=None, offset=0, limit=None):
+        """
+        Página de archivos filtrada y ordenada.
+        
+        El cursor es la clave de orden del último elemento devuelto, así que la
+        paginación sigue siendo estable aunque lleguen subidas nuevas entre páginas.
+        """
+        if sort not in self.SORT_KEYS:
+            raise ValueError(f"Orden no válido: {sort}")
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"Dirección no válida: {order}")
+        
+        _, keys, entries = self._sorted_view(sort, file_type, since, until, prefix)
+        descending = order == 'desc'
+        
+        # Posición (exclusiva en desc, inclusiva en asc) donde empieza la página
+        if cursor:
+            key = self.decode_cursor(cursor)
+            start = bisect.bisect_left(keys, key) if descending else bisect.bisect_right(keys, key)
+        else:
+            start = len(keys) if descending else 0
+        
+        if descending:
+            stop = max(start - offset, 0)
+            first = max(stop - limit, 0) if limit is not None else 0
+            page = entries[first:stop][::-1]
+            last_index = first if page else None
+        else:
+            first = min(start + offset, len(keys))
+            stop = min(first + limit, len(keys)) if limit is not None else len(keys)
+            page = entries[first:stop]
+            last_index = stop - 1 if page else None
+        
+        total = len(entries)
+        has_more = last_index is not None and limit is not None and len(page) == limit and (
+            last_index > 0 if descending else last_index < len(entries) - 1
+        )
+        next_cursor = self.encode_cursor(keys[last_index]) if has_more else None
+        return page, total, next_cursor
+
+def parse_date_arg(value, end_of_day=False):
+    """
+    Convierte un parámetro de fecha (timestamp o YYYY-MM-DD) a timestamp.
+    
+    Con end_of_day, una fecha sin hora cubre el día completo (límite exclusivo).
+    """
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Fecha no válida: {value}")
+    if end_of_day and len(value) == 10:
+        date += timedelta(days=1)
+    return date.timestamp()
+
+TAKEN_FORMAT = '%Y-%m-%d %H:%M:%S'  # fecha de captura en hora local de la cámara
+
+def _exif_text(value):
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    return value.strip('\x00 ').strip() if isinstance(value, str) else None
+
+def read_image_metadata(filepath):
+    """
+    Fecha de captura, cámara, dimensiones y presencia de GPS de una foto.
+    
+    Pillow solo lee la cabecera y el bloque EXIF; la imagen no se decodifica.
+    """
+    from PIL import Image
+    
+    try:
+        import pillow_heif  # opcional: soporte HEIC para Pillow
+        pillow_heif.register_heif_opener()
+    except ImportError:
+        pass
+    
+    with Image.open(filepath) as img:
+        width, height = img.size
+        exif = img.getexif()
+    
+    if exif.get(274) in (5, 6, 7, 8):  # Orientation: girada 90°, se guarda como se ve
+        width, height = height, width
+    meta = {'width': width, 'height': height}
+    
+    exif_ifd = exif.get_ifd(0x8769)
+    # DateTimeOriginal, DateTimeDigitized y, como último recurso, DateTime
+    for raw in (exif_ifd.get(36867), exif_ifd.get(36868), exif.get(306)):
+        try:
+            meta['taken'] = datetime.strptime(_exif_text(raw)[:19], '%Y:%m:%d %H:%M:%S').strftime(TAKEN_FORMAT)
+            break
+        except (TypeError, ValueError):
+            continue
+    
+    make, model = _exif_text(exif.get(271)), _exif_text(exif.get(272))
+    if make and model and model.lower().startswith(make.lower()):
+        make = None  # "Canon Canon EOS R6" -> "Canon EOS R6"
+    meta['camera'] = ' '.join(filter(None, (make, model))) or None
+    
+    gps_ifd = exif.get_ifd(0x8825)
+    meta['gps'] = 2 in gps_ifd and 4 in gps_ifd  # GPSLatitude y GPSLongitude
+    return meta
+
+MP4_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+MP4_SUFFIXES = ('.mp4', '.mov', '.m4v', '.3gp')
+MAX_MOOV_BYTES = 16 * 1024 * 1024
+
+def _iter_boxes(data, start, end):
+    """Cajas ISO BMFF (tipo, inicio del contenido, fin) dentro de data[start:end]"""
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield kind, pos + header, min(pos + size, end)
+        pos += size
+
+def _read_top_box(filepath, wanted):
+    """
+    Contenido de la primera caja de primer nivel de tipo wanted, o None.
+    
+    Se salta de cabecera en cabecera sin leer el resto (mdat puede ocupar GBs)
+    y se descartan cajas de más de MAX_MOOV_BYTES.
+    """
+    with open(filepath, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        pos = 0
+        while pos + 8 <= file_size:
+            f.seek(pos)
+            head = f.read(16)
+            size, kind = struct.unpack_from('>I4s', head)
+            header = 8
+            if size == 1:
+                if len(head) < 16:
+                    return None
+                size, header = struct.unpack_from('>Q', head, 8)[0], 16
+            elif size == 0:
+                size = file_size - pos
+            if size < header:
+                return None
+            if kind == wanted:
+                if size > MAX_MOOV_BYTES:
+                    return None
+                return (head[header:] + f.read(max(0, size - 16)))[:size - header]
+            pos += size
+    return None
+
+def read_heif_size(filepath):
+    """
+    Ancho y alto de un HEIC/HEIF sin decodificarlo, o None.
+    
+    Salen de las propiedades ispe (meta/iprp/ipco); la mayor es la imagen
+    principal (en los iPhone, la rejilla que junta las teselas de 512px).
+    """
+    try:
+        meta = _read_top_box(filepath, b'meta')
+    except OSError:
+        return None
+    if meta is None:
+        return None
+    best = None
+    # meta es una FullBox: versión y flags antes de las cajas hijas
+    for kind, start, end in _iter_boxes(meta, 4, len(meta)):
+        if kind != b'iprp':
+            continue
+        for child, child_start, child_end in _iter_boxes(meta, start, end):
+            if child != b'ipco':
+                continue
+            for prop, prop_start, prop_end in _iter_boxes(meta, child_start, child_end):
+                if prop == b'ispe' and prop_end - prop_start >= 12:
+                    width, height = struct.unpack_from('>II', meta, prop_start + 4)
+                    if best is None or width * height > best[0] * best[1]:
+                        best = (width, height)
+    return best
+
+def read_mp4_metadata(filepath):
+    """
+    Duración, fecha de creación y dimensiones de un MP4/MOV.
+    
+    Pillow no abre vídeos: se buscan las cajas de primer nivel saltando de
+    cabecera en cabecera hasta moov (que puede estar al final del archivo) y
+    solo se lee esa, con mvhd (duración y fecha) y los tkhd (dimensiones).
+    """
+    if Path(filepath).suffix.lower() not in MP4_SUFFIXES:
+        return {}
+    
+    moov = _read_top_box(filepath, b'moov')
+    if moov is None:
+        return {}
+    
+    meta = {}
+    for kind, start, end in _iter_boxes(moov, 0, len(moov)):
+        if kind == b'mvhd' and end - start >= (32 if moov[start] == 1 else 20):
+            if moov[start] == 1:
+                created, _, timescale, duration = struct.unpack_from('>QQIQ', moov, start + 4)
+            else:
+                created, _, timescale, duration = struct.unpack_from('>IIII', moov, start + 4)
+            if timescale:
+                meta['duration'] = round(duration / timescale, 3)
+            if created:
+                # mvhd va en UTC; se guarda en hora local como la fecha EXIF de las fotos
+                taken = MP4_EPOCH + timedelta(seconds=created)
+                meta['taken'] = taken.astimezone().strftime(TAKEN_FORMAT)
+        elif kind == b'trak':
+            for child, child_start, child_end in _iter_boxes(moov, start, end):
+                if child == b'tkhd' and child_end - child_start >= 84:
+                    # Ancho y alto en 16.16 al final de tkhd; las pistas de audio los tienen a 0
+                    width, height = struct.unpack_from('>II', moov, child_end - 8)
+                    if width and height and not meta.get('width'):
+                        meta['width'], meta['height'] = width >> 16, height >> 16
+    return meta
+
+def capture_time(filepath):
+    """Fecha de captura (timestamp) de una foto o un vídeo MP4/MOV, o None si no la tiene"""
+    try:
+        if Path(filepath).suffix.lower() in MP4_SUFFIXES:
+            meta = read_mp4_metadata(filepath)
+        else:
+            meta = read_image_metadata(filepath)
+        taken = meta.get('taken')
+        return datetime.strptime(taken, TAKEN_FORMAT).timestamp() if taken else None
+    except Exception:
+        return None
+
+def migrate_layout(upload_folder, layout, dry_run=False):
+    """
+    Reordena una carpeta de subidas existente según layout (p. ej. de plana a
+    AAAA/MM/DD). Los archivos solo se mueven dentro de la carpeta y conservan
+    su nombre, así que las URLs /uploads/<archivo> no cambian; tampoco el
+    catálogo, el índice de hashes ni el de metadatos, que van por nombre.
+    
+    Hay que ejecutarlo con el servidor parado. Con la disposición por fecha de
+    subida se usa la fecha de modificación de cada archivo. Devuelve un
+    resumen: movidos, ya en su sitio y nombres repetidos en varias carpetas
+    (que se dejan donde están).
+    """
+    folder = Path(upload_folder)
+    summary = {'moved': 0, 'kept': 0, 'duplicates': []}
+    seen = set()
+    plan = []
+    # Primero el plan completo: mover mientras se recorre alteraría el recorrido
+    for shard, item in walk_uploads(folder):
+        if item.name in seen:
+            summary['duplicates'].append(f"{shard}/{item.name}" if shard else item.name)
+            continue
+        seen.add(item.name)
+        when = None
+        if layout.kind == 'date':
+            when = capture_time(item.path) if layout.by_capture else None
+            if when is None:
+                when = item.stat().st_mtime
+        target = layout.shard_for(item.name, when)
+        if target == shard:
+            summary['kept'] += 1
+        else:
+            plan.append((item.name, shard, target))
+    
+    emptied = set()
+    for name, source, target in plan:
+        summary['moved'] += 1
+        if dry_run:
+            continue
+        target_dir = folder / target if target else folder
+        target_dir.mkdir(parents=True, exist_ok=True)
+        os.replace((folder / source if source else folder) / name, target_dir / name)
+        if source:
+            emptied.add(source)
+    
+    # Subcarpetas que quedaron vacías, de la más profunda a la raíz
+    for shard in sorted(emptied, key=lambda s: s.count('/'), reverse=True):
+        parts = shard.split('/')
+        while parts:
+            try:
+                (folder / '/'.join(parts)).rmdir()
+            except OSError:
+                break
+            parts.pop()
+    return summary
+
+class MetadataIndex:
+    """
+    Índice de metadatos (fecha de captura, cámara, dimensiones, GPS y duración)
+    en SQLite, extraído una sola vez por archivo en un hilo de fondo.
+    
+    El hilo compara el catálogo con lo indexado cada vez que cambia su versión,
+    así recoge subidas, conversiones HEIC y archivos copiados a mano. Las
+    consultas solo leen la base: nunca abren una imagen durante una petición.
+    """
+    
+    COLUMNS = ('name', 'size', 'modified', 'type', 'taken', 'dated',
+               'camera', 'width', 'height', 'gps', 'duration')
+    GROUPS = {
+        'day': 'substr(taken, 1, 10)',
+        'month': 'substr(taken, 1, 7)',
+        'year': 'substr(taken, 1, 4)',
+        'camera': "COALESCE(camera, '')",
+        'type': 'type',
+    }
+    POLL_INTERVAL = 5  # segundos entre comprobaciones de la versión del catálogo
+    BATCH = 200  # filas por transacción
+    
+    def __init__(self, catalog, db_path):
+        self.catalog = catalog
+        self.file_manager = catalog.file_manager
+        self.db_path = Path(db_path)
+        self.indexed = {}  # nombre -> (tamaño, mtime) con metadatos ya extraídos
+        self.pending = 0  # archivos que faltan por indexar en la pasada actual
+        self.lock = threading.Lock()
+        self._db = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+    
+    def load(self):
+        """Abre (o crea) la base y carga qué archivos están ya indexados"""
+        with self.lock:
+            self._db = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS media ('
+                'name TEXT PRIMARY KEY, size INTEGER NOT NULL, modified REAL NOT NULL, type TEXT NOT NULL, '
+                'taken TEXT NOT NULL, dated INTEGER NOT NULL, camera TEXT, width INTEGER, height INTEGER, '
+                'gps INTEGER, duration REAL) WITHOUT ROWID'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS media_taken ON media (taken)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS media_camera ON media (camera, taken)')
+            self._db.commit()
+            for name, size, mtime in self._db.execute('SELECT name, size, modified FROM media'):
+                self.indexed[name] = (size, mtime)
+    
+    def start(self):
+        """Lanza el hilo indexador"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='pyshare-metadata', daemon=True)
+            self._thread.start()
+    
+    def notify(self):
+        """Avisa de un archivo nuevo para no esperar a la siguiente comprobación"""
+        self._wake.set()
+    
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        with self.lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+    
+    def _run(self):
+        seen_version = None
+        while not self._stop.is_set():
+            version = self.catalog.version
+            if version != seen_version:
+                try:
+                    if self._sync(version):
+                        seen_version = version
+                except Exception as e:
+                    logging.getLogger(__name__).error(f"Error indexando metadatos: {e}")
+                    seen_version = version
+                continue
+            self._wake.wait(self.POLL_INTERVAL)
+            self._wake.clear()
+    
+    def _sync(self, version):
+        """Una pasada: borra lo que ya no existe y extrae lo nuevo o modificado"""
+        with self.catalog.lock:
+            current = {name: (e['size'], e['modified']) for name, e in self.catalog.entries.items()}
+        
+        with self.lock:
+            if self._db is None:
+                return True
+            gone = [name for name in self.indexed if name not in current]
+            for name in gone:
+                del self.indexed[name]
+            self._db.executemany('DELETE FROM media WHERE name = ?', [(name,) for name in gone])
+            self._db.commit()
+            # Lo más reciente primero: una subida nueva aparece antes que el histórico
+            todo = sorted((name for name, st in current.items() if self.indexed.get(name) != st),
+                          key=lambda name: current[name][1], reverse=True)
+        
+        self.pending = len(todo)
+        rows = []
+        for name in todo:
+            if self._stop.is_set():
+                return False
+            rows.append(self._extract(name, *current[name]))
+            self.pending -= 1
+            if len(rows) >= self.BATCH:
+                self._store(rows)
+                rows = []
+                if self.catalog.version != version:
+                    return False  # han llegado archivos: se vuelve a empezar por ellos
+        self._store(rows)
+        self.pending = 0
+        return True
+    
+    def _extract(self, name, size, mtime):
+        filepath = self.file_manager.path_for(name)
+        is_video = name.rsplit('.', 1)[-1].lower() in self.file_manager.VIDEO_EXTENSIONS
+        try:
+            meta = read_mp4_metadata(filepath) if is_video else read_image_metadata(filepath)
+        except Exception as e:
+            # Formato sin soporte o archivo dañado: queda indexado con la fecha del archivo
+            logging.getLogger(__name__).debug(f"Sin metadatos para {name}: {e}")
+            meta = {}
+        
+        taken = meta.get('taken')
+        dated = taken is not None
+        if not dated:
+            taken = datetime.fromtimestamp(mtime).strftime(TAKEN_FORMAT)
+        gps = meta.get('gps')
+        return (name, size, mtime, 'video' if is_video else 'photo', taken, int(dated),
+                meta.get('camera'), meta.get('width'), meta.get('height'),
+                None if gps is None else int(gps), meta.get('duration'))
+    
+    def _store(self, rows):
+        if not rows:
+            return
+        with self.lock:
+            if self._db is None:
+                return
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO media ({', '.join(self.COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(self.COLUMNS))})", rows
+            )
+            self._db.commit()
+            for row in rows:
+                self.indexed[row[0]] = (row[1], row[2])
+    
+    # --- consultas -------------------------------------------------------------
+    
+    @staticmethod
+    def parse_taken(value, end=False):
+        """
+        Fecha de un filtro (YYYY, YYYY-MM, YYYY-MM-DD o con hora) en el formato del
+        índice. Con end, una fecha parcial cubre el periodo completo (límite exclusivo).
+        """
+        if value is None or value == '':
+            return None
+        value = value.strip().replace('T', ' ')
+        for fmt in ('%Y', '%Y-%m', '%Y-%m-%d', '%Y-%m-%d %H:%M', TAKEN_FORMAT):
+            try:
+                date = datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+            if end and fmt == '%Y':
+                date = date.replace(year=date.year + 1)
+            elif end and fmt == '%Y-%m':
+                date = (date.replace(day=28) + timedelta(days=4)).replace(day=1)
+            elif end and fmt == '%Y-%m-%d':
+                date += timedelta(days=1)
+            return date.strftime(TAKEN_FORMAT)
+        raise ValueError(f"Fecha no válida: {value}")
+    
+    def _where(self, since=None, until=None, camera=None, file_type=None, gps=None):
+        clauses, params = [], []
+        if since is not None:
+            clauses.append('taken >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('taken < ?')
+            params.append(until)
+        if camera is not None:
+            clauses.append("COALESCE(camera, '') = ?")
+            params.append(camera)
+        if file_type is not None:
+            clauses.append('type = ?')
+            params.append(file_type)
+        if gps is not None:
+            clauses.append('gps = ?')
+            params.append(int(gps))
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+    
+    def _as_dict(self, row):
+        entry = dict(zip(self.COLUMNS, row))
+        entry['dated'] = bool(entry['dated'])
+        if entry['gps'] is not None:
+            entry['gps'] = bool(entry['gps'])
+        return entry
+    
+    def query(self, order='desc', offset=0, limit=100, **filters):
+        """Página de archivos por fecha de captura con los filtros dados, y el total"""
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"Dirección no válida: {order}")
+        where, params = self._where(**filters)
+        with self.lock:
+            if self._db is None:
+                return [], 0
+            total = self._db.execute(f'SELECT COUNT(*) FROM media{where}', params).fetchone()[0]
+            rows = self._db.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM media{where} "
+                f"ORDER BY taken {order.upper()}, name LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+        return [self._as_dict(row) for row in rows], total
+    
+    def groups(self, by='day', **filters):
+        """Recuento y tamaño por día, mes, año, cámara o tipo"""
+        if by not in self.GROUPS:
+            raise ValueError(f"Agrupación no válida: {by}")
+        key = self.GROUPS[by]
+        where, params = self._where(**filters)
+        # Las fechas, de la más reciente a la más antigua; el resto, por número de archivos
+        order = 'key DESC' if by in ('day', 'month', 'year') else 'count DESC, key'
+        with self.lock:
+            if self._db is None:
+                return []
+            rows = self._db.execute(
+                f'SELECT {key} AS key, COUNT(*) AS count, SUM(size), MIN(taken), MAX(taken) '
+                f'FROM media{where} GROUP BY key ORDER BY {order}', params
+            ).fetchall()
+        return [{'key': key, 'count': count, 'size': size, 'first': first, 'last': last}
+                for key, count, size, first, last in rows]
+    
+    def get(self, name):
+        """Metadatos de un archivo, o None si aún no está indexado"""
+        with self.lock:
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM media WHERE name = ?", (name,)
+            ).fetchone()
+        return self._as_dict(row) if row else None
+
+class UploadSessionError(Exception):
+    """Error de una sesión de subida, con el código HTTP a devolver"""
+    
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class UploadSessionManager:
+    """
+    Sesiones de subida por chunks reanudables.
+    
+    Cada sesión vive en temp/<id>/ con su session.json, un archivo de datos
+    preasignado donde cada chunk se escribe directamente en su offset (pwrite) y
+    un mapa de bytes con los chunks recibidos. Los chunks pueden llegar en
+    cualquier orden y en paralelo, lo recibido sobrevive a reinicios y finalizar
+    es solo un rename.
+    
+    Con hash_chunks el SHA-256 se calcula a medida que se completa el prefijo
+    contiguo de chunks, así que al finalizar el hash ya está hecho. El estado del
+    hash solo vive en memoria: una sesión recuperada tras un reinicio termina sin él.
+    """
+    
+    SESSION_ID_RE = re.compile(r'^[0-9a-f]{32,40}$')
+    DATA_FILE = 'data'
+    RECEIVED_FILE = 'received'
+    LAST_CHUNK_FILE = 'last.part'
+    MIN_CHUNK_SIZE = 64 * 1024  # salvo el último chunk
+    MAX_CHUNKS = 100_000  # acota el mapa de recibidos y las listas de missing()/status()
+    
+    MEMORY_ONLY = ('received', 'lock', 'hasher', 'hashed', 'hash_lock')
+    
+    def __init__(self, temp_folder, session_ttl=24 * 3600, hash_chunks=False):
+        self.temp_folder = Path(temp_folder)
+        self.session_ttl = session_ttl
+        self.hash_chunks = hash_chunks
+        self.sessions = {}
+        self.lock = threading.Lock()
+    
+    def _session_dir(self, upload_id):
+        if not self.SESSION_ID_RE.match(upload_id or ''):
+            raise UploadSessionError("ID de subida no válido", 404)
+        return self.temp_folder / upload_id
+    
+    def _save_meta(self, session):
+        meta = {k: v for k, v in session.items() if k not in self.MEMORY_ONLY}
+        tmp = self._session_dir(session['id']) / 'session.json.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp, tmp.with_suffix(''))
+    
+    @staticmethod
+    def _preallocate(path, size):
+        """Reserva el espacio del archivo final (fallocate o, si no hay, archivo disperso)"""
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            if size > 0 and hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                    return
+                except OSError:
+                    pass
+            os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+    
+    def create(self, filename, size, chunk_size, upload_id=None, client=None, total_chunks=None):
+        """
+        Crea una sesión nueva (o devuelve la existente si upload_id ya existe).
+        
+        Con size=None (protocolo antiguo de /upload-chunk) solo se conoce total_chunks;
+        el tamaño de chunk se aprende del primer chunk que no sea el último.
+        """
+        if size is None:
+            if not total_chunks or total_chunks < 1 or total_chunks > self.MAX_CHUNKS:
+                raise UploadSessionError("Número de chunks no válido")
+        elif size < 0 or not chunk_size or chunk_size <= 0:
+            raise UploadSessionError("Tamaño de chunk no válido")
+        elif size > chunk_size and chunk_size < self.MIN_CHUNK_SIZE:
+            raise UploadSessionError(f"Tamaño de chunk demasiado pequeño (mínimo {self.MIN_CHUNK_SIZE} bytes)")
+        elif math.ceil(size / chunk_size) > self.MAX_CHUNKS:
+            raise UploadSessionError(f"Demasiados chunks (máximo {self.MAX_CHUNKS})")
+        
+        upload_id = upload_id or secrets.token_hex(16)
+        with self.lock:
+            existing = self._load(upload_id)
+            if existing is not None:
+                return existing
+            
+            session_dir = self._session_dir(upload_id)
+            session_dir.mkdir(parents=True, exist_ok=True)
+            session = {
+                'id': upload_id,
+                'filename': filename,
+                'size': size,
+                'chunk_size': chunk_size,
+                'total_chunks': total_chunks if size is None else max(1, math.ceil(size / chunk_size)),
+                'created': time.time(),
+                'client': client,
+                'received': set(),
+                'lock': threading.Lock(),
+                'hasher': hashlib.sha256() if self.hash_chunks else None,
+                'hashed': 0,  # chunks del prefijo contiguo ya incluidos en el hash
+                'hash_lock': threading.Lock()
+            }
+            self._preallocate(session_dir / self.DATA_FILE, size or 0)
+            with open(session_dir / self.RECEIVED_FILE, 'wb') as f:
+                f.truncate(session['total_chunks'])
+            self._save_meta(session)
+            self.sessions[upload_id] = session
+        
+        self.cleanup_expired()
+        return session
+    
+    def _load(self, upload_id):
+        """Busca la sesión en memoria o la recupera del disco (tras un reinicio)"""
+        session = self.sessions.get(upload_id)
+        if session is not None:
+            return session
+        
+        session_dir = self._session_dir(upload_id)
+        meta_path = session_dir / 'session.json'
+        if not meta_path.exists():
+            return None
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                session = json.load(f)
+            with open(session_dir / self.RECEIVED_FILE, 'rb') as f:
+                bitmap = f.read()
+        except (OSError, ValueError):
+            return None
+        
+        session['received'] = {i for i, flag in enumerate(bitmap) if flag}
+        session['lock'] = threading.Lock()
+        session.update(hasher=None, hashed=0, hash_lock=threading.Lock())
+        self.sessions[upload_id] = session
+        return session
+    
+    def get(self, upload_id):
+        """Devuelve la sesión o lanza 404"""
+        with self.lock:
+            session = self._load(upload_id)
+        if session is None:
+            raise UploadSessionError("Sesión de subida no encontrada", 404)
+        return session
+    
+    def expected_length(self, session, index):
+        """Tamaño que debe tener el chunk index (None si aún no se conoce)"""
+        if index < 0 or index >= session['total_chunks']:
+            raise UploadSessionError(f"Índice de chunk fuera de rango: {index}")
+        if index < session['total_chunks'] - 1:
+            return session['chunk_size']
+        if session['size'] is None:
+            return None
+        return session['size'] - session['chunk_size'] * (session['total_chunks'] - 1)
+    
+    def _learn_chunk_size(self, session, index, length):
+        """Protocolo antiguo: fija el tamaño de chunk con el primer chunk intermedio"""
+        if session['chunk_size'] is not None or length is None or index >= session['total_chunks'] - 1:
+            return
+        if length < self.MIN_CHUNK_SIZE:
+            raise UploadSessionError(f"Tamaño de chunk demasiado pequeño (mínimo {self.MIN_CHUNK_SIZE} bytes)")
+        with session['lock']:
+            if session['chunk_size'] is None:
+                session['chunk_size'] = length
+                self._save_meta(session)
+    
+    @staticmethod
+    def _pwrite_stream(fd, stream, offset, expected, buffer_size):
+        """Copia el stream al descriptor a partir de offset sin buffers intermedios"""
+        written = 0
+        while True:
+            to_read = buffer_size if expected is None else min(buffer_size, expected - written + 1)
+            data = stream.read(to_read)
+            if not data:
+                break
+            if expected is not None and written + len(data) > expected:
+                raise UploadSessionError("Chunk más grande de lo esperado")
+            view = memoryview(data)
+            while view:
+                n = os.pwrite(fd, view, offset + written)
+                written += n
+                view = view[n:]
+        if expected is not None and written != expected:
+            raise UploadSessionError(f"Chunk incompleto: {written} de {expected} bytes")
+        return written
+    
+    def _check_max_size(self, session, index, length, max_size):
+        """Protocolo antiguo: descarta la sesión si el archivo ya no puede caber en max_size"""
+        if max_size is None or session['size'] is not None or length is None:
+            return
+        last = session['total_chunks'] - 1
+        if session['chunk_size'] is None:
+            minimum = length
+        else:
+            # Tamaño mínimo posible del archivo completo con lo que ya se sabe
+            minimum = session['chunk_size'] * last + (length if index == last else 1)
+        if minimum > max_size:
+            self.discard(session['id'])
+            raise UploadSessionError(f"Archivo demasiado grande: más de {max_size} bytes", 413)
+    
+    def _advance_hash(self, session):
+        """Añade al hash los chunks que completan el prefijo contiguo"""
+        with session['hash_lock']:
+            hasher = session['hasher']
+            if hasher is None:
+                return
+            session_dir = self._session_dir(session['id'])
+            last = session['total_chunks'] - 1
+            try:
+                while session['hashed'] <= last and session['hashed'] in session['received']:
+                    index = session['hashed']
+                    last_part = session_dir / self.LAST_CHUNK_FILE
+                    if index == last and last_part.exists():
+                        path, offset, length = last_part, 0, None
+                    else:
+                        path, offset = session_dir / self.DATA_FILE, index * (session['chunk_size'] or 0)
+                        length = session['chunk_size'] if index < last else None
+                    with open(path, 'rb') as f:
+                        f.seek(offset)
+                        remaining = length
+                        while remaining is None or remaining > 0:
+                            data = f.read(1024 * 1024 if remaining is None else min(1024 * 1024, remaining))
+                            if not data:
+                                break
+                            hasher.update(data)
+                            if remaining is not None:
+                                remaining -= len(data)
+                    session['hashed'] += 1
+            except OSError:
+                # Sin hash incremental: se calculará en segundo plano al finalizar
+                session['hasher'] = None
+    
+    def digest(self, session):
+        """SHA-256 del archivo si se calculó mientras llegaban los chunks (o None)"""
+        if session.get('hasher') is None or session['hashed'] != session['total_chunks']:
+            return None
+        return session['hasher'].hexdigest()
+    
+    def write_chunk(self, upload_id, index, stream, length=None, buffer_size=1024 * 1024, max_size=None):
+        """Escribe un chunk directamente en su offset del archivo final"""
+        session = self.get(upload_id)
+        self._learn_chunk_size(session, index, length)
+        expected = self.expected_length(session, index)
+        if expected is not None and length is not None and length != expected:
+            raise UploadSessionError(f"Tamaño de chunk incorrecto: {length} (esperado {expected})")
+        self._check_max_size(session, index, length, max_size)
+        
+        session_dir = self._session_dir(upload_id)
+        if session['chunk_size'] is None:
+            # Protocolo antiguo: el último chunk llegó antes que cualquier otro y su
+            # offset aún no se conoce; se aparca hasta el ensamblado
+            target, offset = session_dir / self.LAST_CHUNK_FILE, 0
+        else:
+            target, offset = session_dir / self.DATA_FILE, index * session['chunk_size']
+        
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT, 0o644)
+        start = time.perf_counter()
+        try:
+            written = self._pwrite_stream(fd, stream, offset, expected, buffer_size)
+        finally:
+            os.close(fd)
+        METRICS.observe_upload(written, time.perf_counter() - start, stage='chunk_write')
+        
+        # Marcar como recibido solo cuando el chunk está completo
+        fd = os.open(session_dir / self.RECEIVED_FILE, os.O_WRONLY)
+        try:
+            os.pwrite(fd, b'\x01', index)
+        finally:
+            os.close(fd)
+        
+        with session['lock']:
+            session['received'].add(index)
+        self._advance_hash(session)
+        return session
+    
+    def missing(self, session):
+        """Índices que faltan por recibir"""
+        return [i for i in range(session['total_chunks']) if i not in session['received']]
+    
+    def status(self, session):
+        """Resumen de la sesión para el cliente"""
+        return {
+            'uploadId': session['id'],
+            'filename': session['filename'],
+            'size': session['size'],
+            'chunkSize': session['chunk_size'],
+            'totalChunks': session['total_chunks'],
+            'received': sorted(session['received']),
+            'complete': len(session['received']) == session['total_chunks']
+        }
+    
+    @METRICS.timed('assemble')
+    def assemble(self, upload_id, final_path):
+        """Mueve el archivo de datos a final_path y borra la sesión; exige todos los chunks"""
+        session = self.get(upload_id)
+        with session['lock']:
+            if session.get('finalized'):
+                raise UploadSessionError("La sesión ya fue finalizada", 409)
+            missing = self.missing(session)
+            if missing:
+                raise UploadSessionError(f"Faltan {len(missing)} chunks", 409)
+            session['finalized'] = True
+        
+        # Espera a un hash en curso de otro chunk y añade lo que aún falte
+        self._advance_hash(session)
+        session_dir = self._session_dir(upload_id)
+        data_path = session_dir / self.DATA_FILE
+        try:
+            last_path = session_dir / self.LAST_CHUNK_FILE
+            if last_path.exists():
+                # Único caso con copia: el último chunk del protocolo antiguo llegó primero
+                chunk_size = session['chunk_size'] or 0
+                offset = chunk_size * (session['total_chunks'] - 1)
+                fd = os.open(data_path, os.O_WRONLY)
+                try:
+                    with open(last_path, 'rb') as f:
+                        self._pwrite_stream(fd, f, offset, None, 1024 * 1024)
+                finally:
+                    os.close(fd)
+            
+            os.replace(data_path, final_path)
+        except Exception:
+            session['finalized'] = False
+            raise
+        
+        self.discard(upload_id)
+        return session
+    
+    def discard(self, upload_id):
+        """Elimina la sesión y sus datos"""
+        session_dir = self._session_dir(upload_id)
+        with self.lock:
+            self.sessions.pop(upload_id, None)
+        shutil.rmtree(session_dir, ignore_errors=True)
+    
+    def cleanup_expired(self):
+        """Borra sesiones abandonadas sin actividad durante session_ttl"""
+        if not self.temp_folder.exists():
+            return
+        limit = time.time() - self.session_ttl
+        for session_dir in self.temp_folder.iterdir():
+            if not session_dir.is_dir() or not self.SESSION_ID_RE.match(session_dir.name):
+                continue
+            try:
+                # pwrite no toca el mtime del directorio, sí el del mapa de recibidos
+                received = session_dir / self.RECEIVED_FILE
+                last_activity = max(session_dir.stat().st_mtime,
+                                    received.stat().st_mtime if received.exists() else 0)
+                if last_activity < limit:
+                    self.discard(session_dir.name)
+            except OSError:
+                pass
+
+class ConversionQueue:
+    """
+    Cola de conversiones HEIC en un pool de procesos, fuera de la petición.
+    
+    El formato de salida (JPEG, WebP o AVIF), la calidad y los metadatos que
+    se conservan van en options. Cada conversión reserva la memoria estimada
+    de la imagen decodificada (según la cabecera, sin decodificarla) y solo se
+    lanzan las que caben en memory_budget: varias fotos de 48MP a la vez
+    esperan su turno en lugar de disparar la memoria. Una sola siempre pasa.
+    
+    Las conversiones pendientes se guardan en conversions.json y se reanudan al
+    arrancar; el estado de cada archivo se puede consultar mientras tanto. En
+    modo 'download' no se convierte nada al subir: el original se guarda tal
+    cual y se convierte solo si alguien lo descarga con ?convert=1.
+    """
+    
+    HEIC_SUFFIXES = ('.heic', '.heif')
+    MODES = ('upload', 'download')
+    MAX_FINISHED = 1000  # estados terminados que se recuerdan
+    BYTES_PER_PIXEL = 8  # imagen decodificada + copia en RGB + búferes del codificador
+    DEFAULT_PIXELS = 12_000_000  # si la cabecera no trae el tamaño
+    
+    def __init__(self, file_manager, state_path, workers=None, options=None,
+                 memory_budget=512 * 1024 * 1024, mode='upload'):
+        options = {**CONVERSION_DEFAULTS, **(options or {})}
+        if options['format'] not in CONVERSION_FORMATS:
+            raise ValueError(f"Formato de conversión no válido: {options['format']}")
+        if mode not in self.MODES:
+            raise ValueError(f"Modo de conversión no válido: {mode}")
+        self.file_manager = file_manager
+        self.state_path = Path(state_path)
+        self.workers = workers or os.cpu_count() or 1
+        self.options = options
+        self.mode = mode
+        self.memory_budget = memory_budget
+        self.memory_inflight = 0  # bytes estimados de las conversiones en marcha
+        self.running = 0
+        self.waiting = deque()  # (origen, destino, bytes estimados, Future)
+        self.status = OrderedDict()  # nombre original -> estado
+        self.pending = {}  # nombre original -> {'digest': ...}
+        self.lock = threading.Lock()
+        self.executor = None
+        self._format_checked = False
+        self.on_converted = None  # callback(origen, resultado, digest)
+    
+    @property
+    def suffix(self):
+        """Extensión de los archivos convertidos"""
+        return CONVERSION_FORMATS[self.options['format']][1]
+    
+    def is_convertible(self, filepath):
+        return Path(filepath).suffix.lower() in self.HEIC_SUFFIXES
+    
+    def needs_conversion(self, filepath):
+        """Si el archivo se convierte al subirlo (en modo 'download' se deja el original)"""
+        return self.mode == 'upload' and self.is_convertible(filepath)
+    
+    def _check_format(self):
+        # AVIF solo si Pillow sabe guardarlo; se comprueba al primer uso para no cargar Pillow al arrancar
+        with self.lock:
+            if self._format_checked:
+                return
+            self._format_checked = True
+            if self.options['format'] == 'avif' and not avif_available():
+                logging.getLogger(__name__).warning(
+                    "Pillow no puede guardar AVIF (falta pillow-avif-plugin); se convierte a JPEG")
+                self.options['format'] = 'jpeg'
+    
+    def _get_executor(self):
+        # spawn: el proceso principal tiene hilos (Flask, Tk) y fork no es seguro
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self.executor
+    
+    def estimate_memory(self, filepath):
+        """Bytes que ocupará la conversión de filepath, según las dimensiones de la cabecera"""
+        size = read_heif_size(filepath)
+        pixels = size[0] * size[1] if size else self.DEFAULT_PIXELS
+        return pixels * self.BYTES_PER_PIXEL
+    
+    def run(self, source, target):
+        """
+        Convierte source en target en cuanto haya un proceso libre y memoria
+        para ello. Devuelve un Future con los segundos de conversión.
+        """
+        self._check_format()
+        future = Future()
+        cost = self.estimate_memory(source)
+        with self.lock:
+            self.waiting.append((str(source), str(target), cost, future))
+        self._dispatch()
+        return future
+    
+    def _dispatch(self):
+        """Lanza, en orden de llegada, las conversiones que caben en el presupuesto"""
+        while True:
+            with self.lock:
+                if not self.waiting or self.running >= self.workers:
+                    return
+                if self.running and self.memory_inflight + self.waiting[0][2] > self.memory_budget:
+                    return
+                source, target, cost, future = self.waiting.popleft()
+                self.memory_inflight += cost
+                self.running += 1
+            try:
+                job = self._get_executor().submit(convert_image_file, source, target, dict(self.options))
+            except Exception as e:
+                self._release(cost)
+                future.set_exception(e)
+                continue
+            job.add_done_callback(lambda job, cost=cost, future=future: self._job_done(job, cost, future))
+    
+    def _release(self, cost):
+        with self.lock:
+            self.memory_inflight -= cost
+            self.running -= 1
+    
+    def _job_done(self, job, cost, future):
+        self._release(cost)
+        self._dispatch()
+        if job.cancelled():
+            future.cancel()
+            return
+        error = job.exception()
+        if error is None:
+            future.set_result(job.result())
+        else:
+            future.set_exception(error)
+    
+    def _save_state(self):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.pending, f)
+        os.replace(tmp, self.state_path)
+    
+    def _set_status(self, name, **status):
+        self.status[name] = status
+        self.status.move_to_end(name)
+        finished = [n for n, st in self.status.items() if st['status'] in ('done', 'error')]
+        for n in finished[:max(0, len(finished) - self.MAX_FINISHED)]:
+            del self.status[n]
+    
+    def submit(self, filepath, digest=None, target_name=None):
+        """
+        Encola la conversión de un archivo ya guardado.
+        
+        El nombre del resultado se reserva al encolar y se guarda en
+        conversions.json; al reanudar se reutiliza esa reserva. La conversión se
+        escribe en un temporal oculto y solo se mueve a su nombre al terminar,
+        así que el resultado nunca se ve a medias.
+        """
+        filepath = Path(filepath)
+        self._check_format()
+        with self.lock:
+            if filepath.name in self.pending:
+                return
+            self.pending[filepath.name] = {'digest': digest}
+        
+        if target_name is not None and not (target_name.endswith(self.suffix)
+                                            and self.file_manager.path_for(target_name).exists()):
+            # Reserva de un formato anterior (o perdida): se libera y se pide otra
+            self.file_manager.release_filename(target_name)
+            target_name = None
+        if target_name is None:
+            target_name = self.file_manager.get_unique_filename(filepath.with_suffix(self.suffix).name, near=filepath.name)
+        target = self.file_manager.path_for(target_name)
+        partial = target.with_name(f".{target.name}.converting")
+        with self.lock:
+            self.pending[filepath.name] = {'digest': digest, 'target': target_name}
+            self._set_status(filepath.name, status='pending')
+            self._save_state()
+        
+        self.run(filepath, partial).add_done_callback(
+            lambda f: self._finished(filepath, target, partial, digest, f))
+    
+    def _finished(self, source, target, partial, digest, future):
+        if future.cancelled():
+            # Parada del servidor: sigue en conversions.json (con su reserva) y se reanuda al arrancar
+            partial.unlink(missing_ok=True)
+            return
+        error = future.exception()
+        if error is None:
+            try:
+                os.replace(partial, target)
+            except OSError as e:
+                error = e
+        if error is None:
+            METRICS.stage('convert').observe(future.result())
+            try:
+                source.unlink()
+                self.file_manager.name_allocator.forget(source.name)
+            except OSError:
+                pass
+        else:
+            partial.unlink(missing_ok=True)
+            self.file_manager.release_filename(target.name)
+            logging.getLogger(__name__).error(f"Error convirtiendo {source.name}: {error}")
+        
+        with self.lock:
+            self.pending.pop(source.name, None)
+            if error is None:
+                self._set_status(source.name, status='done', result=target.name)
+            else:
+                self._set_status(source.name, status='error', error=str(error))
+            self._save_state()
+        
+        if error is None and self.on_converted:
+            self.on_converted(source, target, digest)
+    
+    def resume(self):
+        """Reencola las conversiones que quedaron pendientes antes de un reinicio"""
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for name, job in saved.items():
+            filepath = self.file_manager.path_for(name)
+            if filepath.exists():
+                self.submit(filepath, job.get('digest'), job.get('target'))
+            elif job.get('target'):
+                self.file_manager.release_filename(job['target'])
+    
+    def get_status(self, name):
+        with self.lock:
+            return self.status.get(name)
+    
+    def summary(self):
+        """Estado de todas las conversiones recientes"""
+        with self.lock:
+            return {name: dict(st) for name, st in self.status.items()}
+    
+    def stop(self):
+        with self.lock:
+            waiting, self.waiting = list(self.waiting), deque()
+        for _, _, _, future in waiting:
+            future.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+class DiskCache:
+    """
+    Archivos derivados de las subidas (miniaturas, conversiones) en disco, con
+    tamaño máximo y expulsión LRU.
+    
+    La clave combina el hash de contenido (si se conoce), tamaño y mtime, así que
+    un archivo modificado nunca sirve un derivado viejo. Cada derivado se genera
+    una sola vez aunque lo pidan varias peticiones a la vez.
+    """
+    
+    def __init__(self, file_manager, cache_dir, max_bytes=512 * 1024 * 1024, dedup=None):
+        self.file_manager = file_manager
+        self.cache_dir = Path(cache_dir).absolute()
+        self.max_bytes = max_bytes
+        self.dedup = dedup
+        self.entries = OrderedDict()  # nombre en caché -> bytes (orden LRU)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.inflight = {}  # clave -> Event (una sola generación por clave)
+    
+    def load(self):
+        """Recupera el contenido de la caché ordenado por último acceso"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        found = []
+        with os.scandir(self.cache_dir) as it:
+            for item in it:
+                if item.is_file() and not item.name.endswith('.tmp'):
+                    st = item.stat()
+                    found.append((st.st_atime, item.name, st.st_size))
+        found.sort()
+        with self.lock:
+            for _, name, size in found:
+                self.entries[name] = size
+                self.total_bytes += size
+    
+    def _cache_name(self, filepath, variant):
+        st = filepath.stat()
+        digest = None
+        if self.dedup is not None:
+            record = self.dedup.by_name.get(filepath.name)
+            if record is not None and record[1] == st.st_size and record[2] == st.st_mtime:
+                digest = record[0]
+        if digest is None:
+            digest = hashlib.sha256(filepath.name.encode('utf-8')).hexdigest()
+        key = hashlib.sha256(f"{digest}:{st.st_size}:{st.st_mtime_ns}".encode('ascii')).hexdigest()[:32]
+        return f"{key}_{variant}"
+    
+    def _touch(self, cache_name):
+        with self.lock:
+            if cache_name in self.entries:
+                self.entries.move_to_end(cache_name)
+                try:
+                    os.utime(self.cache_dir / cache_name)  # recencia persistente entre reinicios
+                except OSError:
+                    pass
+                return True
+        return False
+    
+    def _store(self, cache_name):
+        size = (self.cache_dir / cache_name).stat().st_size
+        with self.lock:
+            self.entries[cache_name] = size
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                old_name, old_size = self.entries.popitem(last=False)
+                self.total_bytes -= old_size
+                (self.cache_dir / old_name).unlink(missing_ok=True)
+    
+    def _produce(self, cache_name, build, stage):
+        """
+        Ruta del derivado cache_name, llamando a build(tmp) si no existe;
+        build escribe en tmp y aquí se mueve a su sitio.
+        """
+        target = self.cache_dir / cache_name
+        if self._touch(cache_name):
+            return target
+        
+        with self.lock:
+            event = self.inflight.get(cache_name)
+            owner = event is None
+            if owner:
+                event = self.inflight[cache_name] = threading.Event()
+        
+        if not owner:
+            event.wait()
+            if not target.exists():
+                raise OSError(f"No se pudo generar {cache_name}")
+            return target
+        
+        tmp = target.with_suffix(f'.{secrets.token_hex(4)}.tmp')
+        try:
+            with METRICS.timed(stage):
+                build(tmp)
+            os.replace(tmp, target)
+            self._store(cache_name)
+            return target
+        finally:
+            tmp.unlink(missing_ok=True)
+            with self.lock:
+                self.inflight.pop(cache_name, None)
+            event.set()
+
+class ThumbnailCache(DiskCache):
+    """
+    Miniaturas en disco con tamaño máximo y expulsión LRU.
+    
+    Se generan en segundo plano tras cada subida y bajo demanda si faltan.
+    """
+    
+    SIZES = (128, 256, 512, 1024)
+    DEFAULT_SIZE = 256
+    THUMB_EXTENSIONS = {'jpg', 'jpeg', 'png', 'webp', 'tiff', 'bmp'}
+    
+    def __init__(self, file_manager, cache_dir, max_bytes=512 * 1024 * 1024, dedup=None, workers=2):
+        super().__init__(file_manager, cache_dir, max_bytes, dedup)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+    
+    @classmethod
+    def normalize_size(cls, size):
+        """Ajusta el tamaño pedido al tamaño cacheado más cercano por arriba"""
+        for candidate in cls.SIZES:
+            if size <= candidate:
+                return candidate
+        return cls.SIZES[-1]
+    
+    def supports(self, filename):
+        return filename.rsplit('.', 1)[-1].lower() in self.THUMB_EXTENSIONS
+    
+    @staticmethod
+    def render(source, target, size):
+        """Genera la miniatura usando los atajos de decodificación de Pillow"""
+        from PIL import Image, ImageOps
+        
+        with Image.open(source) as img:
+            # JPEG: decodifica directamente a escala reducida (1/2, 1/4, 1/8)
+            img.draft('RGB', (size, size))
+            factor = min(img.width, img.height) // (size * 2)
+            if factor >= 2:
+                img = img.reduce(factor)
+            img = ImageOps.exif_transpose(img)
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.thumbnail((size, size))
+            img.save(target, 'JPEG', quality=80, optimize=True)
+    
+    def get(self, filename, size=DEFAULT_SIZE):
+        """Ruta de la miniatura, generándola si no existe"""
+        filepath = self.file_manager.path_for(filename)
+        size = self.normalize_size(size)
+        return self._produce(
+            self._cache_name(filepath, f"{size}.jpg"),
+            lambda tmp: self.render(filepath, tmp, size),
+            'thumbnail'
+        )
+    
+    def prefetch(self, filename, sizes=(DEFAULT_SIZE,)):
+        """Genera miniaturas en segundo plano tras una subida"""
+        if not self.supports(filename):
+            return
+        
+        def run():
+            for size in sizes:
+                try:
+                    self.get(filename, size)
+                except Exception as e:
+                    logging.getLogger(__name__).warning(f"Miniatura de {filename}: {e}")
+        
+        self.executor.submit(run)
+    
+    def stop(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class ConvertedCache(DiskCache):
+    """
+    Conversiones bajo demanda de los HEIC guardados sin convertir (modo
+    'download'): se generan al primer /uploads/<archivo>?convert=1, pasando por
+    el presupuesto de memoria de la cola de conversión, y se cachean en disco.
+    """
+    
+    def __init__(self, file_manager, conversions, cache_dir, max_bytes=2 * 1024 * 1024 * 1024, dedup=None):
+        super().__init__(file_manager, cache_dir, max_bytes, dedup)
+        self.conversions = conversions
+    
+    def supports(self, filename):
+        return self.conversions.is_convertible(filename)
+    
+    def download_name(self, filename):
+        """Nombre con el que se descarga la conversión (foto.heic -> foto.jpg)"""
+        return f"{os.path.splitext(filename)[0]}{self.conversions.suffix}"
+    
+    def get(self, filename):
+        """Ruta de la conversión de filename, convirtiéndolo si hace falta (bloquea)"""
+        filepath = self.file_manager.path_for(filename)
+        self.conversions._check_format()
+        # Las opciones entran en la clave: cambiar formato o calidad no sirve conversiones viejas
+        options = json.dumps(self.conversions.options, sort_keys=True)
+        variant = f"{hashlib.sha1(options.encode('utf-8')).hexdigest()[:8]}{self.conversions.suffix}"
+        
+        def build(tmp):
+            seconds = self.conversions.run(filepath, tmp).result()
+            METRICS.stage('convert').observe(seconds)
+        
+        return self._produce(self._cache_name(filepath, variant), build, 'convert_on_demand')
+
+class BatchArchive:
+    """
+    Archivo ZIP64 (sin compresión) o TAR de varios archivos de uploads/,
+    generado al vuelo con memoria constante y sin archivos temporales.
+    
+    El tamaño total se calcula antes de leer nada (Content-Length). El TAR solo
+    depende de nombres, tamaños y fechas, así que admite Range; el ZIP no, porque
+    sus descriptores y el directorio central llevan el CRC de todo lo anterior.
+    """
+    
+    FORMATS = {'zip': 'application/zip', 'tar': 'application/x-tar'}
+    BLOCK_SIZE = 256 * 1024
+    
+    def __init__(self, locate, names, fmt='zip'):
+        # locate: nombre -> ruta en disco (FileManager.path_for)
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Formato no válido: {fmt}")
+        self.format = fmt
+        self.files = []  # (nombre, ruta, tamaño, mtime)
+        for name in names:
+            path = Path(locate(name))
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                self.files.append((name, path, st.st_size, st.st_mtime))
+        
+        listing = hashlib.sha1(fmt.encode('ascii'))
+        for name, _, size, mtime in self.files:
+            listing.update(f"{name}\0{size}\0{mtime}\0".encode('utf-8', 'surrogateescape'))
+        self.etag = listing.hexdigest()
+        self.last_modified = max((f[3] for f in self.files), default=0)
+        
+        if fmt == 'tar':
+            self.segments = self._tar_segments()
+            self.size = sum(len(seg) if isinstance(seg, bytes) else seg[1] for seg in self.segments)
+        else:
+            self.size = sum(
+                30 + len(n.encode('utf-8')) + 20 + size + 24 + 46 + len(n.encode('utf-8')) + 28
+                for n, _, size, _ in self.files
+            ) + 56 + 20 + 22
+    
+    @property
+    def content_type(self):
+        return self.FORMATS[self.format]
+    
+    @property
+    def supports_ranges(self):
+        return self.format == 'tar'
+    
+    def __len__(self):
+        return len(self.files)
+    
+    @classmethod
+    def _read_file(cls, path, offset, count, crc=None):
+        """
+        Bloques de un archivo; si cambió de tamaño desde que se planificó el
+        archivo se rellena con ceros o se corta, para que los offsets sigan valiendo.
+        """
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            f = None
+        try:
+            if f is not None:
+                f.seek(offset)
+            while count > 0:
+                data = f.read(min(cls.BLOCK_SIZE, count)) if f is not None else b''
+                if not data:
+                    data = bytes(min(cls.BLOCK_SIZE, count))
+                count -= len(data)
+                if crc is not None:
+                    crc[0] = zlib.crc32(data, crc[0])
+                yield data
+        finally:
+            if f is not None:
+                f.close()
+    
+    # --- TAR -----------------------------------------------------------------
+    
+    def _tar_segments(self):
+        segments = []
+        total = 0
+        for name, path, size, mtime in self.files:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = int(mtime)
+            info.mode = 0o644
+            header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+            padding = -size % tarfile.BLOCKSIZE
+            segments += [header, (path, size)] + ([bytes(padding)] if padding else [])
+            total += len(header) + size + padding
+        # Fin de archivo: dos bloques vacíos, completando el último registro
+        end = 2 * tarfile.BLOCKSIZE
+        end += -(total + end) % tarfile.RECORDSIZE
+        segments.append(bytes(end))
+        return segments
+    
+    # --- ZIP64 ---------------------------------------------------------------
+    
+    @staticmethod
+    def _dos_datetime(mtime):
+        t = time.localtime(mtime)
+        if t.tm_year < 1980:
+            return 0, (1 << 5) | 1
+        return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), \
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    
+    def _zip_stream(self):
+        central = []
+        offset = 0
+        flags = 0x0808  # descriptor tras los datos + nombres UTF-8
+        for name, path, size, mtime in self.files:
+            encoded = name.encode('utf-8')
+            dos_time, dos_date = self._dos_datetime(mtime)
+            header = struct.pack(
+                '<IHHHHHIIIHH', 0x04034b50, 45, flags, 0, dos_time, dos_date,
+                0, 0xFFFFFFFF, 0xFFFFFFFF, len(encoded), 20
+            ) + encoded + struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+            yield header
+            
+            crc = [0]
+            yield from self._read_file(path, 0, size, crc)
+            yield struct.pack('<IIQQ', 0x08074b50, crc[0], size, size)
+            
+            central.append(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, 45, 45, flags, 0, dos_time, dos_date,
+                crc[0], 0xFFFFFFFF, 0xFFFFFFFF, len(encoded), 28, 0, 0, 0, 0o100644 << 16, 0xFFFFFFFF
+            ) + encoded + struct.pack('<HHQQQ', 0x0001, 24, size, size, offset))
+            offset += len(header) + size + 24
+        
+        directory = b''.join(central)
+        yield directory
+        count = len(self.files)
+        yield struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, len(directory), offset)
+        yield struct.pack('<IIQI', 0x07064b50, 0, offset + len(directory), 1)
+        yield struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, 0xFFFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0)
+    
+    # --- salida --------------------------------------------------------------
+    
+    def stream(self, start=0, end=None):
+        """Bytes [start, end) del archivo; los tramos parciales solo en TAR"""
+        end = self.size if end is None else end
+        if self.format == 'zip':
+            if start != 0 or end != self.size:
+                raise ValueError("El ZIP solo se genera completo")
+            yield from self._zip_stream()
+            return
+        
+        position = 0
+        for segment in self.segments:
+            length = len(segment) if isinstance(segment, bytes) else segment[1]
+            seg_start, seg_end = max(start, position), min(end, position + length)
+            if seg_start < seg_end:
+                if isinstance(segment, bytes):
+                    yield segment[seg_start - position:seg_end - position]
+                else:
+                    yield from self._read_file(segment[0], seg_start - position, seg_end - seg_start)
+            position += length
+            if position >= end:
+                return
+
+class UploadBusy(Exception):
+    """Subida rechazada por saturación: el cliente debe reintentar (503 + Retry-After)"""
+    
+    def __init__(self, retry_after=1):
+        super().__init__("Servidor ocupado. Reintenta en unos segundos.")
+        self.retry_after = retry_after
+
+class IOScheduler:
+    """
+    Planificador de E/S compartido por todas las subidas.
+    
+    Un número fijo de hilos ejecuta los trabajos de disco (validar y guardar
+    cada archivo). Cada cliente tiene su propia cola y los hilos las atienden
+    por turnos, así un móvil con cien fotos no deja esperando al resto.
+    
+    Además lleva un presupuesto global de bytes en vuelo: una subida solo se
+    admite si su tamaño cabe y, con varios clientes a la vez, si el cliente no
+    pasa de su parte. Si no, UploadBusy con un Retry-After estimado a partir
+    del ritmo al que se van liberando bytes. Rechazar pronto mantiene estable
+    el rendimiento en lugar de repartir el disco entre demasiadas subidas.
+    """
+    
+    RATE_WINDOW = 10  # segundos para estimar el ritmo de vaciado
+    MAX_RETRY_AFTER = 30
+    
+    def __init__(self, workers=4, max_queued=1000, max_inflight_bytes=512 * 1024 * 1024):
+        self.max_queued = max_queued
+        self.max_inflight_bytes = max_inflight_bytes
+        # Un archivo enorme cuenta como un cuarto del presupuesto para no quedarse fuera siempre
+        self.max_reservation = max(1, max_inflight_bytes // 4)
+        self.condition = threading.Condition()
+        self.queues = {}  # cliente -> deque de (future, fn, args)
+        self.ready = deque()  # clientes con trabajos pendientes, en orden de turno
+        self.queued = 0
+        self.inflight = {}  # cliente -> bytes admitidos
+        self.inflight_bytes = 0
+        self.released = deque()  # (instante, bytes) liberados en la ventana
+        self.rejected = 0
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self._worker, daemon=True, name=f'pyshare-io-{i}')
+            for i in range(max(1, workers))
+        ]
+        for thread in self.threads:
+            thread.start()
+    
+    # --- admisión --------------------------------------------------------------
+    
+    def _fits(self, client, nbytes):
+        if self.inflight_bytes == 0:
+            return True  # sin nada en vuelo siempre se admite: garantiza progreso
+        if self.inflight_bytes + nbytes > self.max_inflight_bytes:
+            return False
+        own = self.inflight.get(client, 0)
+        clients = len(self.inflight) + (client not in self.inflight)
+        return own == 0 or own + nbytes <= self.max_inflight_bytes / clients
+    
+    def _expire_released(self, now):
+        # Solo interesa la ventana reciente; sin esto crece una entrada por subida
+        while self.released and now - self.released[0][0] > self.RATE_WINDOW:
+            self.released.popleft()
+    
+    def _retry_after(self, nbytes):
+        self._expire_released(time.monotonic())
+        rate = sum(size for _, size in self.released) / self.RATE_WINDOW
+        excess = self.inflight_bytes + nbytes - self.max_inflight_bytes
+        if rate <= 0 or excess <= 0:
+            return 1
+        return min(self.MAX_RETRY_AFTER, max(1, math.ceil(excess / rate)))
+    
+    def reserve(self, client, nbytes):
+        """Reserva bytes del presupuesto (o UploadBusy); devuelve el ticket para release"""
+        nbytes = min(max(0, int(nbytes)), self.max_reservation)
+        with self.condition:
+            if not self._fits(client, nbytes):
+                self.rejected += 1
+                raise UploadBusy(self._retry_after(nbytes))
+            self.inflight[client] = self.inflight.get(client, 0) + nbytes
+            self.inflight_bytes += nbytes
+        return client, nbytes
+    
+    def release(self, ticket):
+        client, nbytes = ticket
+        with self.condition:
+            remaining = self.inflight.get(client, 0) - nbytes
+            if remaining > 0:
+                self.inflight[client] = remaining
+            else:
+                self.inflight.pop(client, None)
+            self.inflight_bytes -= nbytes
+            now = time.monotonic()
+            self._expire_released(now)
+            self.released.append((now, nbytes))
+    
+    @contextmanager
+    def admit(self, client, nbytes):
+        """Mantiene la reserva mientras dura el bloque"""
+        ticket = self.reserve(client, nbytes)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+    
+    # --- trabajos ----------------------------------------------------------------
+    
+    def submit_many(self, client, calls):
+        """
+        Encola [(fn, args), ...] en la cola del cliente y devuelve sus futures.
+        Se aceptan todos o ninguno: si la cola global está llena, UploadBusy.
+        """
+        futures = []
+        with self.condition:
+            if not self.running or self.queued + len(calls) > self.max_queued:
+                self.rejected += 1
+                raise UploadBusy(self._retry_after(0))
+            jobs = self.queues.get(client)
+            if jobs is None:
+                jobs = self.queues[client] = deque()
+                self.ready.append(client)
+            for fn, args in calls:
+                future = Future()
+                jobs.append((future, fn, args))
+                futures.append(future)
+            self.queued += len(calls)
+            self.condition.notify(len(calls))
+        return futures
+    
+    def _worker(self):
+        while True:
+            with self.condition:
+                while self.running and not self.ready:
+                    self.condition.wait()
+                if not self.ready:
+                    return
+                # Turno rotatorio: un trabajo del cliente y vuelve al final de la fila
+                client = self.ready.popleft()
+                jobs = self.queues[client]
+                future, fn, args = jobs.popleft()
+                self.queued -= 1
+                if jobs:
+                    self.ready.append(client)
+                else:
+                    del self.queues[client]
+            
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+    
+    def stats(self):
+        with self.condition:
+            return {'inflight_bytes': self.inflight_bytes, 'queued': self.queued, 'rejected': self.rejected}
+    
+    def stop(self):
+        """Cancela lo pendiente y deja terminar a los hilos"""
+        with self.condition:
+            self.running = False
+            for jobs in self.queues.values():
+                for future, _, _ in jobs:
+                    future.cancel()
+            self.queues.clear()
+            self.ready.clear()
+            self.queued = 0
+            self.condition.notify_all()
+
+class _Bucket:
+    """Estado de un cliente: tokens disponibles y último ajuste (reloj monotónico)"""
+    __slots__ = ('tokens', 'updated')
+    
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+class RateLimiter:
+    """
+    Rate limiting por token bucket: O(1) de memoria y de tiempo por cliente.
+    
+    El coste de una petición es 1 por defecto; los límites por bytes pasan el
+    tamaño del cuerpo. Los clientes inactivos se expulsan periódicamente, ya que
+    su bucket estaría lleno de todos modos.
+    """
+    
+    def __init__(self, max_requests=600, window_seconds=60, evict_interval=60):
+        self.max_requests = max_requests  # capacidad (peticiones o bytes) por ventana
+        self.window_seconds = window_seconds
+        self.rate = max_requests / window_seconds  # tokens por segundo
+        self.evict_interval = evict_interval
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self._last_eviction = time.monotonic()
+    
+    def _evict_idle(self, now):
+        idle_before = now - self.window_seconds
+        for client_ip in [ip for ip, b in self.buckets.items() if b.updated < idle_before]:
+            del self.buckets[client_ip]
+        self._last_eviction = now
+    
+    def check(self, client_ip, cost=1):
+        """
+        Consume cost tokens si hay saldo.
+        
+        Devuelve (permitido, segundos hasta poder reintentar). Un coste mayor que la
+        capacidad se admite con el bucket lleno y deja saldo negativo, para que un
+        chunk grande no quede bloqueado para siempre.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if now - self._last_eviction >= self.evict_interval:
+                self._evict_idle(now)
+            
+            bucket = self.buckets.get(client_ip)
+            if bucket is None:
+                bucket = self.buckets[client_ip] = _Bucket(self.max_requests, now)
+            else:
+                bucket.tokens = min(self.max_requests, bucket.tokens + (now - bucket.updated) * self.rate)
+                bucket.updated = now
+            
+            needed = min(cost, self.max_requests)
+            if bucket.tokens < needed:
+                return False, (needed - bucket.tokens) / self.rate
+            bucket.tokens -= cost
+            return True, 0
+    
+    def is_allowed(self, client_ip, cost=1):
+        """Verifica si el cliente puede hacer una nueva petición"""
+        return self.check(client_ip, cost)[0]
+
+class SendfileWrapper:
+    """
+    Cuerpo de respuesta que es un archivo (o un tramo): los servidores de
+    PyShare lo reconocen y lo envían con sendfile, sin copiarlo a Python.
+    
+    También sirve como wsgi.file_wrapper (file, block_size); en cualquier otro
+    servidor se itera por bloques como un archivo normal.
+    """
+    
+    def __init__(self, file, block_size=256 * 1024, offset=None, count=None):
+        self.file = file
+        self.block_size = block_size
+        self.offset = file.tell() if offset is None else offset
+        if count is None:
+            count = os.fstat(file.fileno()).st_size - self.offset
+        self.count = count
+    
+    def __iter__(self):
+        self.file.seek(self.offset)
+        remaining = self.count
+        while remaining > 0:
+            data = self.file.read(min(self.block_size, remaining))
+            if not data:
+                return
+            remaining -= len(data)
+            yield data
+    
+    def close(self):
+        self.file.close()
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """
+    Handler HTTP/1.1: reutiliza la conexión entre peticiones del mismo cliente.
+    
+    run_wsgi de Werkzeug siempre responde "Connection: close"; esta versión
+    mantiene la conexión si el cliente lo permite, descarta el cuerpo que la app
+    no leyó y envía las respuestas SendfileWrapper con socket.sendfile.
+    """
+    
+    protocol_version = 'HTTP/1.1'
+    MAX_DRAIN = 1024 * 1024  # cuerpo sin leer que se descarta antes de cerrar la conexión
+    
+    def setup(self):
+        super().setup()
+        # Cabecera y cuerpo salen en escrituras separadas: con Nagle, el cuerpo
+        # esperaría al ACK retardado del cliente (~40 ms por respuesta con keep-alive)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    
+    def log_request(self, code='-', size='-'):
+        # Sin una línea por petición: se agregan en ACCESS_LOG
+        try:
+            status = int(getattr(code, 'value', code))
+        except (TypeError, ValueError):
+            return
+        ACCESS_LOG.record(self.command, self.path, status)
+    
+    def run_wsgi(self):
+        if self.headers.get('Expect', '').lower().strip() == '100-continue':
+            self.wfile.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        
+        self.environ = environ = self.make_environ()
+        environ['wsgi.file_wrapper'] = SendfileWrapper
+        
+        connection = self.headers.get('Connection', '').lower()
+        keep_alive = (self.request_version == 'HTTP/1.1' and 'close' not in connection) or \
+            (self.request_version == 'HTTP/1.0' and 'keep-alive' in connection)
+        body = None
+        if environ.get('wsgi.input_terminated'):
+            keep_alive = False  # chunked: no sabemos dónde acaba sin leerlo entero
+        else:
+            try:
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                length, keep_alive = 0, False
+            body = LimitedStream(self.rfile, length)
+            environ['wsgi.input'] = body
+            environ['wsgi.input_terminated'] = True
+        
+        state = {'status': None, 'headers': None, 'sent': False, 'chunked': False}
+        
+        def write(data):
+            if not state['sent']:
+                state['sent'] = True
+                code_str, _, msg = state['status'].partition(' ')
+                code = int(code_str)
+                self.send_response(code, msg)
+                header_keys = set()
+                for key, value in state['headers']:
+                    self.send_header(key, value)
+                    header_keys.add(key.lower())
+                if not ('content-length' in header_keys or environ['REQUEST_METHOD'] == 'HEAD'
+                        or 100 <= code < 200 or code in (204, 304)):
+                    state['chunked'] = True
+                    self.send_header('Transfer-Encoding', 'chunked')
+                self.send_header('Connection', 'keep-alive' if keep_alive else 'close')
+                self.end_headers()
+            
+            if data and environ['REQUEST_METHOD'] != 'HEAD':
+                if state['chunked']:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                else:
+                    self.wfile.write(data)
+        
+        def start_response(status, headers, exc_info=None):
+            if exc_info and state['sent']:
+                raise exc_info[1].with_traceback(exc_info[2])
+            state['status'] = status
+            state['headers'] = headers
+            return write
+        
+        def execute(app):
+            application_iter = app(environ, start_response)
+            try:
+                if isinstance(application_iter, SendfileWrapper) and not state['chunked']:
+                    write(b'')
+                    if environ['REQUEST_METHOD'] != 'HEAD' and application_iter.count:
+                        self.connection.sendfile(application_iter.file, application_iter.offset,
+                                                 application_iter.count)
+                else:
+                    for data in application_iter:
+                        write(data)
+                    if not state['sent']:
+                        write(b'')
+                    if state['chunked']:
+                        self.wfile.write(b'0\r\n\r\n')
+            finally:
+                if hasattr(application_iter, 'close'):
+                    application_iter.close()
+        
+        try:
+            execute(self.server.app)
+        except (ConnectionError, socket.timeout) as e:
+            self.connection_dropped(e, environ)
+            keep_alive = False
+        except Exception as e:
+            keep_alive = False
+            if not state['sent']:
+                try:
+                    execute(InternalServerError())
+                except Exception:
+                    pass
+            self.server.log('error', f"Error on request: {e!r}")
+        
+        # Para reutilizar la conexión hay que consumir el cuerpo que la app no leyó
+        if keep_alive and body is not None and not body.is_exhausted:
+            if body.limit - body.tell() <= self.MAX_DRAIN:
+                try:
+                    body.exhaust()
+                except ClientDisconnected:
+                    keep_alive = False
+            else:
+                keep_alive = False
+        self.close_connection = not keep_alive
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    Servidor WSGI con un pool de hilos acotado y keep-alive.
+    
+    A diferencia del servidor de desarrollo (un hilo nuevo por conexión), las
+    conexiones se atienden con un número fijo de hilos; las que no caben esperan
+    en el backlog del socket en vez de crear hilos sin límite.
+    """
+    
+    multithread = True
+    
+    def __init__(self, host, port, app, threads=32, backlog=256, keepalive_timeout=5):
+        self.request_queue_size = backlog
+        
+        handler = type('Handler', (KeepAliveRequestHandler,), {'timeout': keepalive_timeout})
+        super().__init__(host, port, app, handler=handler)
+        self.threads = threads
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='pyshare-http')
+        self._slots = threading.BoundedSemaphore(threads)
+    
+    def process_request(self, request, client_address):
+        # Bloquear el bucle de accept cuando todos los hilos están ocupados (backpressure)
+        self._slots.acquire()
+        self.pool.submit(self._process_request_thread, request, client_address)
+    
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+    
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+class ServerController:
+    """
+    Arranque, parada y reinicio del servidor HTTP en un hilo propio.
+    
+    backend 'pooled' usa PooledWSGIServer; 'waitress' usa waitress si está instalado;
+    'async' usa el motor asyncio (pyshare.async_engine), que necesita el PyShareServer.
+    """
+    
+    BACKENDS = ('pooled', 'waitress', 'async')
+    
+    def __init__(self, app, host='0.0.0.0', port=8730, backend='pooled', threads=32, keepalive_timeout=5,
+                 max_connections=2048, core=None):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Backend no válido: {backend}")
+        if backend == 'async' and core is None:
+            raise ValueError("El backend 'async' necesita el PyShareServer (core)")
+        self.app = app
+        self.core = core
+        self.host = host
+        self.port = port
+        self.backend = backend
+        self.threads = threads
+        self.keepalive_timeout = keepalive_timeout
+        self.max_connections = max_connections
+        self.server = None
+        self.thread = None
+        self.on_error = None  # callback(excepción) si el servidor cae
+    
+    @property
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+    
+    def _create_server(self):
+        if self.backend == 'waitress':
+            try:
+                from waitress import create_server
+            except ImportError:
+                raise RuntimeError("El backend 'waitress' requiere: pip install waitress")
+            return create_server(
+                self.app, host=self.host, port=self.port,
+                threads=self.threads, channel_timeout=max(self.keepalive_timeout, 60)
+            )
+        if self.backend == 'async':
+            from pyshare.async_engine import AsyncEngine
+            return AsyncEngine(
+                self.core, self.host, self.port, io_workers=self.threads,
+                max_connections=self.max_connections, keepalive_timeout=self.keepalive_timeout
+            )
+        return PooledWSGIServer(
+            self.host, self.port, self.app,
+            threads=self.threads, keepalive_timeout=self.keepalive_timeout
+        )
+    
+    def _serve(self):
+        try:
+            if self.backend == 'waitress':
+                self.server.run()
+            else:
+                self.server.serve_forever()
+        except Exception as e:
+            if self.on_error:
+                self.on_error(e)
+    
+    def start(self):
+        """Abre el socket (los errores como puerto ocupado salen aquí) y sirve en segundo plano"""
+        if self.is_running:
+            return
+        self.server = self._create_server()
+        self.thread = threading.Thread(target=self._serve, name='pyshare-server', daemon=True)
+        self.thread.start()
+    
+    def stop(self, timeout=10):
+        """Deja de aceptar conexiones y espera a que termine el bucle del servidor"""
+        server, self.server = self.server, None
+        if server is None:
+            return
+        if self.backend == 'waitress':
+            server.close()
+        else:
+            server.shutdown()
+            server.server_close()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.thread = None
+    
+    def restart(self):
+        self.stop()
+        self.start()
+
+class PyShareServer:
+    """
+    Servidor de subidas sin interfaz: configuración, componentes, rutas Flask y
+    servidor HTTP. La GUI Tk (app.py) y la línea de comandos (python -m pyshare)
+    se construyen sobre esta clase.
+    """
+    
+    DEFAULT_CONFIG = {
+        'host': '0.0.0.0',
+        'port': 8730,
+        'upload_dir': 'uploads',
+        'max_size_mb': 500,
+    }
+    
+    def __init__(self, config=None, config_file='config.json'):
+        # Configuración: config.json y, por encima, los valores pasados (CLI/entorno)
+        self.CONFIG_FILE = Path(config_file)
+        cfg = {**self.DEFAULT_CONFIG, **self.load_config(), **(config or {})}
+        self.config = cfg
+        
+        self.HOST = cfg['host']
+        self.PORT = int(cfg['port'])
+        self.UPLOAD_FOLDER = cfg['upload_dir']
+        self.CHUNK_SIZE = 32768  # 32KB
+        self.STREAM_BUFFER_SIZE = int(cfg.get('stream_buffer_size', 1024 * 1024))  # buffer de /upload-stream
+        # Planificador de subidas de la página: peticiones en paralelo, chunk y lote
+        self.upload_concurrency = int(cfg.get('upload_concurrency', 4))
+        self.upload_chunk_size = int(cfg.get('upload_chunk_mb', 4) * 1024 * 1024)
+        self.upload_batch_size = int(cfg.get('upload_batch_mb', 16) * 1024 * 1024)
+        # Modo rápido de la página: lado mayor y calidad JPEG de las fotos reducidas
+        self.reduce_max_px = int(cfg.get('reduce_max_px', 2048))
+        self.reduce_quality = float(cfg.get('reduce_quality', 0.85))
+        self.server_config = {
+            'backend': cfg.get('server_backend', 'pooled'),
+            'threads': int(cfg.get('server_threads', 32)),
+            'keepalive_timeout': float(cfg.get('keepalive_timeout', 5)),
+            'max_connections': int(cfg.get('max_connections', 2048)),
+        }
+        
+        # Variables de estado
+        self.is_running = False
+        self.server_thread = None
+        self.stats = {'photos': 0, 'size': 0, 'uploads': 0}
+        self.stats_lock = threading.Lock()
+        
+        # Configurar logging
+        self.setup_logging()
+        
+        # Inicializar componentes
+        upload_folder = Path(self.UPLOAD_FOLDER).absolute()
+        upload_folder.mkdir(parents=True, exist_ok=True)
+        layout = StorageLayout(cfg.get('storage_layout', 'flat'), cfg.get('storage_date', 'upload'))
+        self.file_manager = FileManager(upload_folder, max_size_mb=cfg['max_size_mb'], layout=layout)
+        self.setup_rate_limits(cfg.get('rate_limits', {}))
+        
+        # Catálogo de archivos (se llena una vez y lo mantienen las rutas de subida)
+        self.catalog = FileCatalog(self.file_manager, db_path=cfg.get('catalog_db'))
+        self.catalog.load()
+        self.catalog.on_change = self.update_stats
+        self.catalog.start_watcher()
+        
+        # Deduplicación por contenido
+        self.dedup = DedupIndex(
+            self.file_manager,
+            db_path=cfg.get('dedup_db') or self.state_db(upload_folder, 'hashes.sqlite'),
+            mode=cfg.get('dedup', 'skip')
+        )
+        self.dedup.load()
+        if self.dedup.enabled:
+            self.dedup.index_missing(list(self.catalog.entries))
+        
+        # Índice de metadatos (EXIF y duración de vídeos), extraídos en segundo plano
+        self.metadata = None
+        if cfg.get('metadata_index', True):
+            self.metadata = MetadataIndex(
+                self.catalog, cfg.get('metadata_db') or self.state_db(upload_folder, 'metadata.sqlite')
+            )
+            self.metadata.load()
+            self.metadata.start()
+        
+        # Sesiones de subida por chunks (reanudables)
+        self.upload_sessions = UploadSessionManager(upload_folder / 'temp', hash_chunks=self.dedup.enabled)
+        
+        # Planificador de E/S compartido: hilos de disco, turnos por cliente y control de admisión
+        self.io_scheduler = IOScheduler(
+            workers=int(cfg.get('io_workers', 4)),
+            max_queued=int(cfg.get('io_queue_size', 1000)),
+            max_inflight_bytes=int(cfg.get('upload_inflight_mb', 512) * 1024 * 1024)
+        )
+        
+        # Conversión HEIC en segundo plano
+        self.conversions = ConversionQueue(
+            self.file_manager,
+            upload_folder / 'temp' / 'conversions.json',
+            workers=cfg.get('conversion_workers'),
+            options={
+                'format': cfg.get('conversion_format', 'jpeg'),
+                'quality': int(cfg.get('conversion_quality', 95)),
+                'progressive': bool(cfg.get('conversion_progressive', False)),
+                'keep_exif': bool(cfg.get('conversion_keep_exif', True)),
+                'keep_icc': bool(cfg.get('conversion_keep_icc', True)),
+                'decode_threads': cfg.get('conversion_decode_threads'),
+            },
+            memory_budget=int(cfg.get('conversion_memory_mb', 512) * 1024 * 1024),
+            mode=cfg.get('conversion_mode', 'upload')
+        )
+        self.conversions.on_converted = self.on_converted
+        self.converted = ConvertedCache(
+            self.file_manager,
+            self.conversions,
+            cfg.get('converted_cache', str(upload_folder / '.converted')),
+            max_bytes=int(cfg.get('converted_cache_mb', 2048) * 1024 * 1024),
+            dedup=self.dedup
+        )
+        self.converted.load()
+        
+        # Miniaturas cacheadas en disco
+        self.thumbnails = ThumbnailCache(
+            self.file_manager,
+            cfg.get('thumbnail_cache', str(upload_folder / '.thumbs')),
+            max_bytes=int(cfg.get('thumbnail_cache_mb', 512) * 1024 * 1024),
+            dedup=self.dedup
+        )
+        self.thumbnails.load()
+        
+        # Configurar Flask y servidor HTTP
+        self.setup_flask()
+        self.server = ServerController(self.app, host=self.HOST, port=self.PORT, core=self, **self.server_config)
+        self.server.on_error = lambda e: self.logger.error(f"Error del servidor: {e}")
+        
+        # Retomar conversiones interrumpidas
+        self.conversions.resume()
+        self.update_stats()
+    
+    @staticmethod
+    def state_db(upload_folder, name):
+        """
+        Ruta por defecto de una base SQLite interna: en temp/, junto a
+        conversions.json, que no se publica en /uploads. Una base de versiones
+        anteriores en uploads/.<name> se traslada allí en lugar de reconstruirse.
+        """
+        path = upload_folder / 'temp' / name
+        legacy = upload_folder / f'.{name}'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if legacy.exists() and not path.exists():
+            for suffix in ('', '-wal', '-shm'):
+                source = legacy.with_name(legacy.name + suffix)
+                if source.exists():
+                    os.replace(source, path.with_name(path.name + suffix))
+        return str(path)
+    
+    def load_config(self):
+        """Carga configuración desde config.json"""
+        try:
+            if self.CONFIG_FILE.exists():
+                with open(self.CONFIG_FILE, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"No se pudo cargar config: {e}")
+        # Valores por defecto
+        return {}
+
+    def save_config(self, config):
+        """Guarda configuración en config.json (se mezcla con la existente)"""
+        try:
+            config = {**self.load_config(), **config}
+            with open(self.CONFIG_FILE, 'w', encoding='utf-8') as f:
+                json.dump(config, f, indent=2)
+            return True
+        except Exception as e:
+            self.logger.error(f"Error guardando config: {e}")
+            return False
+
+    def setup_logging(self):
+        """Configura el logging: cola sin bloqueo, archivo con rotación y accesos agregados"""
+        cfg = self.config
+        self.log_pipeline = LogPipeline.install(
+            cfg.get('log_file', 'pyshare.log'),
+            max_bytes=int(cfg.get('log_max_mb', 5) * 1024 * 1024),
+            backups=int(cfg.get('log_backups', 3))
+        )
+        ACCESS_LOG.interval = float(cfg.get('access_log_interval', 60))
+        self.logger = logging.getLogger(__name__)
+    
+    # Límites por ruta (nombre de la vista). "requests" cuenta peticiones y "bytes"
+    # el tamaño del cuerpo, por ventana de "window" segundos.
+    DEFAULT_RATE_LIMITS = {
+        'default': {'requests': 600, 'window': 60},
+        'upload_chunk': {'bytes': 10 * 1024 ** 3, 'window': 60},
+        'upload_session_chunk': {'bytes': 10 * 1024 ** 3, 'window': 60},
+    }
+    
+    def setup_rate_limits(self, overrides):
+        """Crea un RateLimiter por ruta a partir de los valores por defecto y config.json"""
+        limits = {**self.DEFAULT_RATE_LIMITS, **overrides}
+        self.rate_limiters = {}
+        for route, spec in limits.items():
+            by_bytes = 'bytes' in spec
+            limiter = RateLimiter(
+                max_requests=spec['bytes'] if by_bytes else spec['requests'],
+                window_seconds=spec.get('window', 60)
+            )
+            self.rate_limiters[route] = (limiter, by_bytes)
+        self.rate_limiter = self.rate_limiters['default'][0]
+    
+    def rate_limit(self, f):
+        """Decorator para rate limiting (límite propio de la ruta o el general)"""
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            client_ip = request.remote_addr
+            limiter, by_bytes = self.rate_limiters.get(request.endpoint, self.rate_limiters['default'])
+            cost = (request.content_length or 0) if by_bytes else 1
+            allowed, retry_after = limiter.check(client_ip, cost)
+            if not allowed:
+                self.logger.warning(f"Rate limit exceeded for IP: {client_ip}")
+                response = jsonify({'error': 'Demasiadas peticiones. Intenta más tarde.'})
+                response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                return response, 429
+            return f(*args, **kwargs)
+        return decorated_function
+    
+    def admit_upload(self, f):
+        """Decorator de control de admisión: reserva el cuerpo en el presupuesto de bytes en vuelo"""
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            size = request.content_length or self.upload_chunk_size
+            try:
+                with self.io_scheduler.admit(request.remote_addr, size):
+                    return f(*args, **kwargs)
+            except UploadBusy as e:
+                return self.busy_response(e)
+        return decorated_function
+    
+    def busy_response(self, error):
+        """503 con Retry-After: la página reintenta sola cuando el servidor se libera"""
+        self.logger.warning(f"Servidor saturado, subida rechazada de {request.remote_addr}")
+        response = jsonify({'error': str(error)})
+        response.headers['Retry-After'] = str(error.retry_after)
+        return response, 503
+        
+    # Margen sobre max_size para las cabeceras multipart (el límite por archivo se aplica aparte)
+    MULTIPART_OVERHEAD = 1024 * 1024
+    SMALL_FILE_LIMIT = 10 * 1024 * 1024  # los archivos más grandes se suben por sesiones
+    
+    def client_upload_config(self):
+        """Parámetros del planificador de subidas que se inyectan en la página"""
+        max_size = self.file_manager.max_size
+        return {
+            'concurrency': max(1, self.upload_concurrency),
+            'chunkSize': max(64 * 1024, min(self.upload_chunk_size, max_size)),
+            'batchBytes': max(1, min(self.upload_batch_size, max_size)),
+            'smallFileLimit': min(self.SMALL_FILE_LIMIT, max_size),
+            'maxSize': max_size,
+            'reduceMaxPx': self.reduce_max_px,
+            'reduceQuality': self.reduce_quality,
+        }
+    
+    def setup_flask(self):
+        """Configura el servidor Flask optimizado"""
+        self.app = Flask(__name__, static_url_path='', static_folder='.', root_path=str(PROJECT_DIR))
+        self.app.config['MAX_CONTENT_LENGTH'] = self.file_manager.max_size + self.MULTIPART_OVERHEAD
+        self.app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # Evitar cache
+        self.app.config['JSON_SORT_KEYS'] = False  # Mejorar performance JSON
+        self.metrics = METRICS
+        
+        # Latencia por ruta (hasta que la respuesta empieza a enviarse)
+        @self.app.before_request
+        def start_timer():
+            g.request_started = time.perf_counter()
+        
+        @self.app.teardown_request
+        def stop_timer(error=None):
+            started = g.pop('request_started', None)
+            if started is not None:
+                self.metrics.request(request.endpoint or 'not_found').observe(time.perf_counter() - started)
+        
+        @self.app.route('/metrics')
+        def metrics():
+            """Métricas en formato de texto de Prometheus"""
+            with self.stats_lock:
+                stats = dict(self.stats)
+            io_stats = self.io_scheduler.stats()
+            gauges = [
+                ('pyshare_files', 'Archivos en la carpeta de subidas', stats['photos']),
+                ('pyshare_storage_bytes', 'Tamaño total de los archivos', stats['size']),
+                ('pyshare_uploads', 'Subidas completadas desde el arranque', stats['uploads']),
+                ('pyshare_conversions_pending', 'Conversiones HEIC en cola', len(self.conversions.pending)),
+                ('pyshare_conversion_memory_bytes', 'Memoria estimada de las conversiones en curso', self.conversions.memory_inflight),
+                ('pyshare_conversions_waiting', 'Conversiones esperando memoria o proceso libre', len(self.conversions.waiting)),
+                ('pyshare_upload_sessions', 'Sesiones de subida por chunks abiertas', len(self.upload_sessions.sessions)),
+                ('pyshare_io_inflight_bytes', 'Bytes de subidas admitidas en curso', io_stats['inflight_bytes']),
+                ('pyshare_io_queued_jobs', 'Archivos esperando un hilo de E/S', io_stats['queued']),
+                ('pyshare_io_rejected', 'Subidas rechazadas por saturación desde el arranque', io_stats['rejected']),
+            ]
+            return self.app.response_class(self.metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+        
+        # Rutas optimizadas
+        @self.app.route('/api/files')
+        def api_files():
+            try:
+                etag = self.catalog.etag
+                if request.if_none_match.contains(etag):
+                    response = self.app.response_class(status=304)
+                    response.set_etag(etag)
+                    return response
+                
+                args = request.args
+                if not args:
+                    # Listado completo (compatibilidad): JSON ya serializado
+                    response = self.app.response_class(self.catalog.listing_json(), mimetype='application/json')
+                else:
+                    try:
+                        limit = args.get('limit', type=int)
+                        if limit is not None:
+                            limit = max(1, min(limit, 1000))
+                        file_type = args.get('type') or None
+                        if file_type and file_type not in ('photo', 'video'):
+                            raise ValueError(f"Tipo no válido: {file_type}")
+                        
+                        files, total, next_cursor = self.catalog.query(
+                            sort=args.get('sort', 'mtime'),
+                            order=args.get('order', 'desc'),
+                            file_type=file_type,
+                            since=parse_date_arg(args.get('since')),
+                            until=parse_date_arg(args.get('until'), end_of_day=True),
+                            prefix=args.get('prefix') or None,
+                            cursor=args.get('cursor') or None,
+                            offset=max(0, args.get('offset', 0, type=int)),
+                            limit=limit
+                        )
+                    except ValueError as e:
+                        return jsonify({'error': str(e)}), 400
+                    
+                    response = jsonify({'files': files, 'count': total, 'next_cursor': next_cursor})
+                
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'no-cache'
+                return response
+                
+            except Exception as e:
+                self.logger.error(f"Error obteniendo archivos: {e}")
+                return jsonify({'error': f'Error obteniendo archivos: {str(e)}'}), 500
+
+        def media_filters(args):
+            """Filtros comunes de /api/media: date (un día, mes o año), since/until, camera, type, gps"""
+            file_type = args.get('type') or None
+            if file_type and file_type not in ('photo', 'video'):
+                raise ValueError(f"Tipo no válido: {file_type}")
+            gps = args.get('gps')
+            date = args.get('date')
+            return {
+                'since': MetadataIndex.parse_taken(date or args.get('since')),
+                'until': MetadataIndex.parse_taken(date or args.get('until'), end=True),
+                'camera': args.get('camera'),
+                'file_type': file_type,
+                'gps': None if gps in (None, '') else gps.lower() in ('1', 'true', 'yes'),
+            }
+        
+        @self.app.route('/api/media')
+        def api_media():
+            """Búsqueda por fecha de captura, cámara o GPS desde el índice de metadatos"""
+            if not self.metadata:
+                return jsonify({'error': 'Índice de metadatos desactivado'}), 404
+            args = request.args
+            try:
+                limit = max(1, min(args.get('limit', 100, type=int), 1000))
+                files, total = self.metadata.query(
+                    order=args.get('order', 'desc'),
+                    offset=max(0, args.get('offset', 0, type=int)),
+                    limit=limit,
+                    **media_filters(args)
+                )
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            # pending > 0: el indexador aún no ha terminado y el resultado puede estar incompleto
+            return jsonify({'files': files, 'count': total, 'pending': self.metadata.pending})
+        
+        @self.app.route('/api/media/groups')
+        def api_media_groups():
+            """Recuento por día, mes, año, cámara o tipo (p. ej. ?by=day&date=2023-07)"""
+            if not self.metadata:
+                return jsonify({'error': 'Índice de metadatos desactivado'}), 404
+            try:
+                groups = self.metadata.groups(by=request.args.get('by', 'day'), **media_filters(request.args))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            return jsonify({'groups': groups, 'pending': self.metadata.pending})
+        
+        @self.app.route('/api/media/<filename>')
+        def api_media_file(filename):
+            """Metadatos de un archivo"""
+            entry = self.metadata.get(filename) if self.metadata else None
+            if entry is None:
+                return jsonify({'error': 'Sin metadatos (no existe o aún no está indexado)'}), 404
+            return jsonify(entry)
+        
+        @self.app.route('/')
+        def index():
+            return '''
+            <!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Transferir Fotos</title>
+    <style>
+        * { 
+            box-sizing: border-box; 
+            margin: 0; 
+            padding: 0; 
+        }
+        
+        body { 
+            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
+            background: #fafafa;
+            color: #333;
+            line-height: 1.6;
+            padding: 40px 20px;
+        }
+        
+        .container { 
+            max-width: 500px; 
+            margin: 0 auto; 
+        }
+        
+        h1 { 
+            text-align: center; 
+            margin-bottom: 40px; 
+            font-weight: 300;
+            font-size: 1.8em;
+            color: #666;
+        }
+        
+        .drop-zone {
+            border: 2px dashed #ddd;
+            padding: 40px 20px;
+            text-align: center;
+            border-radius: 8px;
+            margin-bottom: 30px;
+            transition: all 0.2s ease;
+            background: white;
+        }
+        
+        .drop-zone:hover { 
+            border-color: #999; 
+        }
+        
+        .drop-zone.dragover { 
+            border-color: #007bff;
+            background: #f8f9ff;
+        }
+        
+        .drop-text {
+            color: #666;
+            margin-bottom: 20px;
+            font-size: 14px;
+        }
+        
+        input[type="file"] { 
+            display: none; 
+        }
+        
+        .upload-btn {
+            background: #007bff;
+            color: white;
+            border: none;
+            padding: 10px 24px;
+            border-radius: 4px;
+            font-size: 14px;
+            cursor: pointer;
+            transition: background 0.2s;
+            font-weight: 500;
+        }
+        
+        .upload-btn:hover { 
+            background: #0056b3; 
+        }
+        
+        .progress { 
+            width: 100%;
+            height: 4px;
+            background: #e9ecef;
+            border-radius: 2px;
+            margin: 20px 0;
+            overflow: hidden;
+            display: none;
+        }
+        
+        .progress-bar { 
+            height: 100%;
+            background: #007bff;
+            width: 0%;
+            transition: width 0.3s ease;
+        }
+        
+        .status { 
+            text-align: center;
+            margin: 20px 0;
+            font-size: 14px;
+            color: #666;
+        }
+        
+        .upload-options {
+            margin-top: 15px;
+            font-size: 13px;
+            color: #666;
+            display: flex;
+            flex-wrap: wrap;
+            gap: 8px 20px;
+            justify-content: center;
+        }
+        
+        .status.success { color: #28a745; }
+        .status.error { color: #dc3545; }
+        
+        .file-list { 
+            margin-top: 30px; 
+        }
+        
+        .file-list-title {
+            font-size: 14px;
+            color: #666;
+            margin-bottom: 15px;
+            text-transform: uppercase;
+            letter-spacing: 0.5px;
+            font-weight: 500;
+            display: flex;
+            justify-content: space-between;
+            align-items: center;
+        }
+        
+        .file-list-title .download-link {
+            text-transform: none;
+            letter-spacing: 0;
+        }
+        
+        .file-item {
+            background: white;
+            padding: 15px;
+            margin-bottom: 8px;
+            border-radius: 4px;
+            display: flex;
+            justify-content: space-between;
+            align-items: center;
+            border: 1px solid #e9ecef;
+            font-size: 14px;
+        }
+        
+        .file-name {
+            color: #333;
+            flex: 1;
+        }
+        
+        .thumb {
+            width: 48px;
+            height: 48px;
+            object-fit: cover;
+            border-radius: 4px;
+            margin-right: 12px;
+            background: #e9ecef;
+        }
+        
+        .file-size {
+            color: #999;
+            font-size: 12px;
+            margin-left: 10px;
+        }
+        
+        .download-link {
+            color: #007bff;
+            text-decoration: none;
+            font-size: 12px;
+            text-transform: uppercase;
+            letter-spacing: 0.5px;
+            font-weight: 500;
+        }
+        
+        .download-link:hover {
+            text-decoration: underline;
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>Transferir Fotos</h1>
+        
+        <div class="drop-zone" id="dropZone">
+            <div class="drop-text">Arrastra archivos aquí o selecciona desde tu dispositivo</div>
+            <button class="upload-btn" onclick="document.getElementById('fileInput').click()">
+                Seleccionar Archivos
+            </button>
+            <input type="file" id="fileInput" multiple accept="image/*,video/*">
+        </div>
+        
+        <div class="upload-options">
+            <label><input type="checkbox" id="skipKnown" checked> Omitir archivos que ya están en el PC</label>
+            <label><input type="checkbox" id="reducedMode"> Modo rápido (fotos reducidas)</label>
+        </div>
+        
+        <div class="progress" id="progressContainer">
+            <div class="progress-bar" id="progressBar"></div>
+        </div>
+        
+        <div class="status" id="status"></div>
+        
+        <div class="file-list" id="fileList"></div>
+        <div id="fileListSentinel"></div>
+    </div>
+    
+    <script type="text/js-worker" id="hashWorkerSource">
+        // Worker de hashing: SHA-256 de archivos sin bloquear la página.
+        // crypto.subtle solo existe en contextos seguros (HTTPS/localhost); por
+        // HTTP en la red local se usa esta implementación incremental.
+        const K = new Uint32Array([
+            0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+            0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+            0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+            0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+            0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+            0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+            0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+            0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+        ]);
+        
+        class Sha256 {
+            constructor() {
+                this.h = new Uint32Array([
+                    0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19
+                ]);
+                this.w = new Uint32Array(64);
+                this.buffer = new Uint8Array(64);
+                this.buffered = 0;
+                this.length = 0;
+            }
+            
+            update(data) {
+                let offset = 0;
+                this.length += data.length;
+                if (this.buffered) {
+                    const take = Math.min(64 - this.buffered, data.length);
+                    this.buffer.set(data.subarray(0, take), this.buffered);
+                    this.buffered += take;
+                    offset = take;
+                    if (this.buffered < 64) return;
+                    this.block(this.buffer, 0);
+                    this.buffered = 0;
+                }
+                for (; offset + 64 <= data.length; offset += 64) this.block(data, offset);
+                this.buffer.set(data.subarray(offset));
+                this.buffered = data.length - offset;
+            }
+            
+            block(data, offset) {
+                const w = this.w, h = this.h;
+                for (let t = 0; t < 16; t++, offset += 4) {
+                    w[t] = (data[offset] << 24) | (data[offset + 1] << 16) | (data[offset + 2] << 8) | data[offset + 3];
+                }
+                for (let t = 16; t < 64; t++) {
+                    const a = w[t - 15], b = w[t - 2];
+                    const s0 = ((a >>> 7) | (a << 25)) ^ ((a >>> 18) | (a << 14)) ^ (a >>> 3);
+                    const s1 = ((b >>> 17) | (b << 15)) ^ ((b >>> 19) | (b << 13)) ^ (b >>> 10);
+                    w[t] = (w[t - 16] + s0 + w[t - 7] + s1) | 0;
+                }
+                let a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], k = h[7];
+                for (let t = 0; t < 64; t++) {
+                    const S1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+                    const t1 = (k + S1 + ((e & f) ^ (~e & g)) + K[t] + w[t]) | 0;
+                    const S0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+                    const t2 = (S0 + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+                    k = g; g = f; f = e; e = (d + t1) | 0;
+                    d = c; c = b; b = a; a = (t1 + t2) | 0;
+                }
+                h[0] += a; h[1] += b; h[2] += c; h[3] += d; h[4] += e; h[5] += f; h[6] += g; h[7] += k;
+            }
+            
+            hex() {
+                const bits = this.length * 8;
+                const tail = new Uint8Array((this.buffered < 56 ? 64 : 128) - this.buffered);
+                tail[0] = 0x80;
+                const view = new DataView(tail.buffer);
+                view.setUint32(tail.length - 8, Math.floor(bits / 0x100000000));
+                view.setUint32(tail.length - 4, bits >>> 0);
+                this.update(tail);
+                return Array.from(this.h, x => x.toString(16).padStart(8, '0')).join('');
+            }
+        }
+        
+        const READ_SIZE = 4 * 1024 * 1024;
+        const SUBTLE_LIMIT = 256 * 1024 * 1024;  // por encima no se carga el archivo entero en memoria
+        
+        async function hashFile(file, id) {
+            if (self.crypto && crypto.subtle && file.size <= SUBTLE_LIMIT) {
+                const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+                return Array.from(new Uint8Array(digest), x => x.toString(16).padStart(2, '0')).join('');
+            }
+            const hasher = new Sha256();
+            for (let offset = 0; offset < file.size; offset += READ_SIZE) {
+                const data = new Uint8Array(await file.slice(offset, offset + READ_SIZE).arrayBuffer());
+                hasher.update(data);
+                self.postMessage({ id, loaded: Math.min(offset + READ_SIZE, file.size) });
+            }
+            return hasher.hex();
+        }
+        
+        self.onmessage = async event => {
+            const { id, file } = event.data;
+            try {
+                self.postMessage({ id, hash: await hashFile(file, id) });
+            } catch (error) {
+                self.postMessage({ id, error: error.message });
+            }
+        };
+    </script>
+    
+    <script>
+        const dropZone = document.getElementById('dropZone');
+        const fileInput = document.getElementById('fileInput');
+        const status = document.getElementById('status');
+        const progressBar = document.getElementById('progressBar');
+        const progressContainer = document.getElementById('progressContainer');
+        
+        // Drag & Drop handlers
+        ['dragenter', 'dragover', 'dragleave', 'drop'].forEach(eventName => {
+            dropZone.addEventListener(eventName, preventDefaults, false);
+        });
+        
+        function preventDefaults(e) { 
+            e.preventDefault(); 
+            e.stopPropagation(); 
+        }
+        
+        ['dragenter', 'dragover'].forEach(eventName => {
+            dropZone.addEventListener(eventName, () => dropZone.classList.add('dragover'));
+        });
+        
+        ['dragleave', 'drop'].forEach(eventName => {
+            dropZone.addEventListener(eventName, () => dropZone.classList.remove('dragover'));
+        });
+        
+        dropZone.addEventListener('drop', handleDrop);
+        fileInput.addEventListener('change', e => handleFiles(e.target.files));
+        
+        function handleDrop(e) { 
+            handleFiles(e.dataTransfer.files); 
+        }
+        
+        // Valores del servidor (config.json): concurrencia, tamaño de chunk y de lote
+        const UPLOAD_CONFIG = __UPLOAD_CONFIG__;
+        const CHUNK_SIZE = UPLOAD_CONFIG.chunkSize;             // chunks de las sesiones reanudables
+        const SMALL_FILE_LIMIT = UPLOAD_CONFIG.smallFileLimit;  // hasta aquí, los archivos van en lotes
+        const BATCH_BYTES = UPLOAD_CONFIG.batchBytes;           // presupuesto de bytes por lote multipart
+        const BATCH_MAX_FILES = 100;
+        const MAX_RETRIES = 5;
+        
+        // Error transitorio (red, 429, 5xx): se reintenta con backoff
+        class RetryableError extends Error {
+            constructor(message, retryAfter = 0) {
+                super(message);
+                this.retryAfter = retryAfter;
+            }
+        }
+        
+        // XHR en vez de fetch para tener progreso de subida
+        function sendRequest(method, url, { body = null, headers = {}, onProgress = null } = {}) {
+            return new Promise((resolve, reject) => {
+                const xhr = new XMLHttpRequest();
+                xhr.open(method, url);
+                for (const [name, value] of Object.entries(headers)) xhr.setRequestHeader(name, value);
+                if (onProgress) xhr.upload.onprogress = e => onProgress(e.lengthComputable ? e.loaded / e.total : 0);
+                xhr.onload = () => {
+                    let data = {};
+                    try { data = JSON.parse(xhr.responseText); } catch (e) {}
+                    if (xhr.status === 429 || xhr.status >= 500) {
+                        const retryAfter = Number(xhr.getResponseHeader('Retry-After')) || 0;
+                        reject(new RetryableError(data.error || `HTTP ${xhr.status}`, retryAfter));
+                    } else if (xhr.status >= 400) {
+                        const error = new Error(data.error || `HTTP ${xhr.status}`);
+                        error.status = xhr.status;
+                        reject(error);
+                    } else {
+                        resolve(data);
+                    }
+                };
+                xhr.onerror = () => reject(new RetryableError('Error de red'));
+                xhr.send(body);
+            });
+        }
+        
+        // Cola de peticiones con una concurrencia fija, compartida por lotes y chunks
+        class UploadScheduler {
+            constructor(concurrency) {
+                this.concurrency = concurrency;
+                this.active = 0;
+                this.queue = [];
+            }
+            
+            run(job) {
+                return new Promise((resolve, reject) => {
+                    this.queue.push({ job, resolve, reject, attempt: 0 });
+                    this.next();
+                });
+            }
+            
+            next() {
+                while (this.active < this.concurrency && this.queue.length) {
+                    const task = this.queue.shift();
+                    this.active++;
+                    task.job()
+                        .then(task.resolve, error => {
+                            if (!(error instanceof RetryableError) || task.attempt >= MAX_RETRIES) {
+                                task.reject(error);
+                                return;
+                            }
+                            // Backoff exponencial con jitter; Retry-After del servidor manda si es mayor
+                            task.attempt++;
+                            const base = Math.max(error.retryAfter * 1000, Math.min(30000, 500 * 2 ** task.attempt));
+                            setTimeout(() => {
+                                this.queue.unshift(task);
+                                this.next();
+                            }, base * (0.5 + Math.random() / 2));
+                        })
+                        .finally(() => {
+                            this.active--;
+                            this.next();
+                        });
+                }
+            }
+        }
+        
+        function formatBytes(bytes) {
+            const units = ['B', 'KB', 'MB', 'GB'];
+            let i = 0;
+            while (bytes >= 1024 && i < units.length - 1) {
+                bytes /= 1024;
+                i++;
+            }
+            return `${bytes.toFixed(i ? 1 : 0)}${units[i]}`;
+        }
+        
+        // Bytes enviados y velocidad media de los últimos segundos, de todas las peticiones
+        class ProgressTracker {
+            constructor(totalBytes, totalFiles) {
+                this.totalBytes = Math.max(totalBytes, 1);
+                this.totalFiles = totalFiles;
+                this.sent = 0;
+                this.filesDone = 0;
+                this.started = performance.now();
+                this.samples = [[this.started, 0]];
+                this.timer = setInterval(() => this.render(), 500);
+            }
+            
+            // Petición con progreso; si falla, sus bytes se descuentan para el reintento
+            send(method, url, options, payloadBytes) {
+                let counted = 0;
+                const update = bytes => {
+                    this.sent += bytes - counted;
+                    counted = bytes;
+                };
+                return sendRequest(method, url, { ...options, onProgress: fraction => update(fraction * payloadBytes) })
+                    .then(data => {
+                        update(payloadBytes);
+                        return data;
+                    }, error => {
+                        update(0);
+                        throw error;
+                    });
+            }
+            
+            skip(bytes) {
+                this.sent += bytes;
+            }
+            
+            fileDone(count = 1) {
+                this.filesDone += count;
+                this.render();
+            }
+            
+            rate() {
+                const now = performance.now();
+                this.samples.push([now, this.sent]);
+                while (this.samples.length > 2 && now - this.samples[0][0] > 5000) this.samples.shift();
+                const [t0, b0] = this.samples[0];
+                return now > t0 ? (this.sent - b0) / ((now - t0) / 1000) : 0;
+            }
+            
+            render() {
+                const rate = this.rate();
+                progressBar.style.width = Math.min(100, (this.sent / this.totalBytes) * 100) + '%';
+                let text = `${this.filesDone}/${this.totalFiles} archivos · ${formatBytes(rate)}/s`;
+                if (rate > 0 && this.sent < this.totalBytes) {
+                    text += ` · quedan ~${Math.ceil((this.totalBytes - this.sent) / rate)}s`;
+                }
+                status.innerHTML = text;
+            }
+            
+            stop() {
+                clearInterval(this.timer);
+                const seconds = (performance.now() - this.started) / 1000;
+                return seconds > 0 ? this.sent / seconds : 0;
+            }
+        }
+        
+        const skipKnownInput = document.getElementById('skipKnown');
+        const reducedModeInput = document.getElementById('reducedMode');
+        
+        // Las opciones de subida se recuerdan entre visitas
+        for (const input of [skipKnownInput, reducedModeInput]) {
+            const saved = localStorage.getItem(`pyshare-option:${input.id}`);
+            if (saved !== null) input.checked = saved === '1';
+            input.addEventListener('change', () => localStorage.setItem(`pyshare-option:${input.id}`, input.checked ? '1' : '0'));
+        }
+        
+        // SHA-256 de cada archivo (clave: objeto File), calculado en Web Workers
+        const fileHashes = new WeakMap();
+        let hashWorkers = null;
+        
+        function getHashWorkers() {
+            if (!hashWorkers) {
+                const source = document.getElementById('hashWorkerSource').textContent;
+                const url = URL.createObjectURL(new Blob([source], { type: 'text/javascript' }));
+                const count = Math.max(1, Math.min(2, navigator.hardwareConcurrency || 2));
+                hashWorkers = Array.from({ length: count }, () => new Worker(url));
+            }
+            return hashWorkers;
+        }
+        
+        function hashFiles(files, onProgress) {
+            return new Promise(resolve => {
+                const queue = files.filter(file => !fileHashes.has(file));
+                let running = 0;
+                let done = files.length - queue.length;
+                
+                const next = worker => {
+                    const file = queue.shift();
+                    if (!file) {
+                        if (!running) resolve();
+                        return;
+                    }
+                    running++;
+                    const finish = hash => {
+                        if (hash) fileHashes.set(file, hash);
+                        running--;
+                        onProgress(++done);
+                        next(worker);
+                    };
+                    worker.onmessage = event => {
+                        if (event.data.loaded === undefined) finish(event.data.hash);
+                    };
+                    worker.onerror = () => finish(null);
+                    worker.postMessage({ id: done, file });
+                };
+                getHashWorkers().forEach(next);
+            });
+        }
+        
+        // {hash: nombre} de los hashes que el servidor ya tiene; si falla, se sube todo
+        async function checkKnownHashes(hashes) {
+            const known = {};
+            for (let i = 0; i < hashes.length; i += 10000) {
+                try {
+                    const data = await sendRequest('POST', '/api/hashes/check', {
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ hashes: hashes.slice(i, i + 10000) })
+                    });
+                    Object.assign(known, data.known || {});
+                } catch (error) {
+                    console.error('Error comprobando hashes:', error);
+                }
+            }
+            return known;
+        }
+        
+        // Modo rápido: fotos reescaladas y recodificadas a JPEG en el navegador
+        const REDUCIBLE_TYPES = ['jpg', 'jpeg', 'png', 'webp', 'heic', 'heif', 'bmp'];
+        
+        async function reduceImage(file) {
+            const ext = file.name.split('.').pop().toLowerCase();
+            if (!REDUCIBLE_TYPES.includes(ext) || !window.createImageBitmap) return file;
+            try {
+                // HEIC solo se decodifica en Safari; si no se puede, se sube el original
+                const bitmap = await createImageBitmap(file);
+                const scale = Math.min(1, UPLOAD_CONFIG.reduceMaxPx / Math.max(bitmap.width, bitmap.height));
+                const canvas = document.createElement('canvas');
+                canvas.width = Math.round(bitmap.width * scale);
+                canvas.height = Math.round(bitmap.height * scale);
+                canvas.getContext('2d').drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+                bitmap.close();
+                
+                const blob = await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', UPLOAD_CONFIG.reduceQuality));
+                if (!blob || blob.size >= file.size) return file;
+                const name = file.name.replace(/\.[^.]+$/, '') + '.jpg';
+                return new File([blob], name, { type: 'image/jpeg', lastModified: file.lastModified });
+            } catch (error) {
+                return file;
+            }
+        }
+        
+        async function reduceImages(files, onProgress) {
+            const result = new Array(files.length);
+            let index = 0;
+            let done = 0;
+            // Dos a la vez: cada foto decodificada ocupa decenas de MB
+            const worker = async () => {
+                while (index < files.length) {
+                    const i = index++;
+                    result[i] = await reduceImage(files[i]);
+                    onProgress(++done);
+                }
+            };
+            await Promise.all([worker(), worker()]);
+            return result;
+        }
+        
+        function sessionKey(file) {
+            return `pyshare-upload:${file.name}:${file.size}:${file.lastModified}`;
+        }
+        
+        async function getOrCreateSession(file) {
+            // Reanudar una sesión previa si el servidor aún la conserva
+            const savedId = localStorage.getItem(sessionKey(file));
+            if (savedId) {
+                try {
+                    return await sendRequest('GET', `/upload-session/${savedId}`);
+                } catch (error) {
+                    if (error instanceof RetryableError) throw error;
+                    localStorage.removeItem(sessionKey(file));
+                }
+            }
+            
+            const session = await sendRequest('POST', '/upload-session', {
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    filename: file.name, size: file.size, chunkSize: CHUNK_SIZE, sha256: fileHashes.get(file)
+                })
+            });
+            if (session.duplicate) return session;
+            localStorage.setItem(sessionKey(file), session.uploadId);
+            return session;
+        }
+        
+        async function uploadFileChunked(file, scheduler, tracker) {
+            const session = await scheduler.run(() => getOrCreateSession(file));
+            if (session.duplicate) {
+                // El servidor ya tiene este contenido
+                tracker.skip(file.size);
+                tracker.fileDone();
+                return [];
+            }
+            const { uploadId, chunkSize, totalChunks } = session;
+            const received = new Set(session.received);
+            
+            const chunks = [];
+            for (let i = 0; i < totalChunks; i++) {
+                const start = i * chunkSize;
+                const chunk = file.slice(start, Math.min(start + chunkSize, file.size));
+                if (received.has(i)) {
+                    tracker.skip(chunk.size);  // ya estaba en el servidor (reanudación)
+                    continue;
+                }
+                // Los chunks entran en la cola común y se envían en paralelo
+                chunks.push(scheduler.run(() => tracker.send('PUT', `/upload-session/${uploadId}/chunks/${i}`, {
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: chunk
+                }, chunk.size)));
+            }
+            await Promise.all(chunks);
+            
+            await scheduler.run(() => sendRequest('POST', `/upload-session/${uploadId}/complete`));
+            localStorage.removeItem(sessionKey(file));
+            tracker.fileDone();
+            return [];
+        }
+        
+        // Archivos pequeños agrupados en peticiones multipart de hasta BATCH_BYTES
+        function makeBatches(files) {
+            const batches = [];
+            let current = [];
+            let bytes = 0;
+            for (const file of files) {
+                if (current.length && (bytes + file.size > BATCH_BYTES || current.length >= BATCH_MAX_FILES)) {
+                    batches.push(current);
+                    current = [];
+                    bytes = 0;
+                }
+                current.push(file);
+                bytes += file.size;
+            }
+            if (current.length) batches.push(current);
+            return batches;
+        }
+        
+        async function uploadBatch(batch, scheduler, tracker) {
+            const bytes = batch.reduce((sum, file) => sum + file.size, 0);
+            const data = await scheduler.run(() => {
+                const formData = new FormData();
+                batch.forEach(file => formData.append('files', file));
+                return tracker.send('POST', '/upload-stream', { body: formData }, bytes);
+            });
+            tracker.fileDone(batch.length);
+            return data.errors || [];
+        }
+        
+        async function handleFiles(fileList) {
+            const files = Array.from(fileList);
+            if (!files.length) return;
+            
+            progressContainer.style.display = 'block';
+            status.className = 'status';
+            
+            const totalFiles = files.length;
+            // Un archivo demasiado grande abortaría todo su lote: se descarta antes de enviar
+            const errors = files.filter(file => file.size > UPLOAD_CONFIG.maxSize)
+                .map(file => `Archivo demasiado grande: ${file.name} (${formatBytes(file.size)})`);
+            let accepted = files.filter(file => file.size <= UPLOAD_CONFIG.maxSize);
+            
+            // Lo que el PC ya tiene no se vuelve a enviar
+            let skipped = 0;
+            if (skipKnownInput.checked && accepted.length && window.Worker) {
+                await hashFiles(accepted, done => {
+                    status.innerHTML = `Comprobando archivos: ${done}/${accepted.length}`;
+                    progressBar.style.width = (done / accepted.length) * 100 + '%';
+                });
+                const known = await checkKnownHashes([...new Set(accepted.map(file => fileHashes.get(file)).filter(Boolean))]);
+                const pending = accepted.filter(file => !known[fileHashes.get(file)]);
+                skipped = accepted.length - pending.length;
+                accepted = pending;
+            }
+            
+            if (reducedModeInput.checked && accepted.length) {
+                accepted = await reduceImages(accepted, done => {
+                    status.innerHTML = `Reduciendo fotos: ${done}/${accepted.length}`;
+                    progressBar.style.width = (done / accepted.length) * 100 + '%';
+                });
+            }
+            
+            const small = accepted.filter(file => file.size <= SMALL_FILE_LIMIT);
+            const large = accepted.filter(file => file.size > SMALL_FILE_LIMIT);
+            
+            const scheduler = new UploadScheduler(UPLOAD_CONFIG.concurrency);
+            const tracker = new ProgressTracker(accepted.reduce((sum, file) => sum + file.size, 0), accepted.length);
+            tracker.render();
+            
+            const results = await Promise.allSettled([
+                ...makeBatches(small).map(batch => uploadBatch(batch, scheduler, tracker)),
+                ...large.map(file => uploadFileChunked(file, scheduler, tracker))
+            ]);
+            const averageRate = tracker.stop();
+            
+            for (const result of results) {
+                if (result.status === 'fulfilled') errors.push(...result.value);
+                else errors.push(result.reason.message);
+            }
+            
+            const uploadedFiles = totalFiles - skipped;
+            if (!errors.length) {
+                status.className = 'status success';
+                status.innerHTML = `${uploadedFiles} archivo${uploadedFiles !== 1 ? 's subidos' : ' subido'} correctamente` +
+                    (uploadedFiles ? ` (${formatBytes(averageRate)}/s)` : '') +
+                    (skipped ? `, ${skipped} ya estaba${skipped > 1 ? 'n' : ''} en el PC` : '');
+            } else {
+                status.className = 'status error';
+                status.innerHTML = `${errors.length} error${errors.length > 1 ? 'es' : ''}: ${errors[0]}`;
+            }
+            loadFiles();
+            
+            setTimeout(() => {
+                progressContainer.style.display = 'none';
+                progressBar.style.width = '0%';
+            }, 2000);
+        }
+        
+        const PAGE_SIZE = 50;
+        const fileList = document.getElementById('fileList');
+        const sentinel = document.getElementById('fileListSentinel');
+        let nextCursor = null;
+        let loadingPage = false;
+        let listGeneration = 0;
+        let listEtag = null;
+        let shownCursor = null;  // cursor de la lista mostrada, por si la recarga responde 304
+        
+        const THUMB_TYPES = ['jpg', 'jpeg', 'png', 'webp', 'tiff', 'bmp'];
+        const CONVERTIBLE_TYPES = ['heic', 'heif'];
+        
+        function renderFileItem(file) {
+            const ext = file.original_name.split('.').pop().toLowerCase();
+            const thumb = THUMB_TYPES.includes(ext)
+                ? `<img class="thumb" loading="lazy" width="48" height="48" alt=""
+                        src="/thumbs/${encodeURIComponent(file.original_name)}?size=128&v=${file.modified}">`
+                : '';
+            // HEIC guardado sin convertir: el servidor lo convierte al descargarlo
+            const converted = CONVERTIBLE_TYPES.includes(ext)
+                ? `<a href="/uploads/${encodeURIComponent(file.original_name)}?convert=1" download class="download-link">
+                        Convertida
+                    </a>`
+                : '';
+            return `
+                <div class="file-item">
+                    ${thumb}
+                    <div>
+                        <div class="file-name">${file.name}</div>
+                    </div>
+                    <div>
+                        <span class="file-size">${file.size_formatted}</span>
+                        <a href="/uploads/${encodeURIComponent(file.original_name)}" download class="download-link">
+                            Descargar
+                        </a>
+                        ${converted}
+                    </div>
+                </div>
+            `;
+        }
+        
+        async function loadPage(generation) {
+            if (loadingPage) return;
+            loadingPage = true;
+            
+            try {
+                const params = new URLSearchParams({ limit: PAGE_SIZE });
+                if (nextCursor) params.set('cursor', nextCursor);
+                
+                const headers = {};
+                if (!nextCursor && listEtag) headers['If-None-Match'] = listEtag;
+                
+                const response = await fetch(`/api/files?${params}`, { headers });
+                if (generation !== listGeneration) return;
+                if (response.status === 304) {
+                    // Nada cambió desde la última carga: la lista mostrada y su cursor siguen valiendo
+                    nextCursor = shownCursor;
+                } else {
+                    const data = await response.json();
+                    if (!nextCursor) {
+                        listEtag = response.headers.get('ETag');
+                        fileList.innerHTML = data.files.length
+                            ? `<div class="file-list-title">Archivos disponibles
+                                   <a href="/download-batch?format=zip" class="download-link">Descargar todo (ZIP)</a></div>`
+                            : '';
+                    }
+                    
+                    // Añadir solo la página nueva en vez de reconstruir toda la lista
+                    fileList.insertAdjacentHTML('beforeend', data.files.map(renderFileItem).join(''));
+                    nextCursor = data.next_cursor;
+                }
+            } catch (error) {
+                console.error('Error loading files:', error);
+            } finally {
+                loadingPage = false;
+            }
+            
+            // Si el centinela sigue visible, seguir cargando
+            if (generation === listGeneration && nextCursor && isSentinelVisible()) {
+                loadPage(generation);
+            }
+        }
+        
+        function isSentinelVisible() {
+            const rect = sentinel.getBoundingClientRect();
+            return rect.top < window.innerHeight + 200;
+        }
+        
+        function loadFiles() {
+            listGeneration++;
+            shownCursor = nextCursor;
+            nextCursor = null;
+            loadingPage = false;
+            loadPage(listGeneration);
+        }
+        
+        // Scroll infinito
+        if ('IntersectionObserver' in window) {
+            new IntersectionObserver(entries => {
+                if (entries[0].isIntersecting && nextCursor) loadPage(listGeneration);
+            }, { rootMargin: '200px' }).observe(sentinel);
+        } else {
+            window.addEventListener('scroll', () => {
+                if (nextCursor && isSentinelVisible()) loadPage(listGeneration);
+            });
+        }
+        
+        // Load files on page load
+        loadFiles();
+    </script>
+</body>
+</html>
+            '''.replace('__UPLOAD_CONFIG__', json.dumps(self.client_upload_config()))
+        
+        
+        @self.app.route('/upload-multiple', methods=['POST'])
+        @self.rate_limit
+        @self.admit_upload
+        def upload_multiple():
+            try:
+                files = request.files.getlist('files')
+                if not files:
+                    return jsonify({'error': 'No se recibieron archivos'}), 400
+                
+                uploaded = []
+                errors = []
+                
+                # Cada archivo es un trabajo del planificador de E/S compartido
+                def process_file(file):
+                    try:
+                        # Validar archivo
+                        with METRICS.timed('validate'):
+                            is_valid, message = self.file_manager.validate_file(file)
+                        if not is_valid:
+                            return None, message
+                        
+                        # Obtener nombre único
+                        filename = self.file_manager.get_unique_filename(file.filename)
+                        
+                        # Guardar archivo calculando su hash al vuelo
+                        hasher = hashlib.sha256()
+                        with METRICS.timed('save'):
+                            success, message = self.file_manager.save_file(file, filename, hasher=hasher)
+                        if not success:
+                            return None, message
+                        
+                        filepath = self.file_manager.path_for(filename)
+                        return self.finish_upload(filepath, digest=hasher.hexdigest()).name, None
+                        
+                    except Exception as e:
+                        return None, f"Error procesando archivo: {str(e)}"
+                
+                # Los archivos de la petición entran en la cola de este cliente
+                futures = self.io_scheduler.submit_many(
+                    request.remote_addr, [(process_file, (file,)) for file in files]
+                )
+                for future in futures:
+                    result, error = future.result()
+                    if result:
+                        uploaded.append(result)
+                    elif error:
+                        errors.append(error)
+                
+                self.update_stats()
+                
+                response_data = {
+                    'message': f'{len(uploaded)} archivos subidos correctamente',
+                    'files': uploaded
+                }
+                
+                if errors:
+                    response_data['errors'] = errors
+                    response_data['message'] += f', {len(errors)} errores'
+                
+                return jsonify(response_data)
+                
+            except UploadBusy:
+                raise
+            except Exception as e:
+                self.logger.error(f"Error en upload_multiple: {e}")
+                return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+        
+        @self.app.route('/upload-chunk', methods=['POST'])
+        @self.rate_limit
+        @self.admit_upload
+        def upload_chunk():
+            """Upload por chunks para archivos grandes (protocolo antiguo, sobre sesiones)"""
+            try:
+                chunk = request.files.get('chunk')
+                filename = request.form.get('filename')
+                chunk_index = int(request.form.get('chunkIndex', 0))
+                total_chunks = int(request.form.get('totalChunks', 1))
+                
+                if not chunk or not filename:
+                    return jsonify({'error': 'Datos incompletos'}), 400
+                
+                filename = secure_filename(filename)
+                if not self.file_manager.is_allowed_extension(filename):
+                    return jsonify({'error': f"Extensión no permitida: {filename.split('.')[-1]}"}), 400
+                
+                # Sesión implícita por cliente + archivo: los chunks pueden llegar en cualquier orden
+                key = f"{request.remote_addr}:{filename}:{total_chunks}"
+                upload_id = hashlib.sha1(key.encode('utf-8')).hexdigest()
+                self.upload_sessions.create(
+                    filename, None, None, upload_id=upload_id,
+                    client=request.remote_addr, total_chunks=total_chunks
+                )
+                # Tamaño del chunk (ya recibido por Werkzeug) para calcular su offset
+                chunk.stream.seek(0, 2)
+                chunk_length = chunk.stream.tell()
+                chunk.stream.seek(0)
+                
+                session = self.upload_sessions.write_chunk(
+                    upload_id, chunk_index, chunk.stream, length=chunk_length,
+                    max_size=self.file_manager.max_size
+                )
+                
+                # Ensamblar solo cuando han llegado todos los chunks
+                if len(session['received']) == total_chunks:
+                    try:
+                        final_filename = self.finalize_session(upload_id)
+                    except UploadSessionError as e:
+                        if e.status in (404, 409) and session.get('finalized'):
+                            # Otro chunk concurrente ya está ensamblando
+                            return jsonify({'message': f'Chunk {chunk_index + 1}/{total_chunks} recibido'})
+                        raise
+                    return jsonify({'message': 'Archivo subido correctamente', 'filename': final_filename})
+                
+                return jsonify({'message': f'Chunk {chunk_index + 1}/{total_chunks} recibido'})
+                
+            except UploadSessionError as e:
+                return jsonify({'error': str(e)}), e.status
+            except Exception as e:
+                self.logger.error(f"Error en upload_chunk: {e}")
+                return jsonify({'error': f'Error procesando chunk: {str(e)}'}), 500
+        
+        @self.app.route('/api/hashes/check', methods=['POST'])
+        @self.rate_limit
+        def check_hashes():
+            """Indica qué hashes SHA-256 ya están guardados para no volver a subirlos"""
+            data = request.get_json(silent=True) or {}
+            hashes = data.get('hashes')
+            if not isinstance(hashes, list) or len(hashes) > 10000:
+                return jsonify({'error': 'Se esperaba una lista "hashes" (máximo 10000)'}), 400
+            
+            digests = [h.lower() for h in hashes if isinstance(h, str) and len(h) == 64]
+            return jsonify({'known': self.dedup.known(digests)})
+        
+        @self.app.route('/api/conversions')
+        def conversions_status():
+            """Estado de las conversiones HEIC recientes"""
+            return jsonify({'conversions': self.conversions.summary()})
+        
+        @self.app.route('/api/conversions/<filename>')
+        def conversion_status(filename):
+            """Estado de la conversión de un archivo"""
+            status = self.conversions.get_status(secure_filename(filename))
+            if status is None:
+                return jsonify({'error': 'Sin conversión para ese archivo'}), 404
+            return jsonify(status)
+        
+        @self.app.route('/upload-stream/<filename>', methods=['PUT'])
+        @self.rate_limit
+        @self.admit_upload
+        def upload_stream_raw(filename):
+            """Subida de un archivo como cuerpo crudo, escrita directamente en uploads/"""
+            filename = secure_filename(filename)
+            is_valid, message = self.file_manager.validate_name(filename)
+            if not is_valid:
+                return jsonify({'error': message}), 400
+            if request.content_length is not None and request.content_length > self.file_manager.max_size:
+                return jsonify({'error': f"Archivo demasiado grande: {self.file_manager.format_size(request.content_length)}"}), 413
+            
+            try:
+                filepath, digest = self.file_manager.save_stream(request.stream, filename, self.STREAM_BUFFER_SIZE)
+                final_filename = self.finish_upload(filepath, digest=digest).name
+                self.update_stats()
+                return jsonify({'message': 'Archivo subido correctamente', 'filename': final_filename})
+            except UploadTooLarge as e:
+                return jsonify({'error': str(e)}), 413
+            except Exception as e:
+                self.logger.error(f"Error en upload_stream_raw: {e}")
+                return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+        
+        @self.app.route('/upload-stream', methods=['POST'])
+        @self.rate_limit
+        @self.admit_upload
+        def upload_stream_multipart():
+            """Multipart procesado de forma incremental: cada archivo va directo a uploads/"""
+            boundary = request.mimetype_params.get('boundary')
+            if request.mimetype != 'multipart/form-data' or not boundary:
+                return jsonify({'error': 'Se esperaba multipart/form-data'}), 400
+            
+            try:
+                uploaded, errors = self.ingest_multipart(request.stream, boundary)
+            except UploadTooLarge as e:
+                return jsonify({'error': str(e)}), 413
+            except UploadIncomplete as e:
+                return jsonify({'error': str(e)}), 400
+            except Exception as e:
+                self.logger.error(f"Error en upload_stream_multipart: {e}")
+                return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+            
+            if not uploaded and not errors:
+                return jsonify({'error': 'No se recibieron archivos'}), 400
+            
+            self.update_stats()
+            response_data = {
+                'message': f'{len(uploaded)} archivos subidos correctamente',
+                'files': uploaded
+            }
+            if errors:
+                response_data['errors'] = errors
+                response_data['message'] += f', {len(errors)} errores'
+            return jsonify(response_data)
+        
+        @self.app.route('/upload-session', methods=['POST'])
+        @self.rate_limit
+        def create_upload_session():
+            """Crea una sesión de subida reanudable"""
+            try:
+                data = request.get_json(silent=True) or {}
+                filename = secure_filename(data.get('filename') or '')
+                size = int(data.get('size', -1))
+                chunk_size = int(data.get('chunkSize', 0))
+                
+                if not filename or size < 0:
+                    return jsonify({'error': 'Datos incompletos'}), 400
+                if not self.file_manager.is_allowed_extension(filename):
+                    return jsonify({'error': f"Extensión no permitida: {filename.split('.')[-1]}"}), 400
+                if size > self.file_manager.max_size:
+                    return jsonify({'error': f"Archivo demasiado grande: {self.file_manager.format_size(size)}"}), 413
+                if chunk_size > self.app.config['MAX_CONTENT_LENGTH']:
+                    return jsonify({'error': 'Chunk demasiado grande'}), 400
+                
+                # Si el cliente ya conoce el hash y el contenido existe, no hace falta subir nada
+                digest = (data.get('sha256') or '').lower()
+                if digest and self.dedup.enabled:
+                    existing = self.dedup.lookup(digest)
+                    if existing is not None:
+                        return jsonify({'duplicate': True, 'filename': existing})
+                
+                session = self.upload_sessions.create(filename, size, chunk_size, client=request.remote_addr)
+                return jsonify(self.upload_sessions.status(session)), 201
+                
+            except UploadSessionError as e:
+                return jsonify({'error': str(e)}), e.status
+            except (TypeError, ValueError):
+                return jsonify({'error': 'Parámetros no válidos'}), 400
+        
+        @self.app.route('/upload-session/<upload_id>', methods=['GET'])
+        def upload_session_status(upload_id):
+            """Chunks ya recibidos, para reanudar una subida interrumpida"""
+            try:
+                session = self.upload_sessions.get(upload_id)
+                return jsonify(self.upload_sessions.status(session))
+            except UploadSessionError as e:
+                return jsonify({'error': str(e)}), e.status
+        
+        @self.app.route('/upload-session/<upload_id>/chunks/<int:index>', methods=['PUT'])
+        @self.rate_limit
+        @self.admit_upload
+        def upload_session_chunk(upload_id, index):
+            """Recibe un chunk (cuerpo binario) en cualquier orden"""
+            try:
+                session = self.upload_sessions.write_chunk(
+                    upload_id, index, request.stream, length=request.content_length
+                )
+                return jsonify({'index': index, 'received': len(session['received']),
+                                'totalChunks': session['total_chunks']})
+            except UploadSessionError as e:
+                return jsonify({'error': str(e)}), e.status
+            except Exception as e:
+                self.logger.error(f"Error en upload_session_chunk: {e}")
+                return jsonify({'error': f'Error procesando chunk: {str(e)}'}), 500
+        
+        @self.app.route('/upload-session/<upload_id>/complete', methods=['POST'])
+        @self.rate_limit
+        def complete_upload_session(upload_id):
+            """Ensambla el archivo cuando están todos los chunks"""
+            try:
+                final_filename = self.finalize_session(upload_id)
+                return jsonify({'message': 'Archivo subido correctamente', 'filename': final_filename})
+            except UploadSessionError as e:
+                response = {'error': str(e)}
+                if e.status == 409:
+                    try:
+                        response['missing'] = self.upload_sessions.missing(self.upload_sessions.get(upload_id))
+                    except UploadSessionError:
+                        pass
+                return jsonify(response), e.status
+            except Exception as e:
+                self.logger.error(f"Error en complete_upload_session: {e}")
+                return jsonify({'error': f'Error finalizando subida: {str(e)}'}), 500
+        
+        @self.app.route('/upload-session/<upload_id>', methods=['DELETE'])
+        def abort_upload_session(upload_id):
+            """Cancela una sesión y borra sus chunks"""
+            try:
+                self.upload_sessions.get(upload_id)
+                self.upload_sessions.discard(upload_id)
+                return jsonify({'message': 'Sesión cancelada'})
+            except UploadSessionError as e:
+                return jsonify({'error': str(e)}), e.status
+
+        @self.app.route('/thumbs/<filename>')
+        def thumbnail(filename):
+            """Miniatura cacheada de una foto (?size=128|256|512|1024)"""
+            if filename != secure_filename(filename) or not self.thumbnails.supports(filename):
+                return jsonify({'error': 'Miniatura no disponible'}), 404
+            if not self.file_manager.path_for(filename).is_file():
+                return jsonify({'error': 'Archivo no encontrado'}), 404
+            
+            size = request.args.get('size', ThumbnailCache.DEFAULT_SIZE, type=int)
+            try:
+                thumb_path = self.thumbnails.get(filename, size)
+            except Exception as e:
+                self.logger.warning(f"Error generando miniatura de {filename}: {e}")
+                return jsonify({'error': 'No se pudo generar la miniatura'}), 415
+            
+            response = send_file(thumb_path, mimetype='image/jpeg', etag=thumb_path.stem, conditional=True)
+            # La página añade ?v=<mtime>, así que la URL identifica el contenido
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+            return response
+        
+        @self.app.route('/download-batch', methods=['GET', 'POST'])
+        @self.rate_limit
+        def download_batch():
+            """
+            Varios archivos en un ZIP (sin compresión) o TAR generado al vuelo.
+            
+            Selección: names (lista, o separados por comas en la URL) o, si no
+            hay, los filtros de /api/files (type, since, until); sin nada, todos.
+            """
+            params = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+            try:
+                fmt = params.get('format', 'zip')
+                if fmt not in BatchArchive.FORMATS:
+                    raise ValueError(f"Formato no válido: {fmt}")
+                
+                names = params.get('names')
+                if isinstance(names, str):
+                    names = [n for n in names.split(',') if n]
+                if request.method == 'GET':
+                    names = (names or []) + request.args.getlist('name')
+                if names:
+                    names = list(dict.fromkeys(n for n in names if secure_filename(n) == n))
+                else:
+                    file_type = params.get('type') or None
+                    if file_type and file_type not in ('photo', 'video'):
+                        raise ValueError(f"Tipo no válido: {file_type}")
+                    entries, _, _ = self.catalog.query(
+                        sort='mtime', order='asc', file_type=file_type,
+                        since=parse_date_arg(params.get('since')),
+                        until=parse_date_arg(params.get('until'), end_of_day=True)
+                    )
+                    names = [e['original_name'] for e in entries]
+            except (TypeError, ValueError) as e:
+                return jsonify({'error': str(e)}), 400
+            
+            archive = BatchArchive(self.file_manager.path_for, names, fmt)
+            if not len(archive):
+                return jsonify({'error': 'No hay archivos que descargar'}), 404
+            
+            response = self.app.response_class(status=200, mimetype=archive.content_type)
+            response.set_etag(archive.etag)
+            response.last_modified = int(archive.last_modified)
+            response.headers['Cache-Control'] = 'no-cache'
+            stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+            response.headers.set('Content-Disposition', 'attachment', filename=f'pyshare-{stamp}.{fmt}')
+            
+            offset, count = 0, archive.size
+            if archive.supports_ranges:
+                response.headers['Accept-Ranges'] = 'bytes'
+                span = self._apply_range(response, archive.size, archive.etag, archive.last_modified)
+                if span is None:
+                    return response
+                offset, count = span
+            else:
+                response.headers['Accept-Ranges'] = 'none'
+            
+            response.response = archive.stream(offset, offset + count)
+            response.content_length = count
+            self.log(f"Descarga en lote: {len(archive)} archivos ({fmt}, {self.file_manager.format_size(count)})")
+            return response
+        
+        @self.app.route('/uploads/<filename>')
+        def download_file(filename):
+            return self.send_upload(filename)
+    
+    
+    IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+    
+    def send_upload(self, filename):
+        """
+        Descarga de un archivo de uploads/ con sendfile, Range/If-Range y caché
+        condicional (ETag/If-None-Match, Last-Modified/If-Modified-Since).
+        
+        El ETag es el SHA-256 si el índice de deduplicación lo conoce. Con
+        ?v=<prefijo del hash> la URL queda ligada al contenido y se sirve como
+        immutable; sin él el navegador revalida, y un 304 no cuesta el archivo.
+        
+        Con ?convert=1 un HEIC se descarga convertido (formato de conversion_format),
+        generando la conversión la primera vez.
+        """
+        # Los ocultos (bases SQLite, subidas a medio escribir) no se publican
+        if filename.startswith('.') or safe_join(str(self.file_manager.upload_folder), filename) is None:
+            abort(404)
+        # La URL solo lleva el nombre: la subcarpeta la resuelve el gestor
+        path = self.file_manager.path_for(filename)
+        upload_folder = self.file_manager.upload_folder
+        if safe_join(str(upload_folder), path.relative_to(upload_folder).as_posix()) is None:
+            abort(404)
+        converted = bool(request.args.get('convert')) and self.converted.supports(filename)
+        if converted:
+            if not path.is_file():
+                abort(404)
+            try:
+                path = self.converted.get(filename)
+            except Exception as e:
+                self.logger.error(f"Error convirtiendo {filename} para descargar: {e}")
+                return jsonify({'error': 'No se pudo convertir el archivo'}), 500
+            filename = self.converted.download_name(filename)
+        try:
+            f = open(path, 'rb')
+            st = os.fstat(f.fileno())
+        except OSError:
+            abort(404)
+        if not stat.S_ISREG(st.st_mode):
+            f.close()
+            abort(404)
+        
+        try:
+            size = st.st_size
+            digest = None if converted else self.dedup.digest_of(filename, st)
+            etag = digest or f"{st.st_size:x}-{st.st_mtime_ns:x}"
+            version = request.args.get('v')
+            immutable = digest is not None and version is not None and len(version) >= 8 and digest.startswith(version)
+            
+            response = self.app.response_class(status=200, mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+            response.set_etag(etag)
+            response.last_modified = int(st.st_mtime)
+            response.headers['Accept-Ranges'] = 'bytes'
+            response.headers['Cache-Control'] = (f'public, max-age={self.IMMUTABLE_MAX_AGE}, immutable'
+                                                 if immutable else 'no-cache')
+            try:
+                filename.encode('ascii')
+                response.headers.set('Content-Disposition', 'attachment', filename=filename)
+            except UnicodeEncodeError:
+                response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{url_quote(filename)}"
+            
+            # Caché condicional: If-None-Match manda sobre If-Modified-Since
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                not_modified = request.if_modified_since is not None and int(st.st_mtime) <= request.if_modified_since.timestamp()
+            if not_modified:
+                f.close()
+                response.status_code = 304
+                return response
+            
+            span = self._apply_range(response, size, etag, st.st_mtime)
+            if span is None:
+                f.close()
+                return response
+            offset, count = span
+            
+            response.response = SendfileWrapper(f, offset=offset, count=count)
+            response.direct_passthrough = True
+            response.content_length = count
+            return response
+        except BaseException:
+            f.close()
+            raise
+    
+    @staticmethod
+    def _apply_range(response, size, etag, mtime):
+        """
+        Aplica la cabecera Range de la petición (un solo tramo) a la respuesta.
+        
+        Devuelve (offset, count) a enviar, o None si el tramo no es satisfacible
+        (la respuesta queda como 416). If-Range que no coincide: se envía entero.
+        """
+        byte_range = request.range
+        if byte_range is None or byte_range.units != 'bytes' or len(byte_range.ranges) != 1:
+            return 0, size
+        
+        if_range = request.if_range
+        if if_range.etag is not None and if_range.etag != etag:
+            return 0, size
+        if if_range.date is not None and int(mtime) > if_range.date.timestamp():
+            return 0, size
+        
+        span = byte_range.range_for_length(size)
+        if span is None:
+            response.status_code = 416
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return None
+        start, end = span
+        response.status_code = 206
+        response.headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+        return start, end - start
+    
+    def get_local_ip(self):
+        """Obtiene IP local de forma optimizada con cache"""
+        if not hasattr(self, '_cached_ip'):
+            try:
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                    s.connect(("8.8.8.8", 80))
+                    self._cached_ip = s.getsockname()[0]
+            except Exception:
+                self._cached_ip = "127.0.0.1"
+        return self._cached_ip
+    
+    @METRICS.timed('finish')
+    def finish_upload(self, filepath, digest=None, hash_in_background=False):
+        """
+        Post-proceso común de una subida: deduplicación, catálogo, contador y conversión HEIC.
+        
+        Con hash_in_background y sin digest, el archivo no se lee en la petición:
+        se guarda sin deduplicar y su hash se indexa después.
+        """
+        filepath = self.file_manager.place_by_capture(filepath)
+        if self.dedup.enabled and digest is None and hash_in_background:
+            self.dedup.index_missing([filepath.name])
+        elif self.dedup.enabled:
+            if digest is None:
+                digest = DedupIndex.hash_file(filepath)
+            existing = self.dedup.deduplicate(digest, filepath)
+            if existing is not None:
+                self.catalog.add(existing)
+                self.record_upload()
+                return existing
+        
+        if digest is not None:
+            self.dedup.add(digest, filepath)
+        self.catalog.add(filepath)
+        self.record_upload()
+        if self.metadata:
+            self.metadata.notify()
+        
+        # La conversión HEIC no bloquea la respuesta
+        if self.conversions.needs_conversion(filepath):
+            self.conversions.submit(filepath, digest)
+        else:
+            self.thumbnails.prefetch(filepath.name)
+        return filepath
+    
+    def on_converted(self, source, target, digest):
+        """Sustituye el HEIC por el JPG convertido en catálogo e índice de hashes"""
+        self.catalog.remove(source.name)
+        self.dedup.remove(source.name)
+        if digest is not None:
+            # Se indexa el hash del original: resubir el mismo HEIC encuentra el JPG
+            self.dedup.add(digest, target)
+        self.catalog.add(target)
+        if self.metadata:
+            self.metadata.notify()
+        self.thumbnails.prefetch(target.name)
+        self.update_stats()
+    
+    def ingest_multipart(self, stream, boundary):
+        """
+        Lee un cuerpo multipart por bloques y escribe cada archivo en cuanto llega.
+        
+        Los archivos no válidos se descartan sin guardarse; superar max_size aborta
+        la petición completa. Si el cuerpo se corta antes del boundary final se
+        lanza UploadIncomplete y el archivo a medias se borra.
+        """
+        decoder = MultipartDecoder(boundary.encode('latin-1'))
+        uploaded = []
+        errors = []
+        writer = None
+        skipping = False
+        eof = False
+        
+        try:
+            while True:
+                try:
+                    event = decoder.next_event()
+                except ValueError:
+                    # El decodificador no admite el fin de datos en mitad de una parte
+                    if eof:
+                        raise UploadIncomplete("Cuerpo multipart incompleto")
+                    raise
+                if event is NEED_DATA:
+                    if eof:
+                        raise UploadIncomplete("Cuerpo multipart incompleto")
+                    try:
+                        data = stream.read(self.STREAM_BUFFER_SIZE)
+                    except ClientDisconnected:
+                        raise UploadIncomplete("Cuerpo multipart incompleto")
+                    eof = not data
+                    decoder.receive_data(data or None)
+                elif isinstance(event, File):
+                    filename = secure_filename(event.filename or '')
+                    is_valid, message = self.file_manager.validate_name(filename)
+                    if is_valid:
+                        writer = UploadWriter(self.file_manager, filename)
+                        skipping = False
+                    else:
+                        errors.append(message)
+                        skipping = True
+                elif isinstance(event, Data):
+                    if writer is not None:
+                        writer.write(event.data)
+                        if not event.more_data:
+                            filepath = writer.commit()
+                            digest = writer.digest
+                            writer = None
+                            uploaded.append(self.finish_upload(filepath, digest=digest).name)
+                    elif skipping and not event.more_data:
+                        skipping = False
+                elif isinstance(event, Epilogue):
+                    break
+        except Exception:
+            if writer is not None:
+                writer.abort()
+            raise
+        
+        return uploaded, errors
+    
+    def finalize_session(self, upload_id):
+        """Ensambla una sesión de chunks en uploads/ y devuelve el nombre final"""
+        session = self.upload_sessions.get(upload_id)
+        missing = self.upload_sessions.missing(session)
+        if missing:
+            # Antes de reservar nombre, para no consumir sufijos en intentos fallidos
+            raise UploadSessionError(f"Faltan {len(missing)} chunks", 409)
+        filename = self.file_manager.get_unique_filename(session['filename'])
+        final_path = self.file_manager.path_for(filename)
+        try:
+            session = self.upload_sessions.assemble(upload_id, final_path)
+        except Exception:
+            self.file_manager.release_filename(filename)
+            raise
+        
+        # El hash se calculó mientras llegaban los chunks; sin él se indexa en segundo plano
+        converted_path = self.finish_upload(
+            final_path, digest=self.upload_sessions.digest(session), hash_in_background=True
+        )
+        self.update_stats()
+        return converted_path.name
+    
+    def record_upload(self):
+        """Cuenta una subida completada"""
+        with self.stats_lock:
+            self.stats['uploads'] += 1
+    
+    @METRICS.timed('update_stats')
+    def update_stats(self):
+        """Actualiza estadísticas desde los contadores incrementales del catálogo"""
+        try:
+            photos, size = self.catalog.totals()
+            with self.stats_lock:
+                self.stats['photos'] = photos
+                self.stats['size'] = size
+            
+            self.on_stats_changed()
+                
+        except Exception as e:
+            self.logger.error(f"Error actualizando estadísticas: {e}")
+    
+    def refresh_stats(self):
+        """Reconciliación completa con el disco (botón Actualizar)"""
+        self.catalog.reconcile(full=True)
+        self.update_stats()
+    
+    def on_stats_changed(self):
+        """Punto de extensión: la GUI refresca aquí sus contadores"""
+    
+    def log(self, message):
+        """Registra un mensaje del servidor"""
+        self.logger.info(message)
+    
+    def run_server(self):
+        """Ejecuta el servidor HTTP bloqueando el hilo actual"""
+        self.server.start()
+        self.is_running = True
+        self.server_thread = self.server.thread
+        self.server_thread.join()
+    
+    def serve(self):
+        """Modo sin interfaz: sirve hasta Ctrl+C o SIGTERM y luego para con orden"""
+        stop = threading.Event()
+        
+        def request_stop(signum, frame):
+            stop.set()
+        
+        signal.signal(signal.SIGINT, request_stop)
+        if hasattr(signal, 'SIGTERM'):
+            signal.signal(signal.SIGTERM, request_stop)
+        
+        self.server.start()
+        self.is_running = True
+        self.log(f"Servidor escuchando en http://{self.get_local_ip()}:{self.PORT} "
+                 f"({self.server.backend}, {self.server.threads} hilos), carpeta {self.file_manager.upload_folder}")
+        try:
+            while not stop.wait(1):
+                if not self.server.is_running:
+                    break
+        finally:
+            self.shutdown()
+    
+    def shutdown(self):
+        """Detiene el servidor HTTP y los componentes en segundo plano"""
+        if self.is_running:
+            self.server.stop()
+            self.is_running = False
+        self.catalog.stop()
+        if self.metadata:
+            self.metadata.stop()
+        self.dedup.stop()
+        self.conversions.stop()
+        self.thumbnails.stop()
+        self.io_scheduler.stop()
+        ACCESS_LOG.flush()